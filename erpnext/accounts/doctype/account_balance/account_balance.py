@@ -0,0 +1,210 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, add_months, cstr, flt, get_first_day, get_last_day, getdate, now
+
+BALANCE_FIELDS = ["debit", "credit", "debit_in_account_currency", "credit_in_account_currency"]
+
+
+class AccountBalance(Document):
+	pass
+
+
+def update_account_balance(gl_entries, sign=1):
+	"""
+		Add the amounts of the (not cancelled) GL entries to the balance of their
+		(account, party, cost center, month), subtract them if sign is -1
+	"""
+	balances = {}
+	for gle in gl_entries:
+		if gle.get("is_cancelled"):
+			continue
+
+		balance = balances.setdefault(get_balance_key(gle), frappe._dict({
+			fieldname: 0.0 for fieldname in BALANCE_FIELDS
+		}))
+		for fieldname in BALANCE_FIELDS:
+			balance[fieldname] += sign * flt(gle.get(fieldname))
+
+	if balances:
+		apply_balance_changes(balances)
+
+def update_account_balance_for_voucher(voucher_type, voucher_no, sign=-1):
+	"""Subtract the amounts of the GL entries of a voucher, before they are cancelled or deleted"""
+	gl_entries = frappe.db.sql("""
+		select
+			company, account, party_type, party, cost_center, posting_date, voucher_type,
+			debit, credit, debit_in_account_currency, credit_in_account_currency
+		from `tabGL Entry`
+		where voucher_type = %s and voucher_no = %s and is_cancelled = 0
+	""", (voucher_type, voucher_no), as_dict=1)
+
+	update_account_balance(gl_entries, sign)
+
+def get_balance_key(gle):
+	return (gle.company, gle.account, cstr(gle.party_type), cstr(gle.party), cstr(gle.cost_center),
+		get_first_day(gle.posting_date), 1 if gle.voucher_type == "Period Closing Voucher" else 0)
+
+def apply_balance_changes(balances):
+	accounts = list({key[1] for key in balances})
+	periods = list({key[5] for key in balances})
+
+	existing = {}
+	for d in frappe.db.sql("""
+		select name, company, account, party_type, party, cost_center, period_start, is_period_closing_voucher
+		from `tabAccount Balance`
+		where account in %s and period_start in %s""", (accounts, periods), as_dict=1):
+		existing.setdefault((d.company, d.account, cstr(d.party_type), cstr(d.party), cstr(d.cost_center),
+			getdate(d.period_start), d.is_period_closing_voucher), d.name)
+
+	values = []
+	timestamp = now()
+	for key, balance in balances.items():
+		if key in existing:
+			frappe.db.sql("""
+				update `tabAccount Balance`
+				set debit = debit + %s, credit = credit + %s,
+					debit_in_account_currency = debit_in_account_currency + %s,
+					credit_in_account_currency = credit_in_account_currency + %s
+				where name = %s""", tuple(balance[fieldname] for fieldname in BALANCE_FIELDS) + (existing[key],))
+		else:
+			values.append(make_balance_row(key, balance, timestamp))
+
+	insert_balance_rows(values)
+
+def make_balance_row(key, balance, timestamp):
+	company, account, party_type, party, cost_center, period_start, is_period_closing_voucher = key
+
+	return (frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user, frappe.session.user,
+		company, account, party_type or None, party or None, cost_center or None, period_start,
+		is_period_closing_voucher) + tuple(balance[fieldname] for fieldname in BALANCE_FIELDS)
+
+def insert_balance_rows(values):
+	if values:
+		frappe.db.bulk_insert("Account Balance", fields=["name", "creation", "modified", "owner",
+			"modified_by", "company", "account", "party_type", "party", "cost_center", "period_start",
+			"is_period_closing_voucher"] + BALANCE_FIELDS, values=values)
+
+def get_balance_periods(from_date, to_date):
+	"""
+		Split the date range into the whole months answered from the account balance
+		and the partial months to be read from the GL
+
+		Returns ((first_period, last_period), [(gl_from_date, gl_to_date)]), the periods are None
+		if there is no whole month in the range. Open ends are left open.
+	"""
+	from_date = getdate(from_date) if from_date else None
+	to_date = getdate(to_date) if to_date else None
+
+	first_period = from_date and get_first_day(from_date)
+	if from_date and from_date != first_period:
+		first_period = get_first_day(add_months(from_date, 1))
+
+	last_period = to_date and get_first_day(to_date)
+	if to_date and to_date != get_last_day(to_date):
+		last_period = get_first_day(add_months(to_date, -1))
+
+	if first_period and last_period and first_period > last_period:
+		return None, [(from_date, to_date)]
+
+	gl_ranges = []
+	if from_date and from_date != first_period:
+		gl_ranges.append((from_date, add_days(first_period, -1)))
+	if to_date and to_date != get_last_day(last_period):
+		gl_ranges.append((add_months(last_period, 1), to_date))
+
+	return (first_period, last_period), gl_ranges
+
+def rebuild_account_balance(company=None):
+	"""Rebuild the account balance of the company (all companies by default) from the GL"""
+	companies = [company] if company else frappe.get_all("Company", pluck="name")
+
+	for company in companies:
+		frappe.db.sql("delete from `tabAccount Balance` where company = %s", company)
+
+		values = []
+		timestamp = now()
+		for key, balance in get_balances_from_gl(company).items():
+			values.append(make_balance_row(key, balance, timestamp))
+
+		insert_balance_rows(values)
+		frappe.db.commit()
+
+def get_balances_from_gl(company):
+	balances = {}
+	for d in frappe.db.sql("""
+		select
+			account, party_type, party, cost_center,
+			year(posting_date) as year, month(posting_date) as month,
+			if(voucher_type = 'Period Closing Voucher', 1, 0) as is_period_closing_voucher,
+			sum(debit) as debit, sum(credit) as credit,
+			sum(debit_in_account_currency) as debit_in_account_currency,
+			sum(credit_in_account_currency) as credit_in_account_currency
+		from `tabGL Entry`
+		where company = %s and is_cancelled = 0
+		group by account, party_type, party, cost_center, year, month, is_period_closing_voucher
+	""", company, as_dict=1):
+		key = (company, d.account, cstr(d.party_type), cstr(d.party), cstr(d.cost_center),
+			getdate("{0}-{1:02d}-01".format(d.year, d.month)), d.is_period_closing_voucher)
+
+		add_to_balance(balances, key, d)
+
+	return balances
+
+def get_balances_from_table(company):
+	balances = {}
+	for d in frappe.db.sql("""
+		select
+			account, party_type, party, cost_center, period_start, is_period_closing_voucher,
+			debit, credit, debit_in_account_currency, credit_in_account_currency
+		from `tabAccount Balance`
+		where company = %s
+	""", company, as_dict=1):
+		key = (company, d.account, cstr(d.party_type), cstr(d.party), cstr(d.cost_center),
+			getdate(d.period_start), d.is_period_closing_voucher)
+
+		add_to_balance(balances, key, d)
+
+	return balances
+
+def add_to_balance(balances, key, row):
+	balance = balances.setdefault(key, frappe._dict({fieldname: 0.0 for fieldname in BALANCE_FIELDS}))
+	for fieldname in BALANCE_FIELDS:
+		balance[fieldname] += flt(row.get(fieldname))
+
+def verify_account_balance(company=None, precision=6):
+	"""
+		Compare the account balance with the raw GL, returns the mismatched
+		(company, account, party, cost center, period) rows
+	"""
+	companies = [company] if company else frappe.get_all("Company", pluck="name")
+
+	mismatches = []
+	for company in companies:
+		expected = get_balances_from_gl(company)
+		actual = get_balances_from_table(company)
+
+		for key in set(expected) | set(actual):
+			expected_balance = expected.get(key) or frappe._dict()
+			actual_balance = actual.get(key) or frappe._dict()
+
+			if any(flt(expected_balance.get(fieldname), precision) != flt(actual_balance.get(fieldname), precision)
+				for fieldname in BALANCE_FIELDS):
+				mismatches.append(frappe._dict({
+					"company": key[0],
+					"account": key[1],
+					"party_type": key[2],
+					"party": key[3],
+					"cost_center": key[4],
+					"period_start": key[5],
+					"expected_balance": flt(expected_balance.debit) - flt(expected_balance.credit),
+					"table_balance": flt(actual_balance.debit) - flt(actual_balance.credit)
+				}))
+
+	return mismatches
+
+def on_doctype_update():
+	frappe.db.add_index("Account Balance", ["account", "period_start"])
+	frappe.db.add_index("Account Balance", ["party_type", "party"])
@@ -0,0 +1,62 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from frappe.utils import flt, getdate
+
+from erpnext.accounts.doctype.account_balance.account_balance import (
+	get_balance_periods,
+	verify_account_balance,
+)
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.utils import get_balance_on
+
+
+class TestAccountBalance(unittest.TestCase):
+	def test_balance_periods(self):
+		cases = [
+			# from date, to date, whole months, partial months
+			(None, None, (None, None), []),
+			(None, "2021-03-31", (None, "2021-03-01"), []),
+			(None, "2021-03-15", (None, "2021-02-01"), [("2021-03-01", "2021-03-15")]),
+			("2021-01-01", "2021-03-15", ("2021-01-01", "2021-02-01"), [("2021-03-01", "2021-03-15")]),
+			("2021-01-10", "2021-03-31", ("2021-02-01", "2021-03-01"), [("2021-01-10", "2021-01-31")]),
+			("2021-01-10", "2021-02-15", None, [("2021-01-10", "2021-02-15")]),
+		]
+
+		for from_date, to_date, periods, gl_ranges in cases:
+			expected_periods = periods and tuple(getdate(d) if d else None for d in periods)
+			expected_ranges = [(getdate(d[0]), getdate(d[1])) for d in gl_ranges]
+
+			self.assertEqual(get_balance_periods(from_date, to_date), (expected_periods, expected_ranges),
+				msg="{0} to {1}".format(from_date, to_date))
+
+	def test_balance_on_submit_and_cancel(self):
+		account = "_Test Bank - _TC"
+		dates = ["2021-01-31", "2021-02-10", "2021-02-15", "2021-02-28"]
+		balances = {d: get_gl_balance(account, d) for d in dates}
+
+		jv1 = make_journal_entry(account, "_Test Cash - _TC", 100, posting_date="2021-02-10", submit=True)
+		jv2 = make_journal_entry("_Test Cash - _TC", account, 30, posting_date="2021-01-20", submit=True)
+
+		for d in dates:
+			self.assertEqual(get_balance_on(account, d), get_gl_balance(account, d))
+
+		self.assertEqual(get_balance_on(account, "2021-02-28") - balances["2021-02-28"], 70)
+		self.assertFalse(verify_account_balance("_Test Company"))
+
+		jv1.cancel()
+		jv2.cancel()
+
+		for d in dates:
+			self.assertEqual(get_balance_on(account, d), balances[d])
+
+		self.assertFalse(verify_account_balance("_Test Company"))
+
+def get_gl_balance(account, date):
+	return flt(frappe.db.sql("""
+		select ifnull(sum(debit_in_account_currency) - sum(credit_in_account_currency), 0)
+		from `tabGL Entry`
+		where account = %s and posting_date <= %s and is_cancelled = 0""", (account, date))[0][0])
@@ -96,10 +96,14 @@ class GLEntry(Document):
 
 			frappe.throw(msg, title=_("Missing Cost Center"))
 
-	def validate_dimensions_for_pl_and_bs(self):
-		account_type = frappe.db.get_value("Account", self.account, "report_type")
+	def validate_dimensions_for_pl_and_bs(self, account_type=None, dimensions=None):
+		if not account_type:
+			account_type = frappe.db.get_value("Account", self.account, "report_type")
 
-		for dimension in get_checks_for_pl_and_bs_accounts():
+		if dimensions is None:
+			dimensions = get_checks_for_pl_and_bs_accounts()
+
+		for dimension in dimensions:
 			if account_type == "Profit and Loss" \
 				and self.company == dimension.company and dimension.mandatory_for_pl and not dimension.disabled:
 				if not self.get(dimension.fieldname):
@@ -112,8 +116,10 @@ class GLEntry(Document):
 					frappe.throw(_("Accounting Dimension <b>{0}</b> is required for 'Balance Sheet' account {1}.")
 						.format(dimension.label, self.account))
 
-	def validate_allowed_dimensions(self):
-		dimension_filter_map = get_dimension_filter_map()
+	def validate_allowed_dimensions(self, dimension_filter_map=None):
+		if dimension_filter_map is None:
+			dimension_filter_map = get_dimension_filter_map()
+
 		for key, value in dimension_filter_map.items():
 			dimension = key[0]
 			account = key[1]
@@ -134,15 +140,16 @@ class GLEntry(Document):
 
 	def check_pl_account(self):
 		if self.is_opening=='Yes' and \
-				frappe.db.get_value("Account", self.account, "report_type")=="Profit and Loss":
+				frappe.get_cached_value("Account", self.account, "report_type")=="Profit and Loss":
 			frappe.throw(_("{0} {1}: 'Profit and Loss' type account {2} not allowed in Opening Entry")
 				.format(self.voucher_type, self.voucher_no, self.account))
 
-	def validate_account_details(self, adv_adj):
+	def validate_account_details(self, adv_adj, ret=None):
 		"""Account must be ledger, active and not freezed"""
 
-		ret = frappe.db.sql("""select is_group, docstatus, company
-			from tabAccount where name=%s""", self.account, as_dict=1)[0]
+		if not ret:
+			ret = frappe.db.sql("""select is_group, docstatus, company
+				from tabAccount where name=%s""", self.account, as_dict=1)[0]
 
 		if ret.is_group==1:
 			frappe.throw(_('''{0} {1}: Account {2} is a Group Account and group accounts cannot be used in transactions''')
@@ -216,23 +223,38 @@ def update_outstanding_amt(account, party_type, party, against_voucher_type, aga
 	else:
 		account_condition = " and account = {0}".format(frappe.db.escape(account))
 
+	if party_condition:
+		# party GL entries are in the payment ledger, signed for the type of their account
+		ledger = "`tabPayment Ledger Entry`"
+		balance = "sum(if(account_type = 'Payable', -1, 1) * amount_in_account_currency)"
+		against_voucher_field = "against_voucher_no"
+		ledger_condition = "and delinked = 0"
+	else:
+		ledger = "`tabGL Entry`"
+		balance = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
+		against_voucher_field = "against_voucher"
+		ledger_condition = ""
+
 	# get final outstanding amt
 	bal = flt(frappe.db.sql("""
-		select sum(debit_in_account_currency) - sum(credit_in_account_currency)
-		from `tabGL Entry`
-		where against_voucher_type=%s and against_voucher=%s
+		select {balance}
+		from {ledger}
+		where against_voucher_type=%s and {against_voucher_field}=%s
 		and voucher_type != 'Invoice Discounting'
-		{0} {1}""".format(party_condition, account_condition),
+		{0} {1} {ledger_condition}""".format(party_condition, account_condition, balance=balance, ledger=ledger,
+			against_voucher_field=against_voucher_field, ledger_condition=ledger_condition),
 		(against_voucher_type, against_voucher))[0][0] or 0.0)
 
 	if against_voucher_type == 'Purchase Invoice':
 		bal = -bal
 	elif against_voucher_type == "Journal Entry":
 		against_voucher_amount = flt(frappe.db.sql("""
-			select sum(debit_in_account_currency) - sum(credit_in_account_currency)
-			from `tabGL Entry` where voucher_type = 'Journal Entry' and voucher_no = %s
-			and account = %s and (against_voucher is null or against_voucher='') {0}"""
-			.format(party_condition), (against_voucher, account))[0][0])
+			select {balance}
+			from {ledger} where voucher_type = 'Journal Entry' and voucher_no = %s
+			and account = %s and ({against_voucher_field} is null or {against_voucher_field}='')
+			{0} {ledger_condition}""".format(party_condition, balance=balance, ledger=ledger,
+				against_voucher_field=against_voucher_field, ledger_condition=ledger_condition),
+			(against_voucher, account))[0][0])
 
 		if not against_voucher_amount:
 			frappe.throw(_("Against Journal Entry {0} is already adjusted against some other voucher")
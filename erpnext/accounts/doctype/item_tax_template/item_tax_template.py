@@ -6,11 +6,22 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from erpnext.stock.get_item_details import clear_item_tax_index
+
 
 class ItemTaxTemplate(Document):
 	def validate(self):
 		self.validate_tax_accounts()
 
+	def on_update(self):
+		clear_item_tax_index()
+
+	def on_trash(self):
+		clear_item_tax_index()
+
+	def after_rename(self, old, new, merge):
+		clear_item_tax_index()
+
 	def autoname(self):
 		if self.company and self.title:
 			abbr = frappe.get_cached_value('Company',  self.company,  'abbr')
@@ -3,6 +3,42 @@
 
 import unittest
 
+import frappe
+
+from erpnext.stock.get_item_details import clear_item_tax_index, get_item_tax_index, get_item_tax_map
+
+test_dependencies = ["Item"]
+
 
 class TestItemTaxTemplate(unittest.TestCase):
-	pass
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_item_tax_index(self):
+		template_name = "_Test Account Excise Duty @ 10 - _TC"
+		self.assertEqual(get_item_tax_map("_Test Company", template_name, as_json=False),
+			{"_Test Account Excise Duty - _TC": 10})
+
+		# the index is cleared when the template is changed
+		template = frappe.get_doc("Item Tax Template", template_name)
+		template.taxes[0].tax_rate = 11
+		template.save()
+
+		self.assertEqual(get_item_tax_map("_Test Company", template_name, as_json=False),
+			{"_Test Account Excise Duty - _TC": 11})
+
+		# and when the change is rolled back
+		frappe.db.rollback()
+		self.assertEqual(get_item_tax_map("_Test Company", template_name, as_json=False),
+			{"_Test Account Excise Duty - _TC": 10})
+
+	def test_item_tax_index_of_items(self):
+		clear_item_tax_index()
+		index = get_item_tax_index("_Test Company")
+
+		for item_code in frappe.get_all("Item Tax", filters={"parenttype": "Item"}, pluck="parent"):
+			item = frappe.get_doc("Item", item_code)
+			expected = [d.item_tax_template for d in item.taxes
+				if frappe.db.get_value("Item Tax Template", d.item_tax_template, "company") == "_Test Company"]
+
+			self.assertEqual([d.item_tax_template for d in index.item_taxes.get(item_code, [])], expected)
@@ -0,0 +1,186 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cstr, flt, now
+
+# account type of the party GL entries in the payment ledger, from the account alias `account`
+LEDGER_ACCOUNT_TYPE = """(case
+	when account.account_type in ('Receivable', 'Payable') then account.account_type
+	when account.root_type = 'Asset' then 'Receivable'
+	else 'Payable' end)"""
+
+LEDGER_FIELDS = ["name", "creation", "modified", "owner", "modified_by", "company", "posting_date",
+	"account_type", "account", "party_type", "party", "voucher_type", "voucher_no", "against_voucher_type",
+	"against_voucher_no", "due_date", "cost_center", "finance_book", "account_currency", "amount",
+	"amount_in_account_currency"]
+
+
+class PaymentLedgerEntry(Document):
+	pass
+
+
+def get_ledger_account_type(account_type, root_type):
+	if account_type in ("Receivable", "Payable"):
+		return account_type
+
+	return "Receivable" if root_type == "Asset" else "Payable"
+
+def make_payment_ledger_entries(gl_entries):
+	"""
+		Add the (not cancelled) GL entries with a party to the payment ledger. The amounts are
+		debit - credit for receivable accounts and credit - debit for payable accounts.
+	"""
+	gl_entries = [gle for gle in gl_entries
+		if gle.get("party_type") and gle.get("party") and not gle.get("is_cancelled")]
+
+	if not gl_entries:
+		return
+
+	accounts = {d.name: d for d in frappe.get_all("Account",
+		filters={"name": ("in", list({gle.account for gle in gl_entries}))},
+		fields=["name", "account_type", "root_type", "account_currency"])}
+
+	values = []
+	timestamp = now()
+	for gle in gl_entries:
+		account = accounts.get(gle.account)
+		if not account:
+			# the GL entry fails its own validation
+			continue
+
+		account_type = get_ledger_account_type(account.account_type, account.root_type)
+		sign = -1 if account_type == "Payable" else 1
+
+		debit_in_account_currency = gle.get("debit_in_account_currency")
+		credit_in_account_currency = gle.get("credit_in_account_currency")
+		if debit_in_account_currency is None and credit_in_account_currency is None:
+			debit_in_account_currency, credit_in_account_currency = gle.get("debit"), gle.get("credit")
+
+		values.append((frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user,
+			frappe.session.user, gle.company, gle.posting_date, account_type, gle.account, gle.party_type,
+			gle.party, gle.voucher_type, gle.voucher_no, gle.get("against_voucher_type") or None,
+			gle.get("against_voucher") or None, gle.get("due_date") or None, gle.get("cost_center") or None,
+			gle.get("finance_book") or None, gle.get("account_currency") or account.account_currency,
+			sign * (flt(gle.get("debit")) - flt(gle.get("credit"))),
+			sign * (flt(debit_in_account_currency) - flt(credit_in_account_currency))))
+
+	frappe.db.bulk_insert("Payment Ledger Entry", fields=LEDGER_FIELDS, values=values)
+
+def delink_payment_ledger_entries(voucher_type, voucher_no):
+	"""Take the entries of a voucher out of the outstanding amounts, when its GL entries are cancelled"""
+	frappe.db.sql("""
+		update `tabPayment Ledger Entry`
+		set delinked = 1, modified = %s, modified_by = %s
+		where voucher_type = %s and voucher_no = %s and delinked = 0""",
+		(now(), frappe.session.user, voucher_type, voucher_no))
+
+def delete_payment_ledger_entries(voucher_type, voucher_no):
+	frappe.db.sql("""delete from `tabPayment Ledger Entry`
+		where voucher_type = %s and voucher_no = %s""", (voucher_type, voucher_no))
+
+def rebuild_payment_ledger(company=None):
+	"""Rebuild the payment ledger of the company (all companies by default) from the GL, a year at a time"""
+	companies = [company] if company else frappe.get_all("Company", pluck="name")
+
+	for company in companies:
+		frappe.db.sql("delete from `tabPayment Ledger Entry` where company = %s", company)
+
+		years = frappe.db.sql_list("""
+			select distinct year(posting_date) from `tabGL Entry`
+			where company = %s and is_cancelled = 0 and party is not null and party != ''""", company)
+
+		for year in sorted(years):
+			# the GL entry names are unique, new entries of the ledger get hashes of their own
+			frappe.db.sql("""
+				insert into `tabPayment Ledger Entry` ({fields})
+				select
+					gle.name, gle.creation, gle.modified, gle.owner, gle.modified_by, gle.company, gle.posting_date,
+					{account_type}, gle.account, gle.party_type, gle.party, gle.voucher_type, gle.voucher_no,
+					nullif(gle.against_voucher_type, ''), nullif(gle.against_voucher, ''), gle.due_date,
+					gle.cost_center, gle.finance_book, gle.account_currency,
+					if({account_type} = 'Payable', -1, 1) * (gle.debit - gle.credit),
+					if({account_type} = 'Payable', -1, 1)
+						* (gle.debit_in_account_currency - gle.credit_in_account_currency)
+				from `tabGL Entry` gle, `tabAccount` account
+				where gle.account = account.name and gle.company = %(company)s
+					and gle.is_cancelled = 0 and gle.party_type is not null and gle.party_type != ''
+					and gle.party is not null and gle.party != ''
+					and gle.posting_date between %(from_date)s and %(to_date)s
+			""".format(fields=", ".join("`{0}`".format(f) for f in LEDGER_FIELDS), #nosec
+				account_type=LEDGER_ACCOUNT_TYPE), {
+					"company": company,
+					"from_date": "{0}-01-01".format(year),
+					"to_date": "{0}-12-31".format(year)
+				})
+
+			frappe.db.commit()
+
+def get_balances_from_gl(company):
+	return get_balances("""
+		select
+			gle.voucher_type, gle.voucher_no, gle.account, gle.party_type, gle.party,
+			gle.against_voucher_type, gle.against_voucher as against_voucher_no,
+			sum(if({0} = 'Payable', -1, 1) * (gle.debit - gle.credit)) as amount
+		from `tabGL Entry` gle, `tabAccount` account
+		where gle.account = account.name and gle.company = %s and gle.is_cancelled = 0
+			and gle.party_type is not null and gle.party_type != ''
+			and gle.party is not null and gle.party != ''
+		group by gle.voucher_type, gle.voucher_no, gle.account, gle.party_type, gle.party,
+			gle.against_voucher_type, gle.against_voucher
+	""".format(LEDGER_ACCOUNT_TYPE), company)
+
+def get_balances_from_ledger(company):
+	return get_balances("""
+		select
+			voucher_type, voucher_no, account, party_type, party, against_voucher_type, against_voucher_no,
+			sum(amount) as amount
+		from `tabPayment Ledger Entry`
+		where company = %s and delinked = 0
+		group by voucher_type, voucher_no, account, party_type, party, against_voucher_type, against_voucher_no
+	""", company)
+
+def get_balances(query, company):
+	balances = {}
+	for d in frappe.db.sql(query, company, as_dict=1): #nosec
+		key = (company, d.voucher_type, d.voucher_no, d.account, cstr(d.party_type), cstr(d.party),
+			cstr(d.against_voucher_type), cstr(d.against_voucher_no))
+		balances[key] = balances.get(key, 0.0) + flt(d.amount)
+
+	return balances
+
+def verify_payment_ledger(company=None, precision=6):
+	"""
+		Compare the payment ledger with the party GL entries, returns the mismatched
+		(company, voucher, account, party, against voucher) amounts
+	"""
+	companies = [company] if company else frappe.get_all("Company", pluck="name")
+
+	mismatches = []
+	for company in companies:
+		expected = get_balances_from_gl(company)
+		actual = get_balances_from_ledger(company)
+
+		for key in set(expected) | set(actual):
+			if flt(expected.get(key), precision) != flt(actual.get(key), precision):
+				mismatches.append(frappe._dict({
+					"company": key[0],
+					"voucher_type": key[1],
+					"voucher_no": key[2],
+					"account": key[3],
+					"party_type": key[4],
+					"party": key[5],
+					"against_voucher_type": key[6],
+					"against_voucher_no": key[7],
+					"expected_amount": flt(expected.get(key)),
+					"ledger_amount": flt(actual.get(key))
+				}))
+
+	return mismatches
+
+def on_doctype_update():
+	frappe.db.add_index("Payment Ledger Entry", ["against_voucher_no", "against_voucher_type"])
+	frappe.db.add_index("Payment Ledger Entry", ["voucher_no", "voucher_type"])
+	frappe.db.add_index("Payment Ledger Entry", ["party", "party_type", "account"])
+	frappe.db.add_index("Payment Ledger Entry", ["company", "party_type", "posting_date"])
@@ -0,0 +1,82 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from frappe.utils import flt
+
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import verify_payment_ledger
+from erpnext.accounts.doctype.purchase_invoice.test_purchase_invoice import make_purchase_invoice
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.utils import get_outstanding_invoices
+
+
+class TestPaymentLedgerEntry(unittest.TestCase):
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_sales_invoice_payment_and_cancel(self):
+		si = create_sales_invoice(rate=300)
+		self.assertEqual(get_ledger_amounts(si.doctype, si.name), [300])
+		self.assertEqual(get_outstanding_amount(si), 300)
+
+		pe = get_payment_entry(si.doctype, si.name, party_amount=100, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = frappe.utils.nowdate()
+		pe.submit()
+
+		self.assertEqual(get_ledger_amounts(pe.doctype, pe.name), [-100])
+		self.assertEqual(get_outstanding_amount(si), 200)
+		self.assertEqual(frappe.db.get_value(si.doctype, si.name, "outstanding_amount"), 200)
+		self.assertFalse(verify_payment_ledger("_Test Company"))
+
+		pe.cancel()
+		self.assertEqual(get_ledger_amounts(pe.doctype, pe.name), [])
+		self.assertEqual(get_outstanding_amount(si), 300)
+		self.assertEqual(frappe.db.get_value(si.doctype, si.name, "outstanding_amount"), 300)
+		self.assertFalse(verify_payment_ledger("_Test Company"))
+
+	def test_purchase_invoice(self):
+		pi = make_purchase_invoice(rate=250)
+		self.assertEqual(get_ledger_amounts(pi.doctype, pi.name), [250])
+		self.assertEqual(get_outstanding_amount(pi), 250)
+
+		pi.cancel()
+		self.assertEqual(get_ledger_amounts(pi.doctype, pi.name), [])
+		self.assertFalse(verify_payment_ledger("_Test Company"))
+
+	def test_cancel_paid_invoice(self):
+		frappe.db.set_value("Accounts Settings", None, "unlink_payment_on_cancellation_of_invoice", 1)
+
+		si = create_sales_invoice(rate=300)
+		pe = get_payment_entry(si.doctype, si.name, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = frappe.utils.nowdate()
+		pe.submit()
+
+		si.reload()
+		si.cancel()
+
+		# the payment is now an unallocated advance
+		self.assertEqual(frappe.get_all("Payment Ledger Entry",
+			filters={"voucher_type": pe.doctype, "voucher_no": pe.name, "delinked": 0},
+			fields=["against_voucher_type", "against_voucher_no"]),
+			[{"against_voucher_type": None, "against_voucher_no": None}])
+		self.assertFalse(verify_payment_ledger("_Test Company"))
+
+def get_ledger_amounts(voucher_type, voucher_no):
+	return [flt(amount) for amount in frappe.get_all("Payment Ledger Entry",
+		filters={"voucher_type": voucher_type, "voucher_no": voucher_no, "delinked": 0},
+		pluck="amount_in_account_currency")]
+
+def get_outstanding_amount(invoice):
+	party_type, party_field, account_field = (("Customer", "customer", "debit_to")
+		if invoice.doctype == "Sales Invoice" else ("Supplier", "supplier", "credit_to"))
+
+	for d in get_outstanding_invoices(party_type, invoice.get(party_field), invoice.get(account_field)):
+		if d.voucher_no == invoice.name:
+			return d.outstanding_amount
+
+	return 0
@@ -0,0 +1,325 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, now
+
+import erpnext
+from erpnext.accounts.general_ledger import make_gl_entries
+from erpnext.accounts.utils import (
+	get_currency_precision,
+	reconcile_against_document,
+	validate_allocated_amount,
+)
+
+# vouchers reconciled per batch, the progress is published after each batch
+RECONCILE_BATCH_SIZE = 500
+
+
+def bulk_reconcile_against_document(company, entries, publish_progress=False):
+	BulkReconciliation(company, entries, publish_progress).reconcile()
+
+class BulkReconciliation:
+	"""
+		Reconcile the allocations of many payments to invoices at once.
+
+		Payment Entries (their unallocated amount) and Journal Entries (their rows without a
+		reference) in the company currency are reconciled to Sales and Purchase Invoices
+		without cancelling and resubmitting them: the references are added to the vouchers
+		with multi-row inserts and a pair of GL entries per allocation moves the allocated
+		amount of the party from the voucher to the invoice.
+
+		Other allocations, with a difference amount, in another currency or against orders
+		and journal entries, are reconciled with `reconcile_against_document` as before.
+	"""
+	def __init__(self, company, entries, publish_progress=False):
+		self.company = company
+		self.entries = entries
+		self.publish_progress = publish_progress
+		self.company_currency = erpnext.get_company_currency(company)
+		self.precision = get_currency_precision()
+
+	def reconcile(self):
+		self.set_journal_entry_rows()
+
+		entries, other_entries = [], []
+		for d in self.entries:
+			if not d.get("unreconciled_amount"):
+				d.unreconciled_amount = d.unadjusted_amount
+			d.precision = self.precision
+
+			if self.can_reconcile_in_bulk(d):
+				entries.append(d)
+			else:
+				other_entries.append(d)
+
+		vouchers = list(dict.fromkeys((d.voucher_type, d.voucher_no) for d in entries))
+		other_vouchers = {}
+		for d in other_entries:
+			other_vouchers.setdefault((d.voucher_type, d.voucher_no), []).append(d)
+
+		total = len(vouchers) + len(other_vouchers)
+		for i in range(0, len(vouchers), RECONCILE_BATCH_SIZE):
+			batch = set(vouchers[i:i + RECONCILE_BATCH_SIZE])
+			self.reconcile_batch([d for d in entries if (d.voucher_type, d.voucher_no) in batch])
+			self.update_progress(i + len(batch), total)
+
+		for i, voucher_entries in enumerate(other_vouchers.values()):
+			reconcile_against_document(voucher_entries)
+			self.update_progress(len(vouchers) + i + 1, total)
+
+	def update_progress(self, count, total):
+		if self.publish_progress:
+			frappe.publish_progress(count * 100 / total, title=_("Reconciling Payments..."))
+
+	def set_journal_entry_rows(self):
+		detail_nos = [d.voucher_detail_no for d in self.entries
+			if d.voucher_type == "Journal Entry" and d.voucher_detail_no]
+
+		self.journal_entry_rows = {}
+		if detail_nos:
+			for row in frappe.db.sql("""
+				select t2.*, t1.docstatus as voucher_docstatus
+				from `tabJournal Entry` t1, `tabJournal Entry Account` t2
+				where t1.name = t2.parent and t2.name in %s""", [detail_nos], as_dict=1):
+				self.journal_entry_rows[row.name] = row
+
+	def can_reconcile_in_bulk(self, d):
+		if d.against_voucher_type not in ("Sales Invoice", "Purchase Invoice") \
+			or d.party_type not in ("Customer", "Supplier") or flt(d.difference_amount) \
+			or frappe.get_cached_value("Account", d.account, "account_currency") != self.company_currency:
+			return False
+
+		if d.voucher_type == "Payment Entry":
+			# the references against orders are split in the document
+			return not d.voucher_detail_no
+
+		if d.voucher_type == "Journal Entry":
+			row = self.journal_entry_rows.get(d.voucher_detail_no)
+			return bool(row and not row.reference_type and flt(row.exchange_rate) == 1)
+
+	def reconcile_batch(self, entries):
+		self.set_invoice_details(entries)
+
+		payment_entries = [d for d in entries if d.voucher_type == "Payment Entry"]
+		journal_entries = [d for d in entries if d.voucher_type == "Journal Entry"]
+
+		if payment_entries:
+			self.update_payment_entries(payment_entries)
+
+		if journal_entries:
+			self.update_journal_entries(journal_entries)
+
+		for voucher_type, voucher_entries in (("Payment Entry", payment_entries),
+			("Journal Entry", journal_entries)):
+			if voucher_entries:
+				self.make_gl_entries(voucher_type, voucher_entries)
+
+	def set_invoice_details(self, entries):
+		self.invoice_details = {}
+		for doctype in ("Sales Invoice", "Purchase Invoice"):
+			invoices = list({d.against_voucher for d in entries if d.against_voucher_type == doctype})
+			if not invoices:
+				continue
+
+			for d in frappe.db.sql("""
+				select name, due_date, {0} as bill_no, outstanding_amount,
+					if(currency = party_account_currency, grand_total, base_grand_total) as total_amount
+				from `tab{1}`
+				where name in %s and docstatus = 1""".format( #nosec
+					"bill_no" if doctype == "Purchase Invoice" else "null", doctype), [invoices], as_dict=1):
+				self.invoice_details[(doctype, d.name)] = d
+
+	def get_invoice(self, d):
+		invoice = self.invoice_details.get((d.against_voucher_type, d.against_voucher))
+		if not invoice:
+			frappe.throw(_("{0} {1} is cancelled or does not exist").format(
+				_(d.against_voucher_type), d.against_voucher))
+
+		return invoice
+
+	def validate_allocated_amounts(self, entries, get_unadjusted_amount):
+		allocated_amounts = {}
+		for d in entries:
+			validate_allocated_amount(d)
+
+			key = (d.voucher_no, d.voucher_detail_no)
+			allocated_amounts[key] = allocated_amounts.get(key, 0.0) + flt(d.allocated_amount)
+			if flt(allocated_amounts[key], self.precision) > flt(get_unadjusted_amount(d), self.precision):
+				frappe.throw(_("Allocated amount cannot be greater than unadjusted amount"))
+
+		return allocated_amounts
+
+	def update_payment_entries(self, entries):
+		payments = {d.name: d for d in frappe.get_all("Payment Entry",
+			filters={"name": ("in", list({d.voucher_no for d in entries}))},
+			fields=["name", "docstatus", "party_type", "party", "paid_from", "paid_to", "unallocated_amount"])}
+
+		for d in entries:
+			payment = payments.get(d.voucher_no)
+			party_account = payment and (payment.paid_from
+				if erpnext.get_party_account_type(d.party_type) == 'Receivable' else payment.paid_to)
+
+			if not (payment and payment.docstatus == 1 and payment.party_type == d.party_type
+				and payment.party == d.party and party_account == d.account
+				and flt(payment.unallocated_amount, self.precision) == flt(d.unreconciled_amount, self.precision)):
+				frappe.throw(_("""Payment Entry has been modified after you pulled it. Please pull it again."""))
+
+		self.validate_allocated_amounts(entries, lambda d: d.unreconciled_amount)
+
+		idx = dict(frappe.db.sql("""select parent, max(idx) from `tabPayment Entry Reference`
+			where parent in %s group by parent""", [list(payments)]))
+
+		fields = ["name", "creation", "modified", "owner", "modified_by", "docstatus", "parent", "parentfield",
+			"parenttype", "idx", "reference_doctype", "reference_name", "due_date", "bill_no", "total_amount",
+			"outstanding_amount", "allocated_amount", "exchange_rate"]
+
+		values = []
+		timestamp = now()
+		for d in entries:
+			invoice = self.get_invoice(d)
+			idx[d.voucher_no] = cint(idx.get(d.voucher_no)) + 1
+
+			values.append((frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user,
+				frappe.session.user, 1, d.voucher_no, "references", "Payment Entry", idx[d.voucher_no],
+				d.against_voucher_type, d.against_voucher, invoice.due_date, invoice.bill_no, invoice.total_amount,
+				invoice.outstanding_amount, d.allocated_amount, 1))
+
+			# outstanding amount of the invoice for its next reference
+			invoice.outstanding_amount = flt(invoice.outstanding_amount) - flt(d.allocated_amount)
+
+		frappe.db.bulk_insert("Payment Entry Reference", fields=fields, values=values)
+
+		# the party account is in the company currency, so are the allocated amounts
+		frappe.db.sql("""
+			update `tabPayment Entry` pe, (
+				select parent, sum(allocated_amount) as allocated_amount
+				from `tabPayment Entry Reference`
+				where name in %(references)s
+				group by parent) ref
+			set
+				pe.unallocated_amount = pe.unallocated_amount - ref.allocated_amount,
+				pe.total_allocated_amount = pe.total_allocated_amount + ref.allocated_amount,
+				pe.base_total_allocated_amount = pe.base_total_allocated_amount + ref.allocated_amount,
+				pe.modified = %(modified)s, pe.modified_by = %(modified_by)s
+			where pe.name = ref.parent""", {
+				"references": [v[0] for v in values],
+				"modified": timestamp,
+				"modified_by": frappe.session.user
+			})
+
+	def update_journal_entries(self, entries):
+		for d in entries:
+			row = self.journal_entry_rows.get(d.voucher_detail_no)
+			if not (row and row.voucher_docstatus == 1 and row.parent == d.voucher_no
+				and row.account == d.account and row.party_type == d.party_type and row.party == d.party
+				and flt(row.get(d.dr_or_cr), self.precision) == flt(d.unreconciled_amount, self.precision)):
+				frappe.throw(_("""Payment Entry has been modified after you pulled it. Please pull it again."""))
+
+		allocated_amounts = self.validate_allocated_amounts(entries,
+			lambda d: self.journal_entry_rows[d.voucher_detail_no].get(d.dr_or_cr))
+
+		idx = dict(frappe.db.sql("""select parent, max(idx) from `tabJournal Entry Account`
+			where parent in %s group by parent""", [list({d.voucher_no for d in entries})]))
+
+		# a new row with the reference per allocation, split from the row of the payment
+		fields = None
+		values = []
+		timestamp = now()
+		for d in entries:
+			row = self.journal_entry_rows[d.voucher_detail_no]
+			invoice = self.get_invoice(d)
+			idx[d.voucher_no] = cint(idx.get(d.voucher_no)) + 1
+
+			new_row = frappe._dict(row)
+			new_row.pop("voucher_docstatus")
+			new_row.update({
+				"name": frappe.generate_hash(length=10),
+				"creation": timestamp,
+				"modified": timestamp,
+				"owner": frappe.session.user,
+				"modified_by": frappe.session.user,
+				"idx": idx[d.voucher_no],
+				"debit_in_account_currency": 0.0,
+				"debit": 0.0,
+				"credit_in_account_currency": 0.0,
+				"credit": 0.0,
+				"reference_type": d.against_voucher_type,
+				"reference_name": d.against_voucher,
+				"reference_due_date": invoice.due_date
+			})
+			new_row[d.dr_or_cr] = new_row[get_company_currency_field(d.dr_or_cr)] = flt(d.allocated_amount)
+
+			if not fields:
+				fields = list(new_row)
+			values.append([new_row.get(fieldname) for fieldname in fields])
+
+		frappe.db.bulk_insert("Journal Entry Account", fields=fields, values=values)
+
+		dr_or_cr_by_row = {d.voucher_detail_no: d.dr_or_cr for d in entries}
+		fully_allocated_rows = []
+		for (voucher_no, detail_no), allocated_amount in allocated_amounts.items():
+			row = self.journal_entry_rows[detail_no]
+			dr_or_cr = dr_or_cr_by_row[detail_no]
+			balance = flt(row.get(dr_or_cr) - allocated_amount, self.precision)
+
+			if balance > 0:
+				frappe.db.sql("""update `tabJournal Entry Account`
+					set {0} = %s, {1} = %s, modified = %s, modified_by = %s
+					where name = %s""".format(dr_or_cr, get_company_currency_field(dr_or_cr)), #nosec
+					(balance, balance, timestamp, frappe.session.user, detail_no))
+			else:
+				fully_allocated_rows.append(detail_no)
+
+		if fully_allocated_rows:
+			frappe.db.sql("delete from `tabJournal Entry Account` where name in %s", [fully_allocated_rows])
+
+	def make_gl_entries(self, voucher_type, entries):
+		"""
+			Move the allocated amounts from the party GL entries of the vouchers without an
+			against voucher to the invoices, with a reversing and an allocated GL entry each
+		"""
+		party_gl_entries = {}
+		for gle in frappe.db.sql("""
+			select * from `tabGL Entry`
+			where voucher_type = %s and voucher_no in %s and is_cancelled = 0
+				and party is not null and party != ''
+				and (against_voucher is null or against_voucher = '')
+			order by creation""", (voucher_type, list({d.voucher_no for d in entries})), as_dict=1):
+			party_gl_entries.setdefault((gle.voucher_no, gle.account, gle.party_type, gle.party), gle)
+
+		gl_map = []
+		for d in entries:
+			gle = party_gl_entries.get((d.voucher_no, d.account, d.party_type, d.party))
+			if not gle:
+				frappe.throw(_("""Payment Entry has been modified after you pulled it. Please pull it again."""))
+
+			reverse_dr_or_cr = ("debit_in_account_currency" if d.dr_or_cr == "credit_in_account_currency"
+				else "credit_in_account_currency")
+
+			for dr_or_cr, against_voucher_type, against_voucher in ((reverse_dr_or_cr, None, None),
+				(d.dr_or_cr, d.against_voucher_type, d.against_voucher)):
+				entry = frappe._dict(gle)
+				for fieldname in ("name", "creation", "modified", "owner", "modified_by", "docstatus", "idx",
+					"to_rename", "_user_tags", "_comments", "_assign", "_liked_by"):
+					entry.pop(fieldname, None)
+
+				entry.update({
+					"debit": 0.0,
+					"credit": 0.0,
+					"debit_in_account_currency": 0.0,
+					"credit_in_account_currency": 0.0,
+					"against_voucher_type": against_voucher_type,
+					"against_voucher": against_voucher
+				})
+				entry[dr_or_cr] = entry[get_company_currency_field(dr_or_cr)] = flt(d.allocated_amount)
+				gl_map.append(entry)
+
+		# the freezing date and accounting periods are checked against the first entry
+		gl_map.sort(key=lambda gle: gle.posting_date)
+		make_gl_entries(gl_map, adv_adj=True, merge_entries=False, bulk_insert=True)
+
+def get_company_currency_field(dr_or_cr):
+	return "debit" if dr_or_cr == "debit_in_account_currency" else "credit"
@@ -8,9 +8,15 @@ from frappe.model.document import Document
 from frappe.utils import flt, getdate, nowdate, today
 
 import erpnext
-from erpnext.accounts.utils import get_outstanding_invoices, reconcile_against_document
+from erpnext.accounts.doctype.payment_reconciliation.bulk_reconciliation import (
+	bulk_reconcile_against_document,
+)
+from erpnext.accounts.utils import get_outstanding_invoices
 from erpnext.controllers.accounts_controller import get_advance_payment_entries
 
+# allocations with at least these many rows are reconciled in a background job
+RECONCILE_IN_BACKGROUND_THRESHOLD = 100
+
 
 class PaymentReconciliation(Document):
 	@frappe.whitelist()
@@ -91,35 +97,29 @@ class PaymentReconciliation(Document):
 
 	def get_dr_or_cr_notes(self):
 		condition = self.get_conditions(get_return_invoices=True)
-		dr_or_cr = ("credit_in_account_currency"
-			if erpnext.get_party_account_type(self.party_type) == 'Receivable' else "debit_in_account_currency")
-
-		reconciled_dr_or_cr =  ("debit_in_account_currency"
-			if dr_or_cr == "credit_in_account_currency" else "credit_in_account_currency")
 
 		voucher_type = ('Sales Invoice'
 			if self.party_type == 'Customer' else "Purchase Invoice")
 
+		# the payment ledger amounts are negative for the credit and debit notes
 		return frappe.db.sql(""" SELECT doc.name as reference_name, %(voucher_type)s as reference_type,
-				(sum(gl.{dr_or_cr}) - sum(gl.{reconciled_dr_or_cr})) as amount, doc.posting_date,
+				-sum(ple.amount_in_account_currency) as amount, doc.posting_date,
 				account_currency as currency
-			FROM `tab{doc}` doc, `tabGL Entry` gl
+			FROM `tab{doc}` doc, `tabPayment Ledger Entry` ple
 			WHERE
-				(doc.name = gl.against_voucher or doc.name = gl.voucher_no)
+				(doc.name = ple.against_voucher_no or doc.name = ple.voucher_no)
 				and doc.{party_type_field} = %(party)s
 				and doc.is_return = 1 and ifnull(doc.return_against, "") = ""
-				and gl.against_voucher_type = %(voucher_type)s
-				and doc.docstatus = 1 and gl.party = %(party)s
-				and gl.party_type = %(party_type)s and gl.account = %(account)s
-				and gl.is_cancelled = 0 {condition}
+				and ple.against_voucher_type = %(voucher_type)s
+				and doc.docstatus = 1 and ple.party = %(party)s
+				and ple.party_type = %(party_type)s and ple.account = %(account)s
+				and ple.delinked = 0 {condition}
 			GROUP BY doc.name
 			Having
 				amount > 0
 			ORDER BY doc.posting_date
 		""".format(
 			doc=voucher_type,
-			dr_or_cr=dr_or_cr,
-			reconciled_dr_or_cr=reconciled_dr_or_cr,
 			party_type_field=frappe.scrub(self.party_type),
 			condition=condition or ""),
 			{
@@ -158,6 +158,7 @@ class PaymentReconciliation(Document):
 			inv.invoice_type = entry.get('voucher_type')
 			inv.invoice_number = entry.get('voucher_no')
 			inv.invoice_date = entry.get('posting_date')
+			inv.due_date = entry.get('due_date')
 			inv.amount = flt(entry.get('invoice_amount'))
 			inv.currency = entry.get('currency')
 			inv.outstanding_amount = flt(entry.get('outstanding_amount'))
@@ -165,45 +166,13 @@ class PaymentReconciliation(Document):
 	@frappe.whitelist()
 	def allocate_entries(self, args):
 		self.validate_entries()
-		entries = []
-		for pay in args.get('payments'):
-			pay.update({'unreconciled_amount': pay.get('amount')})
-			for inv in args.get('invoices'):
-				if pay.get('amount') >= inv.get('outstanding_amount'):
-					res = self.get_allocated_entry(pay, inv, inv['outstanding_amount'])
-					pay['amount'] = flt(pay.get('amount')) - flt(inv.get('outstanding_amount'))
-					inv['outstanding_amount'] = 0
-				else:
-					res = self.get_allocated_entry(pay, inv, pay['amount'])
-					inv['outstanding_amount'] = flt(inv.get('outstanding_amount')) - flt(pay.get('amount'))
-					pay['amount'] = 0
-				if pay.get('amount') == 0:
-					entries.append(res)
-					break
-				elif inv.get('outstanding_amount') == 0:
-					entries.append(res)
-					continue
-			else:
-				break
+		entries = allocate_payments(args.get('payments'), args.get('invoices'),
+			frappe.get_precision("Payment Reconciliation Allocation", "allocated_amount") or 2)
 
 		self.set('allocation', [])
 		for entry in entries:
-			if entry['allocated_amount'] != 0:
-				row = self.append('allocation', {})
-				row.update(entry)
-
-	def get_allocated_entry(self, pay, inv, allocated_amount):
-		return frappe._dict({
-			'reference_type': pay.get('reference_type'),
-			'reference_name': pay.get('reference_name'),
-			'reference_row': pay.get('reference_row'),
-			'invoice_type': inv.get('invoice_type'),
-			'invoice_number': inv.get('invoice_number'),
-			'unreconciled_amount': pay.get('unreconciled_amount'),
-			'amount': pay.get('amount'),
-			'allocated_amount': allocated_amount,
-			'difference_amount': pay.get('difference_amount')
-		})
+			row = self.append('allocation', {})
+			row.update(entry)
 
 	@frappe.whitelist()
 	def reconcile(self):
@@ -223,11 +192,15 @@ class PaymentReconciliation(Document):
 
 				reconciled_entry.append(self.get_payment_details(row, dr_or_cr))
 
-		if entry_list:
-			reconcile_against_document(entry_list)
+		if len(entry_list) + len(dr_or_cr_notes) >= RECONCILE_IN_BACKGROUND_THRESHOLD:
+			frappe.enqueue(reconcile_entries, queue='long', timeout=3600, company=self.company,
+				entry_list=entry_list, dr_or_cr_notes=dr_or_cr_notes)
 
-		if dr_or_cr_notes:
-			reconcile_dr_cr_note(dr_or_cr_notes, self.company)
+			msgprint(_("Reconciliation has been queued. Get the unreconciled entries again once it is completed."))
+			self.set('allocation', [])
+			return
+
+		reconcile_entries(self.company, entry_list, dr_or_cr_notes)
 
 		msgprint(_("Successfully Reconciled"))
 		self.get_unreconciled_entries()
@@ -292,25 +265,21 @@ class PaymentReconciliation(Document):
 		if get_invoices:
 			condition += " and posting_date >= {0}".format(frappe.db.escape(self.from_invoice_date)) if self.from_invoice_date else ""
 			condition += " and posting_date <= {0}".format(frappe.db.escape(self.to_invoice_date)) if self.to_invoice_date else ""
-			dr_or_cr = ("debit_in_account_currency" if erpnext.get_party_account_type(self.party_type) == 'Receivable'
-				else "credit_in_account_currency")
 
 			if self.minimum_invoice_amount:
-				condition += " and `{0}` >= {1}".format(dr_or_cr, flt(self.minimum_invoice_amount))
+				condition += " and amount_in_account_currency >= {0}".format(flt(self.minimum_invoice_amount))
 			if self.maximum_invoice_amount:
-				condition += " and `{0}` <= {1}".format(dr_or_cr, flt(self.maximum_invoice_amount))
+				condition += " and amount_in_account_currency <= {0}".format(flt(self.maximum_invoice_amount))
 
 		elif get_return_invoices:
 			condition = " and doc.company = '{0}' ".format(self.company)
 			condition += " and doc.posting_date >= {0}".format(frappe.db.escape(self.from_payment_date)) if self.from_payment_date else ""
 			condition += " and doc.posting_date <= {0}".format(frappe.db.escape(self.to_payment_date)) if self.to_payment_date else ""
-			dr_or_cr = ("gl.debit_in_account_currency" if erpnext.get_party_account_type(self.party_type) == 'Receivable'
-				else "gl.credit_in_account_currency")
 
 			if self.minimum_invoice_amount:
-				condition += " and `{0}` >= {1}".format(dr_or_cr, flt(self.minimum_payment_amount))
+				condition += " and -ple.amount_in_account_currency >= {0}".format(flt(self.minimum_payment_amount))
 			if self.maximum_invoice_amount:
-				condition += " and `{0}` <= {1}".format(dr_or_cr, flt(self.maximum_payment_amount))
+				condition += " and -ple.amount_in_account_currency <= {0}".format(flt(self.maximum_payment_amount))
 
 		else:
 			condition += " and posting_date >= {0}".format(frappe.db.escape(self.from_payment_date)) if self.from_payment_date else ""
@@ -325,6 +294,57 @@ class PaymentReconciliation(Document):
 
 		return condition
 
+def allocate_payments(payments, invoices, precision=2):
+	"""
+		Allocate the payments in the order of their posting date to the invoices in the order of
+		their due date, in one pass over both. The amount of an allocation is what is left of the
+		payment before it. Amounts are rounded to `precision`, and a payment or invoice with less
+		than half of the last digit left is done.
+	"""
+	payments = sorted(payments, key=lambda d: getdate(d.get('posting_date') or nowdate()))
+	invoices = sorted(invoices, key=lambda d: getdate(d.get('due_date') or d.get('invoice_date') or nowdate()))
+
+	unallocated_amounts = [flt(pay.get('amount'), precision) for pay in payments]
+	outstanding_amounts = [flt(inv.get('outstanding_amount'), precision) for inv in invoices]
+	tolerance = 0.5 / 10**precision
+
+	entries = []
+	i = j = 0
+	while i < len(payments) and j < len(invoices):
+		allocated_amount = flt(min(unallocated_amounts[i], outstanding_amounts[j]), precision)
+		if allocated_amount >= tolerance:
+			entries.append(get_allocated_entry(payments[i], invoices[j], unallocated_amounts[i], allocated_amount))
+
+		unallocated_amounts[i] = flt(unallocated_amounts[i] - allocated_amount, precision)
+		outstanding_amounts[j] = flt(outstanding_amounts[j] - allocated_amount, precision)
+
+		if unallocated_amounts[i] < tolerance:
+			i += 1
+		if outstanding_amounts[j] < tolerance:
+			j += 1
+
+	return entries
+
+def get_allocated_entry(pay, inv, unallocated_amount, allocated_amount):
+	return frappe._dict({
+		'reference_type': pay.get('reference_type'),
+		'reference_name': pay.get('reference_name'),
+		'reference_row': pay.get('reference_row'),
+		'invoice_type': inv.get('invoice_type'),
+		'invoice_number': inv.get('invoice_number'),
+		'unreconciled_amount': pay.get('amount'),
+		'amount': unallocated_amount,
+		'allocated_amount': allocated_amount,
+		'difference_amount': pay.get('difference_amount')
+	})
+
+def reconcile_entries(company, entry_list, dr_or_cr_notes=None):
+	if entry_list:
+		bulk_reconcile_against_document(company, entry_list, publish_progress=True)
+
+	if dr_or_cr_notes:
+		reconcile_dr_cr_note(dr_or_cr_notes, company)
+
 def reconcile_dr_cr_note(dr_cr_notes, company):
 	for inv in dr_cr_notes:
 		voucher_type = ('Credit Note'
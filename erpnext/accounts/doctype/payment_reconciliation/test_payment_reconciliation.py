@@ -1,9 +1,85 @@
 # Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
 import unittest
 
+import frappe
+from frappe.utils import add_days, nowdate
+
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import verify_payment_ledger
+from erpnext.accounts.doctype.payment_reconciliation.payment_reconciliation import allocate_payments
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+
 
 class TestPaymentReconciliation(unittest.TestCase):
-	pass
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_allocate_payments(self):
+		payments = [
+			frappe._dict(reference_name="PE-2", posting_date=add_days(nowdate(), 1), amount=50),
+			frappe._dict(reference_name="PE-1", posting_date=nowdate(), amount=70)
+		]
+		invoices = [
+			frappe._dict(invoice_number="SI-2", due_date=add_days(nowdate(), 30), outstanding_amount=100),
+			frappe._dict(invoice_number="SI-1", due_date=nowdate(), outstanding_amount=40)
+		]
+
+		# the earliest payments go to the invoices due first
+		self.assertEqual([(d.reference_name, d.invoice_number, d.amount, d.allocated_amount)
+			for d in allocate_payments(payments, invoices)], [
+				("PE-1", "SI-1", 70, 40),
+				("PE-1", "SI-2", 30, 30),
+				("PE-2", "SI-2", 50, 50)
+			])
+
+	def test_allocate_payments_with_rounding(self):
+		payments = [
+			frappe._dict(reference_name="PE-1", posting_date=nowdate(), amount=1.1),
+			frappe._dict(reference_name="PE-2", posting_date=add_days(nowdate(), 1), amount=0.1)
+		]
+		invoices = [
+			frappe._dict(invoice_number="SI-1", due_date=nowdate(), outstanding_amount=1.0),
+			frappe._dict(invoice_number="SI-2", due_date=add_days(nowdate(), 1), outstanding_amount=0.1),
+			frappe._dict(invoice_number="SI-3", due_date=add_days(nowdate(), 2), outstanding_amount=0.1)
+		]
+
+		# no allocation is made of the float residue of a payment
+		self.assertEqual([(d.reference_name, d.invoice_number, d.allocated_amount)
+			for d in allocate_payments(payments, invoices)], [
+				("PE-1", "SI-1", 1.0),
+				("PE-1", "SI-2", 0.1),
+				("PE-2", "SI-3", 0.1)
+			])
+
+	def test_reconcile_payment_entry(self):
+		si = create_sales_invoice(rate=100)
+
+		pe = get_payment_entry(si.doctype, si.name, bank_account="_Test Bank - _TC")
+		pe.references = []
+		pe.reference_no = "1"
+		pe.reference_date = nowdate()
+		pe.submit()
+		self.assertEqual(pe.unallocated_amount, 100)
+
+		pr = frappe.get_doc({
+			"doctype": "Payment Reconciliation",
+			"company": si.company,
+			"party_type": "Customer",
+			"party": si.customer,
+			"receivable_payable_account": si.debit_to
+		})
+		pr.get_unreconciled_entries()
+
+		payments = [d.as_dict() for d in pr.payments if d.reference_name == pe.name]
+		invoices = [d.as_dict() for d in pr.invoices if d.invoice_number == si.name]
+		pr.allocate_entries(frappe._dict(payments=payments, invoices=invoices))
+		pr.reconcile()
+
+		self.assertEqual(frappe.db.get_value(si.doctype, si.name, "outstanding_amount"), 0)
+
+		pe.reload()
+		self.assertEqual(pe.unallocated_amount, 0)
+		self.assertEqual([(d.reference_name, d.allocated_amount) for d in pe.references], [(si.name, 100)])
+		self.assertFalse(verify_payment_ledger(si.company))
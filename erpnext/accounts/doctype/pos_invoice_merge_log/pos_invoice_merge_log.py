@@ -9,10 +9,16 @@ from frappe import _
 from frappe.core.page.background_jobs.background_jobs import get_info
 from frappe.model.document import Document
 from frappe.model.mapper import map_child_doc, map_doc
-from frappe.utils import flt, getdate, nowdate
+from frappe.utils import flt, getdate, now, nowdate
 from frappe.utils.background_jobs import enqueue
 from frappe.utils.scheduler import is_scheduler_inactive
 
+# POS Invoices merged a chunk at a time, each chunk fetched with its items, taxes and payments at once
+POS_INVOICE_CHUNK_SIZE = 500
+
+# POS Invoices of a customer consolidated per merge log, the closing job commits after each merge log
+MERGE_LOG_SIZE = 2000
+
 
 class POSInvoiceMergeLog(Document):
 	def validate(self):
@@ -28,9 +34,15 @@ class POSInvoiceMergeLog(Document):
 				frappe.throw(_("Row #{}: POS Invoice {} is not against customer {}").format(d.idx, d.pos_invoice, self.customer))
 
 	def validate_pos_invoice_status(self):
+		pos_invoices = {d.name: d for d in frappe.get_all('POS Invoice',
+			filters={'name': ('in', [d.pos_invoice for d in self.pos_invoices])},
+			fields=['name', 'status', 'docstatus', 'is_return', 'return_against'])}
+
+		merged_invoices = {d.pos_invoice for d in self.pos_invoices}
 		for d in self.pos_invoices:
-			status, docstatus, is_return, return_against = frappe.db.get_value(
-				'POS Invoice', d.pos_invoice, ['status', 'docstatus', 'is_return', 'return_against'])
+			invoice = pos_invoices.get(d.pos_invoice) or frappe._dict()
+			status, docstatus, is_return, return_against = (invoice.status, invoice.docstatus,
+				invoice.is_return, invoice.return_against)
 
 			bold_pos_invoice = frappe.bold(d.pos_invoice)
 			bold_status = frappe.bold(status)
@@ -38,7 +50,7 @@ class POSInvoiceMergeLog(Document):
 				frappe.throw(_("Row #{}: POS Invoice {} is not submitted yet").format(d.idx, bold_pos_invoice))
 			if status == "Consolidated":
 				frappe.throw(_("Row #{}: POS Invoice {} has been {}").format(d.idx, bold_pos_invoice, bold_status))
-			if is_return and return_against and return_against not in [d.pos_invoice for d in self.pos_invoices]:
+			if is_return and return_against and return_against not in merged_invoices:
 				bold_return_against = frappe.bold(return_against)
 				return_against_status = frappe.db.get_value('POS Invoice', return_against, "status")
 				if return_against_status != "Consolidated":
@@ -53,10 +65,12 @@ class POSInvoiceMergeLog(Document):
 					frappe.throw(msg)
 
 	def on_submit(self):
-		pos_invoice_docs = [frappe.get_doc("POS Invoice", d.pos_invoice) for d in self.pos_invoices]
+		is_return = dict(frappe.get_all('POS Invoice',
+			filters={'name': ('in', [d.pos_invoice for d in self.pos_invoices])},
+			fields=['name', 'is_return'], as_list=1))
 
-		returns = [d for d in pos_invoice_docs if d.get('is_return') == 1]
-		sales = [d for d in pos_invoice_docs if d.get('is_return') == 0]
+		returns = [d.pos_invoice for d in self.pos_invoices if is_return.get(d.pos_invoice) == 1]
+		sales = [d.pos_invoice for d in self.pos_invoices if is_return.get(d.pos_invoice) == 0]
 
 		sales_invoice, credit_note = "", ""
 		if returns:
@@ -67,7 +81,7 @@ class POSInvoiceMergeLog(Document):
 
 		self.save() # save consolidated_sales_invoice & consolidated_credit_note ref in merge log
 
-		self.update_pos_invoices(pos_invoice_docs, sales_invoice, credit_note)
+		self.set_consolidated_invoice(returns + sales, sales_invoice, credit_note)
 
 	def on_cancel(self):
 		pos_invoice_docs = [frappe.get_doc("POS Invoice", d.pos_invoice) for d in self.pos_invoices]
@@ -109,12 +123,16 @@ class POSInvoiceMergeLog(Document):
 		return credit_note.name
 
 	def merge_pos_invoice_into(self, invoice, data):
-		items, payments, taxes = [], [], []
+		# rows of the consolidated invoice by their key, in the order they were added
+		items, payments, taxes = {}, {}, {}
+		header = {}
 		loyalty_amount_sum, loyalty_points_sum = 0, 0
 		rounding_adjustment, base_rounding_adjustment = 0, 0
 		rounded_total, base_rounded_total = 0, 0
-		for doc in data:
-			map_doc(doc, invoice, table_map={ "doctype": invoice.doctype })
+		for doc in get_pos_invoices_in_chunks(data):
+			# the last value set in the invoices, as mapped one invoice after the other
+			header.update((key, value) for key, value in doc.items()
+				if value not in (None, "") and key not in ("items", "taxes", "payments"))
 
 			if doc.redeem_loyalty_points:
 				invoice.loyalty_redemption_account = doc.loyalty_redemption_account
@@ -123,49 +141,51 @@ class POSInvoiceMergeLog(Document):
 				loyalty_amount_sum += doc.loyalty_amount
 
 			for item in doc.get('items'):
-				found = False
-				for i in items:
-					if (i.item_code == item.item_code and not i.serial_no and not i.batch_no and
-						i.uom == item.uom and i.net_rate == item.net_rate and i.warehouse == item.warehouse):
-						found = True
-						i.qty = i.qty + item.qty
-
-				if not found:
+				# items with serial numbers or batches are not merged
+				key = (None if item.serial_no or item.batch_no
+					else (item.item_code, item.uom, item.net_rate, item.warehouse))
+
+				if key and key in items:
+					items[key].qty = items[key].qty + item.qty
+				else:
 					item.rate = item.net_rate
 					item.price_list_rate = 0
-					si_item = map_child_doc(item, invoice, {"doctype": "Sales Invoice Item"})
-					items.append(si_item)
+					si_item = map_child_doc(frappe.get_doc(item), invoice, {"doctype": "Sales Invoice Item"})
+					# rows not merged are kept by their position
+					items[key or len(items)] = si_item
 
 			for tax in doc.get('taxes'):
-				found = False
-				for t in taxes:
-					if t.account_head == tax.account_head and t.cost_center == tax.cost_center:
-						t.tax_amount = flt(t.tax_amount) + flt(tax.tax_amount_after_discount_amount)
-						t.base_tax_amount = flt(t.base_tax_amount) + flt(tax.base_tax_amount_after_discount_amount)
-						update_item_wise_tax_detail(t, tax)
-						found = True
-				if not found:
+				key = (tax.account_head, tax.cost_center)
+				if key in taxes:
+					t = taxes[key]
+					t.tax_amount = flt(t.tax_amount) + flt(tax.tax_amount_after_discount_amount)
+					t.base_tax_amount = flt(t.base_tax_amount) + flt(tax.base_tax_amount_after_discount_amount)
+					update_item_wise_tax_detail(t, tax)
+				else:
 					tax.charge_type = 'Actual'
 					tax.included_in_print_rate = 0
 					tax.tax_amount = tax.tax_amount_after_discount_amount
 					tax.base_tax_amount = tax.base_tax_amount_after_discount_amount
-					tax.item_wise_tax_detail = tax.item_wise_tax_detail
-					taxes.append(tax)
+					taxes[key] = tax
 
 			for payment in doc.get('payments'):
-				found = False
-				for pay in payments:
-					if pay.account == payment.account and pay.mode_of_payment == payment.mode_of_payment:
-						pay.amount = flt(pay.amount) + flt(payment.amount)
-						pay.base_amount = flt(pay.base_amount) + flt(payment.base_amount)
-						found = True
-				if not found:
-					payments.append(payment)
+				key = (payment.account, payment.mode_of_payment)
+				if key in payments:
+					pay = payments[key]
+					pay.amount = flt(pay.amount) + flt(payment.amount)
+					pay.base_amount = flt(pay.base_amount) + flt(payment.base_amount)
+				else:
+					payments[key] = payment
+
 			rounding_adjustment += doc.rounding_adjustment
 			rounded_total += doc.rounded_total
 			base_rounding_adjustment += doc.rounding_adjustment
 			base_rounded_total += doc.rounded_total
 
+		if header:
+			map_doc(frappe.get_doc(header), invoice, table_map={ "doctype": invoice.doctype })
+
+		items, payments, taxes = list(items.values()), list(payments.values()), list(taxes.values())
 
 		if loyalty_points_sum:
 			invoice.redeem_loyalty_points = 1
@@ -198,6 +218,20 @@ class POSInvoiceMergeLog(Document):
 
 		return sales_invoice
 
+	def set_consolidated_invoice(self, pos_invoices, sales_invoice='', credit_note=''):
+		frappe.db.sql("""
+			update `tabPOS Invoice`
+			set
+				consolidated_invoice = if(is_return = 1, %(credit_note)s, %(sales_invoice)s),
+				status = 'Consolidated', modified = %(modified)s, modified_by = %(modified_by)s
+			where name in %(pos_invoices)s""", {
+				"pos_invoices": pos_invoices,
+				"sales_invoice": sales_invoice or None,
+				"credit_note": credit_note or None,
+				"modified": now(),
+				"modified_by": frappe.session.user
+			})
+
 	def update_pos_invoices(self, invoice_docs, sales_invoice='', credit_note=''):
 		for doc in invoice_docs:
 			doc.load_from_db()
@@ -232,6 +266,32 @@ def update_item_wise_tax_detail(consolidate_tax_row, tax_row):
 
 	consolidate_tax_row.item_wise_tax_detail = json.dumps(consolidated_tax_detail, separators=(',', ':'))
 
+def get_pos_invoices_in_chunks(pos_invoices):
+	"""
+		POS Invoices, in the given order, as dicts with their items, taxes and payments,
+		fetched a chunk at a time
+	"""
+	child_tables = (("items", "POS Invoice Item"), ("taxes", "Sales Taxes and Charges"),
+		("payments", "Sales Invoice Payment"))
+
+	for i in range(0, len(pos_invoices), POS_INVOICE_CHUNK_SIZE):
+		names = pos_invoices[i:i + POS_INVOICE_CHUNK_SIZE]
+
+		invoices = {d.name: d for d in frappe.get_all("POS Invoice", filters={"name": ("in", names)}, fields=["*"])}
+		for fieldname, doctype in child_tables:
+			for d in invoices.values():
+				d[fieldname] = []
+
+			for d in frappe.get_all(doctype, filters={"parenttype": "POS Invoice", "parent": ("in", names)},
+				fields=["*"], order_by="idx"):
+				d.doctype = doctype
+				invoices[d.parent][fieldname].append(d)
+
+		for name in names:
+			doc = invoices[name]
+			doc.doctype = "POS Invoice"
+			yield doc
+
 def get_all_unconsolidated_invoices():
 	filters = {
 		'consolidated_invoice': [ 'in', [ '', None ]],
@@ -279,17 +339,47 @@ def unconsolidate_pos_invoices(closing_entry):
 	else:
 		cancel_merge_logs(merge_logs, closing_entry)
 
+def get_merge_log_chunks(invoices):
+	"""
+		Invoices of a customer in chunks of MERGE_LOG_SIZE, the returns after the sales so that
+		the original invoices of the returns are consolidated before or along with them
+	"""
+	if len(invoices) > MERGE_LOG_SIZE:
+		returns = set(frappe.get_all('POS Invoice', filters={
+			'name': ('in', [d.get('pos_invoice') for d in invoices]),
+			'is_return': 1
+		}, pluck='name'))
+		invoices = sorted(invoices, key=lambda d: d.get('pos_invoice') in returns)
+
+	for i in range(0, len(invoices), MERGE_LOG_SIZE):
+		yield invoices[i:i + MERGE_LOG_SIZE]
+
 def create_merge_logs(invoice_by_customer, closing_entry=None):
 	try:
+		# invoices consolidated by an earlier, failed run of the closing are skipped
+		consolidated_invoices = set(frappe.get_all('POS Invoice', filters={
+			'name': ('in', [d.get('pos_invoice') for invoices in invoice_by_customer.values() for d in invoices]),
+			'consolidated_invoice': ('is', 'set')
+		}, pluck='name')) if closing_entry else set()
+
 		for customer, invoices in invoice_by_customer.items():
-			merge_log = frappe.new_doc('POS Invoice Merge Log')
-			merge_log.posting_date = getdate(closing_entry.get('posting_date')) if closing_entry else nowdate()
-			merge_log.customer = customer
-			merge_log.pos_closing_entry = closing_entry.get('name') if closing_entry else None
-
-			merge_log.set('pos_invoices', invoices)
-			merge_log.save(ignore_permissions=True)
-			merge_log.submit()
+			invoices = [d for d in invoices if d.get('pos_invoice') not in consolidated_invoices]
+			if not invoices:
+				continue
+
+			for chunk in get_merge_log_chunks(invoices):
+				merge_log = frappe.new_doc('POS Invoice Merge Log')
+				merge_log.posting_date = getdate(closing_entry.get('posting_date')) if closing_entry else nowdate()
+				merge_log.customer = customer
+				merge_log.pos_closing_entry = closing_entry.get('name') if closing_entry else None
+
+				merge_log.set('pos_invoices', chunk)
+				merge_log.save(ignore_permissions=True)
+				merge_log.submit()
+
+				if closing_entry:
+					# a retry of the closing resumes from the invoices left
+					frappe.db.commit()
 
 		if closing_entry:
 			closing_entry.set_status(update=True, status='Submitted')
@@ -9,6 +9,7 @@ import frappe
 from erpnext.accounts.doctype.pos_closing_entry.test_pos_closing_entry import init_user_and_profile
 from erpnext.accounts.doctype.pos_invoice.pos_invoice import make_sales_return
 from erpnext.accounts.doctype.pos_invoice.test_pos_invoice import create_pos_invoice
+from erpnext.accounts.doctype.pos_invoice_merge_log import pos_invoice_merge_log
 from erpnext.accounts.doctype.pos_invoice_merge_log.pos_invoice_merge_log import (
 	consolidate_pos_invoices,
 )
@@ -150,3 +151,40 @@ class TestPOSInvoiceMergeLog(unittest.TestCase):
 			frappe.set_user("Administrator")
 			frappe.db.sql("delete from `tabPOS Profile`")
 			frappe.db.sql("delete from `tabPOS Invoice`")
+
+	def test_consolidated_invoice_in_chunks(self):
+		frappe.db.sql("delete from `tabPOS Invoice`")
+
+		chunk_size = pos_invoice_merge_log.POS_INVOICE_CHUNK_SIZE
+		pos_invoice_merge_log.POS_INVOICE_CHUNK_SIZE = 2
+		try:
+			test_user, pos_profile = init_user_and_profile()
+
+			pos_invoices = []
+			for rate in (100, 100, 200, 100, 200):
+				pos_inv = create_pos_invoice(rate=rate, do_not_submit=1)
+				pos_inv.append('payments', {
+					'mode_of_payment': 'Cash', 'account': 'Cash - _TC', 'amount': rate
+				})
+				pos_inv.submit()
+				pos_invoices.append(pos_inv)
+
+			consolidate_pos_invoices()
+
+			pos_invoices[0].load_from_db()
+			consolidated_invoice = frappe.get_doc('Sales Invoice', pos_invoices[0].consolidated_invoice)
+
+			# the items are merged by item, uom, rate and warehouse across the chunks
+			self.assertEqual(sorted((d.item_code, d.rate, d.qty) for d in consolidated_invoice.items),
+				[('_Test Item', 100, 3), ('_Test Item', 200, 2)])
+			self.assertEqual([(d.mode_of_payment, d.amount) for d in consolidated_invoice.payments],
+				[('Cash', 700)])
+
+			for pos_inv in pos_invoices:
+				self.assertEqual(frappe.db.get_value('POS Invoice', pos_inv.name, ['consolidated_invoice', 'status']),
+					(consolidated_invoice.name, 'Consolidated'))
+		finally:
+			pos_invoice_merge_log.POS_INVOICE_CHUNK_SIZE = chunk_size
+			frappe.set_user("Administrator")
+			frappe.db.sql("delete from `tabPOS Profile`")
+			frappe.db.sql("delete from `tabPOS Invoice`")
@@ -33,6 +33,20 @@ class PricingRule(Document):
 
 		if not self.margin_type: self.margin_rate_or_amount = 0.0
 
+	def on_update(self):
+		self.clear_pricing_rule_index()
+
+	def on_trash(self):
+		self.clear_pricing_rule_index()
+
+	def after_rename(self, old, new, merge):
+		self.clear_pricing_rule_index()
+
+	def clear_pricing_rule_index(self):
+		from erpnext.accounts.doctype.pricing_rule.utils import clear_pricing_rule_index
+
+		clear_pricing_rule_index()
+
 	def validate_duplicate_apply_on(self):
 		field = apply_on_dict.get(self.apply_on)
 		values = [d.get(frappe.scrub(self.apply_on)) for d in self.get(field) if field]
@@ -7,6 +7,7 @@ import unittest
 
 import frappe
 
+from erpnext.accounts.doctype.pricing_rule.utils import clear_pricing_rule_index
 from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
 from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
 from erpnext.stock.doctype.item.test_item import make_item
@@ -98,6 +99,7 @@ class TestPricingRule(unittest.TestCase):
 
 		frappe.db.sql("update `tabPricing Rule` set priority=NULL where campaign='_Test Campaign'")
 		from erpnext.accounts.doctype.pricing_rule.utils import MultiplePricingRuleConflict
+		clear_pricing_rule_index()
 		self.assertRaises(MultiplePricingRuleConflict, get_item_details, args)
 
 		args.item_code = "_Test Item 2"
@@ -559,6 +561,41 @@ class TestPricingRule(unittest.TestCase):
 		for doc in [si, si1]:
 			doc.delete()
 
+	def test_pricing_rule_index(self):
+		from erpnext.accounts.doctype.pricing_rule.utils import (
+			_get_pricing_rules,
+			_get_pricing_rules_from_db,
+		)
+
+		make_pricing_rule(title="_Test Index Rule 1", selling=1, discount_percentage=10)
+		make_pricing_rule(title="_Test Index Rule 2", selling=1, discount_percentage=20, priority=2,
+			applicable_for="Customer", customer="_Test Customer")
+		make_pricing_rule(title="_Test Index Rule 3", selling=1, apply_on="Item Group",
+			item_group="_Test Item Group", discount_percentage=5, priority=3,
+			applicable_for="Territory", territory="All Territories")
+		make_pricing_rule(title="_Test Index Rule 4", selling=1, apply_on="Brand",
+			brand="_Test Brand", discount_percentage=7, applicable_for="Campaign", campaign="_Test Campaign")
+		make_pricing_rule(title="_Test Index Rule 5", buying=1, discount_percentage=12)
+
+		for args in [
+			{"customer": "_Test Customer"},
+			{"customer": "_Test Customer 1", "territory": "_Test Territory"},
+			{"campaign": "_Test Campaign", "price_list": "_Test Price List"},
+			{"transaction_type": "buying", "supplier": "_Test Supplier"},
+			{"company": "_Test Company 1"}]:
+			args = frappe._dict({
+				"item_code": "_Test Item",
+				"item_group": "_Test Item Group",
+				"brand": "_Test Brand",
+				"company": "_Test Company",
+				"transaction_type": "selling",
+				"transaction_date": frappe.utils.nowdate()
+			}, **args)
+
+			for apply_on in ["Item Code", "Item Group", "Brand"]:
+				expected = [d.name for d in _get_pricing_rules_from_db(apply_on, frappe._dict(args), {})]
+				self.assertEqual([d.name for d in _get_pricing_rules(apply_on, frappe._dict(args), {})], expected)
+
 test_dependencies = ["Campaign"]
 
 def make_pricing_rule(**args):
@@ -621,6 +658,8 @@ def delete_existing_pricing_rules():
 
 		frappe.db.sql("delete from `tab{0}`".format(doctype))
 
+	clear_pricing_rule_index()
+
 
 def make_item_price(item, price_list_name, item_price):
 	frappe.get_doc({
@@ -9,7 +9,7 @@ import json
 
 import frappe
 from frappe import _, bold
-from frappe.utils import cint, flt, fmt_money, get_link_to_form, getdate, today
+from frappe.utils import cint, cstr, flt, fmt_money, get_link_to_form, getdate, today
 
 from erpnext.setup.doctype.item_group.item_group import get_child_item_groups
 from erpnext.stock.doctype.warehouse.warehouse import get_child_warehouses
@@ -28,7 +28,7 @@ def get_pricing_rules(args, doc=None):
 	pricing_rules = []
 	values =  {}
 
-	if not frappe.db.exists('Pricing Rule', {'disable': 0, args.transaction_type: 1}):
+	if not get_pricing_rule_index(args.transaction_type, args.get("company")).rules:
 		return
 
 	for apply_on in ['Item Code', 'Item Group', 'Brand']:
@@ -97,6 +97,51 @@ def _get_pricing_rules(apply_on, args, values):
 
 	if not args.get(apply_on_field): return []
 
+	index = get_pricing_rule_index(args.transaction_type, args.get("company"))
+	if not index.rules: return []
+
+	value = args.get(apply_on_field)
+	if apply_on_field == 'item_code':
+		if "variant_of" not in args:
+			args.variant_of = frappe.get_cached_value("Item", args.item_code, "variant_of")
+
+		values_to_match = [value, args.variant_of] if args.variant_of else [value]
+	elif apply_on_field == 'item_group':
+		values_to_match = get_tree_ancestors(args, "Item Group")
+	else:
+		values_to_match = [value]
+
+	if not args.price_list: args.price_list = None
+
+	# (rule, child row) pairs matching on the item code, item group or brand
+	matched = set()
+	for d in values_to_match:
+		matched.update(index.children_by_value[apply_on_field].get(d, ()))
+
+	for rule in index.rules_by_other_value[apply_on_field].get(value, ()):
+		matched.update((rule, idx) for idx in range(len(index.children_by_rule[apply_on_field][rule])))
+
+	pricing_rules = []
+	for rule, idx in matched:
+		pricing_rule = index.rules[rule]
+		if not match_pricing_rule_conditions(pricing_rule, args):
+			continue
+
+		child = index.children_by_rule[apply_on_field][rule][idx]
+		pricing_rules.append((pricing_rule, idx, frappe._dict(pricing_rule,
+			**{apply_on_field: child[0], "uom": child[1]})))
+
+	pricing_rules.sort(key=lambda d: d[1])
+	pricing_rules.sort(key=lambda d: (cstr(d[0].priority), d[0].name), reverse=True)
+
+	return [d[2] for d in pricing_rules]
+
+def _get_pricing_rules_from_db(apply_on, args, values):
+	"""Query the pricing rules directly, the index in `_get_pricing_rules` must return the same rules"""
+	apply_on_field = frappe.scrub(apply_on)
+
+	if not args.get(apply_on_field): return []
+
 	child_doc = '`tabPricing Rule {0}`'.format(apply_on)
 
 	conditions = item_variant_condition = item_conditions = ""
@@ -146,6 +191,96 @@ def _get_pricing_rules(apply_on, args, values):
 
 	return pricing_rules
 
+def match_pricing_rule_conditions(pricing_rule, args):
+	"""Python version of the party, tree, validity and price list conditions of `get_other_conditions`"""
+	for field in ["customer", "supplier", "campaign", "sales_partner"]:
+		if pricing_rule.get(field) and pricing_rule.get(field) != args.get(field):
+			return False
+
+	for parenttype in ["Customer Group", "Territory", "Supplier Group", "Warehouse"]:
+		field = frappe.scrub(parenttype)
+		if (args.get(field) and pricing_rule.get(field)
+			and pricing_rule.get(field) not in get_tree_ancestors(args, parenttype)):
+			return False
+
+	if args.get("transaction_date"):
+		transaction_date = getdate(args.get("transaction_date"))
+		if (transaction_date < getdate(pricing_rule.valid_from or "2000-01-01")
+			or transaction_date > getdate(pricing_rule.valid_upto or "2500-12-31")):
+			return False
+
+	if pricing_rule.for_price_list and pricing_rule.for_price_list != args.get("price_list"):
+		return False
+
+	return True
+
+def get_pricing_rule_index(transaction_type, company=None):
+	"""
+		Active pricing rules of the transaction type (selling / buying) for the company, indexed by
+		the item code, item group and brand they apply on
+
+		The index is kept in redis and memoized for the request. It is cleared when a Pricing Rule
+		is changed and when the transaction is rolled back.
+	"""
+	if not hasattr(frappe.local, "pricing_rule_index"):
+		frappe.local.pricing_rule_index = {}
+
+	key = "{0}::{1}".format(transaction_type, company or "")
+	if key not in frappe.local.pricing_rule_index:
+		index = frappe.cache().hget("pricing_rule_index", key)
+		if index is None:
+			index = build_pricing_rule_index(transaction_type, company)
+			frappe.cache().hset("pricing_rule_index", key, index)
+
+		frappe.local.pricing_rule_index[key] = index
+
+	return frappe.local.pricing_rule_index[key]
+
+def build_pricing_rule_index(transaction_type, company=None):
+	pricing_rules = frappe.db.sql("""select * from `tabPricing Rule`
+		where disable = 0 and `{0}` = 1 and ifnull(company, '') in (%s, '')""".format(transaction_type), #nosec
+		company or "", as_dict=1)
+
+	index = frappe._dict({
+		"rules": {d.name: d for d in pricing_rules},
+		"children_by_value": {},
+		"children_by_rule": {},
+		"rules_by_other_value": {}
+	})
+
+	for apply_on in apply_on_table:
+		field = frappe.scrub(apply_on)
+		children_by_value = index.children_by_value.setdefault(field, {})
+		children_by_rule = index.children_by_rule.setdefault(field, {})
+		rules_by_other_value = index.rules_by_other_value.setdefault(field, {})
+
+		for rule in pricing_rules:
+			children_by_rule[rule.name] = []
+			if rule.apply_rule_on_other is not None and rule.get("other_" + field):
+				rules_by_other_value.setdefault(rule.get("other_" + field), []).append(rule.name)
+
+		for d in frappe.db.sql("""select parent, `{0}` as value, uom from `tabPricing Rule {1}`
+			where parenttype = 'Pricing Rule' order by parent, idx""".format(field, apply_on), as_dict=1): #nosec
+			if d.parent not in children_by_rule:
+				continue
+
+			children_by_value.setdefault(d.value, []).append((d.parent, len(children_by_rule[d.parent])))
+			children_by_rule[d.parent].append((d.value, d.uom))
+
+	return index
+
+class PricingRuleIndexObserver:
+	def on_rollback(self):
+		clear_pricing_rule_index()
+
+def clear_pricing_rule_index():
+	frappe.cache().delete_value("pricing_rule_index")
+	frappe.local.pricing_rule_index = {}
+
+	# the index may be rebuilt with changes that are rolled back later
+	if not any(isinstance(observer, PricingRuleIndexObserver) for observer in frappe.local.rollback_observers):
+		frappe.local.rollback_observers.append(PricingRuleIndexObserver())
+
 def apply_multiple_pricing_rules(pricing_rules):
 	apply_multiple_rule = [d.apply_multiple_pricing_rules
 		for d in pricing_rules if d.apply_multiple_pricing_rules]
@@ -158,27 +293,7 @@ def _get_tree_conditions(args, parenttype, table, allow_blank=True):
 	field = frappe.scrub(parenttype)
 	condition = ""
 	if args.get(field):
-		if not frappe.flags.tree_conditions:
-			frappe.flags.tree_conditions = {}
-		key = (parenttype, args.get(field))
-		if key in frappe.flags.tree_conditions:
-			return frappe.flags.tree_conditions[key]
-
-		try:
-			lft, rgt = frappe.db.get_value(parenttype, args.get(field), ["lft", "rgt"])
-		except TypeError:
-			frappe.throw(_("Invalid {0}").format(args.get(field)))
-
-		parent_groups = frappe.db.sql_list("""select name from `tab%s`
-			where lft<=%s and rgt>=%s""" % (parenttype, '%s', '%s'), (lft, rgt))
-
-		if parenttype in ["Customer Group", "Item Group", "Territory"]:
-			parent_field = "parent_{0}".format(frappe.scrub(parenttype))
-			root_name = frappe.db.get_list(parenttype,
-				{"is_group": 1, parent_field: ("is", "not set")}, "name", as_list=1, ignore_permissions=True)
-
-			if root_name and root_name[0][0]:
-				parent_groups.append(root_name[0][0])
+		parent_groups = list(get_tree_ancestors(args, parenttype))
 
 		if parent_groups:
 			if allow_blank: parent_groups.append('')
@@ -188,9 +303,37 @@ def _get_tree_conditions(args, parenttype, table, allow_blank=True):
 				parent_groups=", ".join(frappe.db.escape(d) for d in parent_groups)
 			)
 
-			frappe.flags.tree_conditions[key] = condition
 	return condition
 
+def get_tree_ancestors(args, parenttype):
+	"""Names of the node in `args`, its ancestors and the root of the tree, cached for the request"""
+	field = frappe.scrub(parenttype)
+	if not frappe.flags.tree_ancestors:
+		frappe.flags.tree_ancestors = {}
+
+	key = (parenttype, args.get(field))
+	if key in frappe.flags.tree_ancestors:
+		return frappe.flags.tree_ancestors[key]
+
+	try:
+		lft, rgt = frappe.db.get_value(parenttype, args.get(field), ["lft", "rgt"])
+	except TypeError:
+		frappe.throw(_("Invalid {0}").format(args.get(field)))
+
+	parent_groups = frappe.db.sql_list("""select name from `tab%s`
+		where lft<=%s and rgt>=%s""" % (parenttype, '%s', '%s'), (lft, rgt))
+
+	if parenttype in ["Customer Group", "Item Group", "Territory"]:
+		parent_field = "parent_{0}".format(frappe.scrub(parenttype))
+		root_name = frappe.db.get_list(parenttype,
+			{"is_group": 1, parent_field: ("is", "not set")}, "name", as_list=1, ignore_permissions=True)
+
+		if root_name and root_name[0][0]:
+			parent_groups.append(root_name[0][0])
+
+	frappe.flags.tree_ancestors[key] = parent_groups
+	return parent_groups
+
 def get_other_conditions(conditions, values, args):
 	for field in ["company", "customer", "supplier", "campaign", "sales_partner"]:
 		if args.get(field):
@@ -1,6 +1,7 @@
 # Copyright (c) 2018, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import time
 
 import frappe
 from frappe import _
@@ -24,6 +25,9 @@ from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import (
 )
 from erpnext.accounts.doctype.subscription_plan.subscription_plan import get_plan_rate
 
+# subscriptions processed by each background job of the scheduled task
+SUBSCRIPTION_BATCH_SIZE = 500
+PROCESSING_JOB_NAME = 'process_subscriptions'
 
 class Subscription(Document):
 	def before_insert(self):
@@ -273,6 +277,51 @@ class Subscription(Document):
 		self.validate_end_date()
 		self.validate_to_follow_calendar_months()
 		self.cost_center = erpnext.get_default_cost_center(self.get('company'))
+		self.set_next_processing_date()
+
+	def set_next_processing_date(self):
+		"""
+		Sets `next_processing_date`, the first day on which `process` can change the
+		`Subscription`, so that the scheduled task only picks the subscriptions that are due
+		"""
+		self.next_processing_date = self.get_next_processing_date()
+
+	def get_next_processing_date(self):
+		if self.status in ('Cancelled', 'Completed'):
+			return None
+
+		# the invoice can be paid any day
+		if self.status in ('Past Due Date', 'Unpaid'):
+			return getdate()
+
+		dates = []
+		if self.trial_period_end and self.is_new_subscription():
+			dates.append(add_days(self.trial_period_end, 1))
+
+		if self.end_date:
+			dates.append(add_days(self.end_date, 1))
+
+		current_invoice = self.get_current_invoice()
+		if current_invoice and not self.is_paid(current_invoice) and current_invoice.due_date:
+			dates.append(add_days(current_invoice.due_date, 1))
+
+		if self.current_invoice_start and self.current_invoice_end:
+			invoice_generated = current_invoice and getdate(self.current_invoice_start) \
+				<= getdate(current_invoice.posting_date) <= getdate(self.current_invoice_end)
+
+			if self.generate_invoice_at_period_start:
+				# the next period starts, and is invoiced, after the end of the current one
+				dates.append(add_days(self.current_invoice_end, 1) if invoice_generated
+					else self.current_invoice_start)
+			elif not invoice_generated:
+				dates.append(self.current_invoice_end
+					if getdate(self.current_invoice_end) == getdate(self.current_invoice_start)
+					else add_days(self.current_invoice_end, 1))
+
+			if self.cancel_at_period_end:
+				dates.append(add_days(self.current_invoice_end, 1))
+
+		return min(getdate(d) for d in dates) if dates else None
 
 	def validate_trial_period(self):
 		"""
@@ -651,34 +700,89 @@ def get_prorata_factor(period_end, period_start, is_prepaid):
 
 def process_all():
 	"""
-	Task to updates the status of all `Subscription` apart from those that are cancelled
+	Task to update the status of the `Subscription`s that are due. They are processed by
+	background jobs, `SUBSCRIPTION_BATCH_SIZE` at a time. Subscriptions left by a job that
+	stopped midway are still due, and are picked by the next run
 	"""
+	if is_processing_job_running():
+		return
+
 	subscriptions = get_all_subscriptions()
-	for subscription in subscriptions:
-		process(subscription)
+	batches = [subscriptions[i:i + SUBSCRIPTION_BATCH_SIZE]
+		for i in range(0, len(subscriptions), SUBSCRIPTION_BATCH_SIZE)]
+
+	if len(batches) <= 1:
+		process_subscriptions(subscriptions)
+		return
+
+	for batch in batches:
+		frappe.enqueue(process_subscriptions, queue='long', timeout=3600,
+			job_name=PROCESSING_JOB_NAME, now=frappe.flags.in_test, subscriptions=batch)
+
+	get_logger().info('Queued {0} due subscriptions in {1} jobs'.format(len(subscriptions), len(batches)))
+
+
+def is_processing_job_running():
+	from frappe.utils.background_jobs import get_jobs
+
+	jobs = get_jobs(site=frappe.local.site, queue='long', key='job_name')
+	return PROCESSING_JOB_NAME in jobs.get(frappe.local.site, [])
 
 
 def get_all_subscriptions():
 	"""
-	Returns all `Subscription` documents
+	Returns the names of the `Subscription`s due for processing
+	"""
+	return frappe.db.sql_list("""
+		select name from `tabSubscription`
+		where next_processing_date <= %s and status not in ('Cancelled', 'Completed')
+		order by name""", nowdate())
+
+
+def process_subscriptions(subscriptions):
+	"""
+	Processes the given `Subscription`s one by one and logs the throughput. Subscriptions that are
+	no longer due, having been processed by another job, are skipped
 	"""
-	return frappe.db.get_all('Subscription', {'status': ('!=','Cancelled')})
+	start = time.time()
+	processed, failed, skipped = 0, 0, 0
+
+	for name in subscriptions:
+		# the lock is held until the subscription is processed and committed
+		if not frappe.db.get_value('Subscription', {'name': name, 'next_processing_date': ('<=', nowdate()),
+			'status': ('not in', ('Cancelled', 'Completed'))}, 'name', for_update=True):
+			frappe.db.rollback()
+			skipped += 1
+		elif process({'name': name}):
+			processed += 1
+		else:
+			failed += 1
+
+	elapsed = time.time() - start
+	get_logger().info('Processed {0} subscriptions, {1} failed and {2} skipped, in {3:.2f}s ({4:.2f} per second)'.format(
+		processed, failed, skipped, elapsed, (processed + failed) / elapsed if elapsed else 0))
+
+
+def get_logger():
+	return frappe.logger('subscription', allow_site=True, file_count=50)
 
 
 def process(data):
 	"""
-	Checks a `Subscription` and updates it status as necessary
+	Checks a `Subscription` and updates it status as necessary, returns `True` if it was processed
 	"""
 	if data:
 		try:
 			subscription = frappe.get_doc('Subscription', data['name'])
 			subscription.process()
 			frappe.db.commit()
+			return True
 		except frappe.ValidationError:
 			frappe.db.rollback()
 			frappe.db.begin()
 			frappe.log_error(frappe.get_traceback())
 			frappe.db.commit()
+			return False
 
 
 @frappe.whitelist()
@@ -11,10 +11,14 @@ from frappe.utils.data import (
 	date_diff,
 	flt,
 	get_date_str,
+	getdate,
 	nowdate,
 )
 
-from erpnext.accounts.doctype.subscription.subscription import get_prorata_factor
+from erpnext.accounts.doctype.subscription.subscription import (
+	get_all_subscriptions,
+	get_prorata_factor,
+)
 
 test_dependencies = ("UOM", "Item Group", "Item")
 
@@ -637,3 +641,26 @@ class TestSubscription(unittest.TestCase):
 
 		subscription.process()
 		self.assertEqual(len(subscription.invoices), 1)
+
+	def test_next_processing_date(self):
+		subscription = frappe.new_doc('Subscription')
+		subscription.party_type = 'Customer'
+		subscription.party = '_Test Customer'
+		subscription.append('plans', {'plan': '_Test Plan Name', 'qty': 1})
+		subscription.save()
+
+		# nothing to do till the end of the period
+		self.assertEqual(subscription.next_processing_date, getdate(add_months(nowdate(), 1)))
+		self.assertNotIn(subscription.name, get_all_subscriptions())
+
+		# prepaid subscriptions are invoiced at the start of the period
+		subscription.generate_invoice_at_period_start = True
+		subscription.save()
+		self.assertEqual(subscription.next_processing_date, getdate(nowdate()))
+		self.assertIn(subscription.name, get_all_subscriptions())
+
+		# and are due again when the invoice is past its due date
+		subscription.process()
+		self.assertEqual(len(subscription.invoices), 1)
+		self.assertEqual(subscription.next_processing_date, getdate(add_days(nowdate(), 1)))
+		self.assertNotIn(subscription.name, get_all_subscriptions())
@@ -8,26 +8,44 @@ from frappe.model.meta import get_field_precision
 from frappe.utils import cint, cstr, flt, formatdate, getdate, now
 
 import erpnext
+from erpnext.accounts.doctype.account_balance.account_balance import (
+	update_account_balance,
+	update_account_balance_for_voucher,
+)
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import (
 	get_accounting_dimensions,
+	get_checks_for_pl_and_bs_accounts,
+)
+from erpnext.accounts.doctype.accounting_dimension_filter.accounting_dimension_filter import (
+	get_dimension_filter_map,
 )
 from erpnext.accounts.doctype.budget.budget import validate_expense_against_budget
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import (
+	delink_payment_ledger_entries,
+	make_payment_ledger_entries,
+)
+from erpnext.utilities.bulk_validation import has_doc_event_hooks, validate_mandatory_and_links
 
 
 class ClosedAccountingPeriod(frappe.ValidationError): pass
 
-def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes', from_repost=False):
+# GL maps with at least these many rows are inserted in bulk, unless asked otherwise
+BULK_INSERT_THRESHOLD = 100
+
+def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes', from_repost=False,
+	bulk_insert=None):
 	if gl_map:
 		if not cancel:
 			validate_accounting_period(gl_map)
 			gl_map = process_gl_map(gl_map, merge_entries)
 			if gl_map and len(gl_map) > 1:
-				save_entries(gl_map, adv_adj, update_outstanding, from_repost)
+				save_entries(gl_map, adv_adj, update_outstanding, from_repost, bulk_insert)
 			# Post GL Map proccess there may no be any GL Entries
 			elif gl_map:
 				frappe.throw(_("Incorrect number of General Ledger Entries found. You might have selected a wrong Account in the transaction."))
 		else:
-			make_reverse_gl_entries(gl_map, adv_adj=adv_adj, update_outstanding=update_outstanding)
+			make_reverse_gl_entries(gl_map, adv_adj=adv_adj, update_outstanding=update_outstanding,
+				bulk_insert=bulk_insert)
 
 def validate_accounting_period(gl_map):
 	accounting_periods = frappe.db.sql(""" SELECT
@@ -78,10 +96,13 @@ def process_gl_map(gl_map, merge_entries=True, precision=None):
 def merge_similar_entries(gl_map, precision=None):
 	merged_gl_map = []
 	accounting_dimensions = get_accounting_dimensions()
+	merged_entries = {}
+
 	for entry in gl_map:
 		# if there is already an entry in this account then just add it
 		# to that entry
-		same_head = check_if_in_list(entry, merged_gl_map, accounting_dimensions)
+		key = get_merge_key(entry, accounting_dimensions)
+		same_head = merged_entries.get(key)
 		if same_head:
 			same_head.debit	= flt(same_head.debit) + flt(entry.debit)
 			same_head.debit_in_account_currency	= \
@@ -90,6 +111,7 @@ def merge_similar_entries(gl_map, precision=None):
 			same_head.credit_in_account_currency = \
 				flt(same_head.credit_in_account_currency) + flt(entry.credit_in_account_currency)
 		else:
+			merged_entries[key] = entry
 			merged_gl_map.append(entry)
 
 	company = gl_map[0].company if gl_map else erpnext.get_default_company()
@@ -104,28 +126,24 @@ def merge_similar_entries(gl_map, precision=None):
 
 	return merged_gl_map
 
-def check_if_in_list(gle, gl_map, dimensions=None):
+def get_merge_key(gle, dimensions=None):
+	"""Entries with the same account head and dimensions are merged into one"""
 	account_head_fieldnames = ['voucher_detail_no', 'party', 'against_voucher',
 			'cost_center', 'against_voucher_type', 'party_type', 'project', 'finance_book']
 
 	if dimensions:
 		account_head_fieldnames = account_head_fieldnames + dimensions
 
-	for e in gl_map:
-		same_head = True
-		if e.account != gle.account:
-			same_head = False
-			continue
+	return (gle.account,) + tuple(cstr(gle.get(fieldname)) for fieldname in account_head_fieldnames)
 
-		for fieldname in account_head_fieldnames:
-			if cstr(e.get(fieldname)) != cstr(gle.get(fieldname)):
-				same_head = False
-				break
+def check_if_in_list(gle, gl_map, dimensions=None):
+	key = get_merge_key(gle, dimensions)
 
-		if same_head:
+	for e in gl_map:
+		if get_merge_key(e, dimensions) == key:
 			return e
 
-def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
+def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False, bulk_insert=None):
 	if not from_repost:
 		validate_cwip_accounts(gl_map)
 
@@ -134,8 +152,22 @@ def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
 	if gl_map:
 		check_freezing_date(gl_map[0]["posting_date"], adv_adj)
 
-	for entry in gl_map:
-		make_entry(entry, adv_adj, update_outstanding, from_repost)
+	make_entries(gl_map, adv_adj, update_outstanding, from_repost, bulk_insert)
+
+def make_entries(gl_map, adv_adj, update_outstanding, from_repost=False, bulk_insert=None):
+	if bulk_insert is None:
+		bulk_insert = len(gl_map) >= BULK_INSERT_THRESHOLD and not has_gl_entry_hooks()
+
+	# the outstanding amounts updated with the GL entries are read from the payment ledger
+	make_payment_ledger_entries(gl_map)
+
+	if bulk_insert:
+		make_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost)
+	else:
+		for entry in gl_map:
+			make_entry(entry, adv_adj, update_outstanding, from_repost)
+
+	update_account_balance(gl_map)
 
 def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	gle = frappe.new_doc("GL Entry")
@@ -149,6 +181,98 @@ def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	if not from_repost:
 		validate_expense_against_budget(args)
 
+def make_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost=False):
+	"""
+		Make the GL Entries of the map with a single multi-row insert.
+
+		Runs the validations of `GL Entry`, and the mandatory and link validations of
+		`Document.insert`, with accounts, accounting dimensions and dimension filters fetched
+		once for the whole map, and updates the outstanding amount once per against voucher.
+		Document hooks are not run, entries with hooks are made one by one.
+	"""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import update_outstanding_amt, validate_balance_type
+
+	gl_entries = []
+	for args in gl_map:
+		gle = frappe.new_doc("GL Entry")
+		gle.update(args)
+		gle.flags.from_repost = from_repost
+		gle.validate()
+		gl_entries.append(gle)
+
+	validate_mandatory_and_links(gl_entries)
+
+	if not from_repost:
+		validate_gl_entries(gl_entries, adv_adj)
+
+	insert_gl_entries(gl_entries)
+
+	if from_repost:
+		return
+
+	for account in dict.fromkeys(gle.account for gle in gl_entries):
+		validate_balance_type(account, adv_adj)
+
+	# Update outstanding amt on against vouchers, once per voucher
+	update_outstanding = update_outstanding or 'Yes'
+	against_vouchers = {}
+	for gle in gl_entries:
+		if (gle.against_voucher_type in ['Journal Entry', 'Sales Invoice', 'Purchase Invoice', 'Fees']
+			and gle.against_voucher and update_outstanding == 'Yes'
+			and not frappe.flags.is_reverse_depr_entry):
+				against_vouchers.setdefault((gle.account, gle.party_type, gle.party,
+					gle.against_voucher_type, gle.against_voucher))
+
+	for account, party_type, party, against_voucher_type, against_voucher in against_vouchers:
+		update_outstanding_amt(account, party_type, party, against_voucher_type, against_voucher)
+
+	for args in gl_map:
+		validate_expense_against_budget(args)
+
+def validate_gl_entries(gl_entries, adv_adj):
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_frozen_account
+
+	accounts = {d.name: d for d in frappe.get_all("Account",
+		filters={"name": ("in", list({gle.account for gle in gl_entries}))},
+		fields=["name", "is_group", "docstatus", "company", "report_type"])}
+
+	dimensions = get_checks_for_pl_and_bs_accounts()
+	dimension_filter_map = get_dimension_filter_map()
+
+	for gle in gl_entries:
+		account = accounts.get(gle.account)
+		if not account:
+			frappe.throw(_("{0} {1}: Account {2} does not exist")
+				.format(gle.voucher_type, gle.voucher_no, gle.account), frappe.LinkValidationError)
+
+		gle.validate_account_details(adv_adj, account)
+		gle.validate_dimensions_for_pl_and_bs(account.report_type, dimensions)
+		gle.validate_allowed_dimensions(dimension_filter_map)
+
+	for account in accounts:
+		validate_frozen_account(account, adv_adj)
+
+def insert_gl_entries(gl_entries):
+	fields = []
+	values = []
+	timestamp = now()
+	for gle in gl_entries:
+		gle.name = frappe.generate_hash(txt="", length=10)
+		gle.docstatus = 1
+		gle.owner = gle.modified_by = frappe.session.user
+		gle.creation = gle.modified = timestamp
+
+		d = gle.get_valid_dict(convert_dates_to_str=True)
+		if not fields:
+			fields = list(d)
+
+		values.append([d.get(fieldname) for fieldname in fields])
+
+	frappe.db.bulk_insert("GL Entry", fields=fields, values=values)
+
+def has_gl_entry_hooks():
+	return has_doc_event_hooks("GL Entry")
+
 def validate_cwip_accounts(gl_map):
 	"""Validate that CWIP account are not used in Journal Entry"""
 	if gl_map and gl_map[0].voucher_type != "Journal Entry":
@@ -239,7 +363,7 @@ def get_round_off_account_and_cost_center(company):
 	return round_off_account, round_off_cost_center
 
 def make_reverse_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
-	adv_adj=False, update_outstanding="Yes"):
+	adv_adj=False, update_outstanding="Yes", bulk_insert=None):
 	"""
 		Get original gl entries of the voucher
 		and make reverse gl entries by swapping debit and credit
@@ -259,6 +383,7 @@ def make_reverse_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 		check_freezing_date(gl_entries[0]["posting_date"], adv_adj)
 		set_as_cancel(gl_entries[0]['voucher_type'], gl_entries[0]['voucher_no'])
 
+		reverse_entries = []
 		for entry in gl_entries:
 			entry['name'] = None
 			debit = entry.get('debit', 0)
@@ -276,7 +401,9 @@ def make_reverse_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 			entry['is_cancelled'] = 1
 
 			if entry['debit'] or entry['credit']:
-				make_entry(entry, adv_adj, "Yes")
+				reverse_entries.append(entry)
+
+		make_entries(reverse_entries, adv_adj, "Yes", bulk_insert=bulk_insert)
 
 
 def check_freezing_date(posting_date, adv_adj=False):
@@ -299,6 +426,8 @@ def set_as_cancel(voucher_type, voucher_no):
 	"""
 		Set is_cancelled=1 in all original gl entries for the voucher
 	"""
+	update_account_balance_for_voucher(voucher_type, voucher_no)
+	delink_payment_ledger_entries(voucher_type, voucher_no)
 	frappe.db.sql("""UPDATE `tabGL Entry` SET is_cancelled = 1,
 		modified=%s, modified_by=%s
 		where voucher_type=%s and voucher_no=%s and is_cancelled = 0""",
@@ -559,10 +559,10 @@ def get_dashboard_info(party_type, party, loyalty_program=None):
 
 
 	company_wise_total_unpaid = frappe._dict(frappe.db.sql("""
-		select company, sum(debit_in_account_currency) - sum(credit_in_account_currency)
-		from `tabGL Entry`
+		select company, sum(if(account_type = 'Payable', -1, 1) * amount_in_account_currency)
+		from `tabPayment Ledger Entry`
 		where party_type = %s and party=%s
-		and is_cancelled = 0
+		and delinked = 0
 		group by company""", (party_type, party)))
 
 	for d in companies:
@@ -634,13 +634,15 @@ def get_partywise_advanced_payment_amount(party_type, posting_date = None, futur
 	if company:
 		cond += "and company = {0}".format(frappe.db.escape(company))
 
-	data = frappe.db.sql(""" SELECT party, sum({0}) as amount
-		FROM `tabGL Entry`
+	# credit for customers and debit for suppliers, from the amounts signed for the account type
+	data = frappe.db.sql(""" SELECT party, sum(greatest({0} * amount, 0)) as amount
+		FROM `tabPayment Ledger Entry`
 		WHERE
-			party_type = %s and against_voucher is null
-			and is_cancelled = 0
+			party_type = %s and against_voucher_no is null
+			and delinked = 0
 			and {1} GROUP BY party"""
-		.format(("credit") if party_type == "Customer" else "debit", cond) , party_type)
+		.format("if(account_type = 'Payable', 1, -1)" if party_type == "Customer"
+			else "if(account_type = 'Payable', -1, 1)", cond), party_type)
 
 	if data:
 		return frappe._dict(data)
@@ -27,7 +27,12 @@ from erpnext.accounts.utils import get_currency_precision
 #  7. For overpayment against an invoice with payment terms, there will be an additional row
 #  8. Invoice details like Sales Persons, Delivery Notes are also fetched comma separated
 #  9. Report amounts are in "Party Currency" if party is selected, or company currency for multi-party
-# 10. This reports is based on all GL Entries that are made against account_type "Receivable" or "Payable"
+# 10. This reports is based on all GL Entries that are made against account_type "Receivable" or "Payable",
+#     read from the Payment Ledger unless accounting dimensions or remarks are asked for
+# 11. From the Payment Ledger, the report is built a chunk of parties at a time
+
+# parties per chunk of the report built from the payment ledger
+PARTY_CHUNK_SIZE = 500
 
 def execute(filters=None):
 	args = {
@@ -45,14 +50,27 @@ class ReceivablePayableReport(object):
 			else self.filters.report_date
 
 	def run(self, args):
-		self.filters.update(args)
-		self.set_defaults()
-		self.party_naming_by = frappe.db.get_value(args.get("naming_by")[0], None, args.get("naming_by")[1])
+		self.setup(args)
 		self.get_columns()
 		self.get_data()
 		self.get_chart_data()
 		return self.columns, self.data, None, self.chart, None, self.skip_total_row
 
+	def setup(self, args):
+		self.filters.update(args)
+		self.set_defaults()
+		self.party_naming_by = frappe.db.get_value(args.get("naming_by")[0], None, args.get("naming_by")[1])
+
+	def iterate_data(self, args):
+		"""Rows of the report a chunk at a time, for the reports summing them up"""
+		self.setup(args)
+
+		if self.use_payment_ledger():
+			yield from self.get_data_in_chunks()
+		else:
+			self.get_data()
+			yield self.data
+
 	def set_defaults(self):
 		if not self.filters.get("company"):
 			self.filters.company = frappe.db.get_single_value('Global Defaults', 'default_company')
@@ -62,6 +80,7 @@ class ReceivablePayableReport(object):
 		self.party_type = self.filters.party_type
 		self.party_details = {}
 		self.invoices = set()
+		self.payment_terms_details = None
 		self.skip_total_row = 0
 
 		if self.filters.get('group_by_party'):
@@ -70,6 +89,19 @@ class ReceivablePayableReport(object):
 			self.skip_total_row = 1
 
 	def get_data(self):
+		if self.use_payment_ledger():
+			data = []
+			for rows in self.get_data_in_chunks():
+				data += rows
+
+			self.data = data
+			self.append_total_rows()
+
+			if not self.filters.get('group_by_party'):
+				# in the order of the vouchers in the ledger, as without chunks
+				self.data.sort(key=lambda row: (row.posting_date, row.party))
+			return
+
 		self.get_gl_entries()
 		self.get_sales_invoices_or_customers_based_on_sales_person()
 		self.voucher_balance = OrderedDict()
@@ -93,6 +125,34 @@ class ReceivablePayableReport(object):
 
 		self.build_data()
 
+	def get_data_in_chunks(self):
+		"""
+			Build the rows from the payment ledger a chunk of parties at a time. The ledger is summed
+			up per voucher and the ages are computed in the database, the invoice details, returns,
+			future payments and payment terms are fetched for the parties of the chunk only.
+		"""
+		self.get_sales_invoices_or_customers_based_on_sales_person()
+
+		for parties in self.get_party_chunks():
+			self.get_voucher_ledger(parties)
+			self.invoices = set()
+			self.voucher_balance = OrderedDict()
+			self.init_voucher_balance()
+
+			self.build_delivery_note_map()
+			self.get_invoice_details(parties)
+			self.get_future_payments(parties)
+			self.get_return_entries(parties)
+			self.get_payment_terms_details(parties)
+			self.get_party_details_for(parties)
+
+			self.data = []
+			for gle in self.gl_entries:
+				self.update_voucher_balance(gle)
+
+			self.build_voucher_rows()
+			yield self.data
+
 	def init_voucher_balance(self):
 		# build all keys, since we want to exclude vouchers beyond the report date
 		for gle in self.gl_entries:
@@ -106,6 +166,8 @@ class ReceivablePayableReport(object):
 					posting_date = gle.posting_date,
 					account_currency = gle.account_currency,
 					remarks = gle.remarks if self.filters.get("show_remarks") else None,
+					posting_date_age = gle.get("posting_date_age"),
+					posting_date_range = gle.get("posting_date_range"),
 					invoiced = 0.0,
 					paid = 0.0,
 					credit_note = 0.0,
@@ -212,6 +274,10 @@ class ReceivablePayableReport(object):
 		return voucher_balance
 
 	def build_data(self):
+		self.build_voucher_rows()
+		self.append_total_rows()
+
+	def build_voucher_rows(self):
 		# set outstanding for all the accumulated balances
 		# as we can use this to filter out invoices without outstanding
 		for key, row in self.voucher_balance.items():
@@ -238,6 +304,7 @@ class ReceivablePayableReport(object):
 				else:
 					self.append_row(row)
 
+	def append_total_rows(self):
 		if self.filters.get('group_by_party'):
 			self.append_subtotal_row(self.previous_party)
 			if self.data:
@@ -261,6 +328,8 @@ class ReceivablePayableReport(object):
 		invoice_details = self.invoice_details.get(row.voucher_no, {})
 		if row.due_date:
 			invoice_details.pop("due_date", None)
+			invoice_details.pop("due_date_age", None)
+			invoice_details.pop("due_date_range", None)
 		row.update(invoice_details)
 
 		if row.voucher_type == 'Sales Invoice':
@@ -300,14 +369,18 @@ class ReceivablePayableReport(object):
 			for d in dn_against_si:
 				self.delivery_notes.setdefault(d.against_sales_invoice, set()).add(d.parent)
 
-	def get_invoice_details(self):
+	def get_invoice_details(self, parties=None):
 		self.invoice_details = frappe._dict()
+		values = {"report_date": self.filters.report_date, "parties": parties}
+		due_date_ageing = self.get_ageing_fields("due_date", "due_date")
+		bill_date_ageing = self.get_ageing_fields("bill_date", "bill_date")
+
 		if self.party_type == "Customer":
 			si_list = frappe.db.sql("""
-				select name, due_date, po_no
+				select name, due_date, po_no, {0}
 				from `tabSales Invoice`
-				where posting_date <= %s
-			""",self.filters.report_date, as_dict=1)
+				where posting_date <= %(report_date)s {1}
+			""".format(due_date_ageing, "and customer in %(parties)s" if parties else ""), values, as_dict=1)
 			for d in si_list:
 				self.invoice_details.setdefault(d.name, d)
 
@@ -316,26 +389,35 @@ class ReceivablePayableReport(object):
 				sales_team = frappe.db.sql("""
 					select parent, sales_person
 					from `tabSales Team`
-					where parenttype = 'Sales Invoice'
-				""", as_dict=1)
+					where parenttype = 'Sales Invoice' {0}
+				""".format("and parent in (select name from `tabSales Invoice` where customer in %(parties)s)"
+					if parties else ""), values, as_dict=1)
 				for d in sales_team:
 					self.invoice_details.setdefault(d.parent, {})\
 						.setdefault('sales_team', []).append(d.sales_person)
 
 		if self.party_type == "Supplier":
 			for pi in frappe.db.sql("""
-				select name, due_date, bill_no, bill_date
+				select name, due_date, bill_no, bill_date, {0}, {1}
 				from `tabPurchase Invoice`
-				where posting_date <= %s
-			""", self.filters.report_date, as_dict=1):
+				where posting_date <= %(report_date)s {2}
+			""".format(due_date_ageing, bill_date_ageing, "and supplier in %(parties)s" if parties else ""),
+				values, as_dict=1):
 				self.invoice_details.setdefault(pi.name, pi)
 
 		# Invoices booked via Journal Entries
+		if parties:
+			values["journal_entries"] = [voucher_no for voucher_type, voucher_no, party in self.voucher_balance
+				if voucher_type == "Journal Entry"]
+			if not values["journal_entries"]:
+				return
+
 		journal_entries = frappe.db.sql("""
-			select name, due_date, bill_no, bill_date
+			select name, due_date, bill_no, bill_date, {0}, {1}
 			from `tabJournal Entry`
-			where posting_date <= %s
-		""", self.filters.report_date, as_dict=1)
+			where posting_date <= %(report_date)s {2}
+		""".format(due_date_ageing, bill_date_ageing, "and name in %(journal_entries)s" if parties else ""),
+			values, as_dict=1)
 
 		for je in journal_entries:
 			if je.bill_no:
@@ -366,16 +448,19 @@ class ReceivablePayableReport(object):
 
 	def get_payment_terms(self, row):
 		# build payment_terms for row
-		payment_terms_details = frappe.db.sql("""
-			select
-				si.name, si.party_account_currency, si.currency, si.conversion_rate,
-				ps.due_date, ps.payment_term, ps.payment_amount, ps.description, ps.paid_amount, ps.discounted_amount
-			from `tab{0}` si, `tabPayment Schedule` ps
-			where
-				si.name = ps.parent and
-				si.name = %s
-			order by ps.paid_amount desc, due_date
-		""".format(row.voucher_type), row.voucher_no, as_dict = 1)
+		if self.payment_terms_details is not None:
+			payment_terms_details = self.payment_terms_details.get(row.voucher_no, [])
+		else:
+			payment_terms_details = frappe.db.sql("""
+				select
+					si.name, si.party_account_currency, si.currency, si.conversion_rate,
+					ps.due_date, ps.payment_term, ps.payment_amount, ps.description, ps.paid_amount, ps.discounted_amount
+				from `tab{0}` si, `tabPayment Schedule` ps
+				where
+					si.name = ps.parent and
+					si.name = %s
+				order by ps.paid_amount desc, due_date
+			""".format(row.voucher_type), row.voucher_no, as_dict = 1)
 
 
 		original_row = frappe._dict(row)
@@ -432,17 +517,48 @@ class ReceivablePayableReport(object):
 			additional_row.outstanding = additional_row.invoiced - additional_row.paid - additional_row.credit_note
 			self.append_row(additional_row)
 
-	def get_future_payments(self):
+	def get_payment_terms_details(self, parties):
+		# payment schedules of the invoices of the parties, in the order of allocation
+		self.payment_terms_details = None
+		if not self.filters.based_on_payment_terms:
+			return
+
+		doctype, party_field = (("Sales Invoice", "customer") if self.party_type == "Customer"
+			else ("Purchase Invoice", "supplier"))
+
+		self.payment_terms_details = {}
+		for d in frappe.db.sql("""
+			select
+				si.name, si.party_account_currency, si.currency, si.conversion_rate,
+				ps.due_date, ps.payment_term, ps.payment_amount, ps.description, ps.paid_amount, ps.discounted_amount
+			from `tab{0}` si, `tabPayment Schedule` ps
+			where
+				si.name = ps.parent and
+				si.{1} in %s
+			order by si.name, ps.paid_amount desc, ps.due_date
+		""".format(doctype, party_field), [parties], as_dict=1): #nosec
+			self.payment_terms_details.setdefault(d.name, []).append(d)
+
+	def get_party_details_for(self, parties):
+		# details of the parties of the chunk only
+		fields = (['name', 'customer_name', 'territory', 'customer_group', 'customer_primary_contact']
+			if self.party_type == 'Customer' else ['name', 'supplier_name', 'supplier_group'])
+
+		self.party_details = {}
+		for d in frappe.get_all(self.party_type, filters={"name": ("in", parties)}, fields=fields):
+			self.party_details[d.pop("name")] = d
+
+	def get_future_payments(self, parties=None):
 		if self.filters.show_future_payments:
 			self.future_payments = frappe._dict()
-			future_payments = list(self.get_future_payments_from_payment_entry())
-			future_payments += list(self.get_future_payments_from_journal_entry())
+			future_payments = list(self.get_future_payments_from_payment_entry(parties))
+			future_payments += list(self.get_future_payments_from_journal_entry(parties))
 			if future_payments:
 				for d in future_payments:
 					if d.future_amount and d.invoice_no:
 						self.future_payments.setdefault((d.invoice_no, d.party), []).append(d)
 
-	def get_future_payments_from_payment_entry(self):
+	def get_future_payments_from_payment_entry(self, parties=None):
 		return frappe.db.sql("""
 			select
 				ref.reference_name as invoice_no,
@@ -459,9 +575,11 @@ class ReceivablePayableReport(object):
 				payment_entry.docstatus < 2
 				and payment_entry.posting_date > %s
 				and payment_entry.party_type = %s
-			""", (self.filters.report_date, self.party_type), as_dict=1)
+				{0}
+			""".format("and payment_entry.party in %s" if parties else ""),
+			[self.filters.report_date, self.party_type] + ([parties] if parties else []), as_dict=1)
 
-	def get_future_payments_from_journal_entry(self):
+	def get_future_payments_from_journal_entry(self, parties=None):
 		if self.filters.get('party'):
 			amount_field = ("jea.debit_in_account_currency - jea.credit_in_account_currency"
 				if self.party_type == 'Supplier' else "jea.credit_in_account_currency - jea.debit_in_account_currency")
@@ -485,9 +603,11 @@ class ReceivablePayableReport(object):
 				and je.posting_date > %s
 				and jea.party_type = %s
 				and jea.reference_name is not null and jea.reference_name != ''
+				{1}
 			group by je.name, jea.reference_name
 			having future_amount > 0
-			""".format(amount_field), (self.filters.report_date, self.party_type), as_dict=1)
+			""".format(amount_field, "and jea.party in %s" if parties else ""),
+			[self.filters.report_date, self.party_type] + ([parties] if parties else []), as_dict=1)
 
 	def allocate_future_payments(self, row):
 		# future payments are captured in additional columns
@@ -514,7 +634,7 @@ class ReceivablePayableReport(object):
 		if row.future_ref:
 			row.future_ref = ', '.join(row.future_ref)
 
-	def get_return_entries(self):
+	def get_return_entries(self, parties=None):
 		doctype = "Sales Invoice" if self.party_type == "Customer" else "Purchase Invoice"
 		filters={
 			'is_return': 1,
@@ -523,19 +643,22 @@ class ReceivablePayableReport(object):
 		party_field = scrub(self.filters.party_type)
 		if self.filters.get(party_field):
 			filters.update({party_field: self.filters.get(party_field)})
+		elif parties:
+			filters.update({party_field: ("in", parties)})
 		self.return_entries = frappe._dict(
 			frappe.get_all(doctype, filters, ['name', 'return_against'], as_list=1)
 		)
 
 	def set_ageing(self, row):
 		if self.filters.ageing_based_on == "Due Date":
-			entry_date = row.due_date
+			entry_date, date_field = row.due_date, "due_date"
 		elif self.filters.ageing_based_on == "Supplier Invoice Date":
-			entry_date = row.bill_date
+			entry_date, date_field = row.bill_date, "bill_date"
 		else:
-			entry_date = row.posting_date
+			entry_date, date_field = row.posting_date, "posting_date"
 
-		self.get_ageing_data(entry_date, row)
+		# the age may have been computed in the query along with the date
+		self.get_ageing_data(entry_date, row, row.get(date_field + "_age"), row.get(date_field + "_range"))
 
 		# ageing buckets should not have amounts if due date is not reached
 		if getdate(entry_date) > getdate(self.filters.report_date):
@@ -543,20 +666,22 @@ class ReceivablePayableReport(object):
 
 		row.total_due = row.range1 + row.range2 + row.range3 + row.range4 + row.range5
 
-	def get_ageing_data(self, entry_date, row):
+	def get_ageing_data(self, entry_date, row, age=None, range_index=None):
 		# [0-30, 30-60, 60-90, 90-120, 120-above]
 		row.range1 = row.range2 = row.range3 = row.range4 = row.range5 = 0.0
 
 		if not (self.age_as_on and entry_date):
 			return
 
+		if age is not None and range_index:
+			row.age = cint(age)
+			row['range' + str(range_index)] = row.outstanding
+			return
+
 		row.age = (getdate(self.age_as_on) - getdate(entry_date)).days or 0
 		index = None
 
-		if not (self.filters.range1 and self.filters.range2 and self.filters.range3 and self.filters.range4):
-			self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4 = 30, 60, 90, 120
-
-		for i, days in enumerate([self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4]):
+		for i, days in enumerate(self.get_ageing_ranges()):
 			if cint(row.age) <= cint(days):
 				index = i
 				break
@@ -564,9 +689,24 @@ class ReceivablePayableReport(object):
 		if index is None: index = 4
 		row['range' + str(index+1)] = row.outstanding
 
+	def get_ageing_ranges(self):
+		if not (self.filters.range1 and self.filters.range2 and self.filters.range3 and self.filters.range4):
+			self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4 = 30, 60, 90, 120
+
+		return [self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4]
+
+	def get_ageing_fields(self, date_field, fieldname):
+		"""Columns `<fieldname>_age` and `<fieldname>_range` (1 to 5) of the age of the date as on the report date"""
+		age = "datediff({0}, {1})".format(frappe.db.escape(str(self.age_as_on)), date_field)
+		ranges = " ".join("when {0} <= {1} then {2}".format(age, cint(days), i + 1)
+			for i, days in enumerate(self.get_ageing_ranges()))
+
+		return """{age} as {fieldname}_age,
+			case when {date_field} is null then null {ranges} else 5 end as {fieldname}_range""".format(
+				age=age, fieldname=fieldname, date_field=date_field, ranges=ranges)
+
 	def get_gl_entries(self):
 		# get all the GL entries filtered by the given filters
-
 		conditions, values = self.prepare_conditions()
 		order_by = self.get_order_by_condition()
 
@@ -599,6 +739,67 @@ class ReceivablePayableReport(object):
 				{1} {2} {3}"""
 			.format(select_fields, date_condition, conditions, order_by, remarks=remarks), values, as_dict=True)
 
+	def use_payment_ledger(self):
+		# the payment ledger has no accounting dimensions and remarks
+		if self.filters.get("show_remarks"):
+			return False
+
+		return not any(self.filters.get(dimension.fieldname)
+			for dimension in get_accounting_dimensions(as_list=False))
+
+	def get_ledger_conditions(self):
+		conditions, values = self.prepare_conditions()
+
+		if self.filters.show_future_payments:
+			values.insert(2, self.filters.report_date)
+
+			date_condition = """AND (posting_date <= %s
+				OR (against_voucher_no IS NULL AND DATE(creation) <= %s))"""
+		else:
+			date_condition = "AND posting_date <=%s"
+
+		account_type = "Receivable" if self.party_type == "Customer" else "Payable"
+
+		return """delinked = 0
+			and party_type=%s
+			and account_type = {0}
+			{1} {2}""".format(frappe.db.escape(account_type), date_condition, conditions), values
+
+	def get_party_chunks(self):
+		conditions, values = self.get_ledger_conditions()
+		parties = frappe.db.sql_list("""
+			select distinct party
+			from `tabPayment Ledger Entry`
+			where {0}
+			order by party""".format(conditions), values)
+
+		for i in range(0, len(parties), PARTY_CHUNK_SIZE):
+			yield parties[i:i + PARTY_CHUNK_SIZE]
+
+	def get_voucher_ledger(self, parties):
+		"""
+			Payment ledger of the parties summed up per voucher and against voucher, debits and
+			credits apart, with the age of the vouchers as on the report date
+		"""
+		conditions, values = self.get_ledger_conditions()
+		amount_field = "amount_in_account_currency" if self.filters.get(scrub(self.party_type)) else "amount"
+
+		self.gl_entries = frappe.db.sql("""
+			select
+				min(posting_date) as posting_date, party, voucher_type, voucher_no,
+				against_voucher_type, against_voucher_no as against_voucher,
+				max(account_currency) as account_currency, max(cost_center) as cost_center,
+				sum({0}) as amount, {1}
+			from
+				`tabPayment Ledger Entry`
+			where
+				{2} and party in %s
+			group by
+				party, voucher_type, voucher_no, against_voucher_type, against_voucher_no, {0} > 0
+			{3}"""
+			.format(amount_field, self.get_ageing_fields("min(posting_date)", "posting_date"), conditions,
+				self.get_order_by_condition()), values + [parties], as_dict=True)
+
 	def get_sales_invoices_or_customers_based_on_sales_person(self):
 		if self.filters.get("sales_person"):
 			lft, rgt = frappe.db.get_value("Sales Person",
@@ -716,6 +917,10 @@ class ReceivablePayableReport(object):
 
 	def get_gle_balance(self, gle):
 		# get the balance of the GL (debit - credit) or reverse balance based on report type
+		if "amount" in gle:
+			# payment ledger entry
+			return gle.amount
+
 		return gle.get(self.dr_or_cr) - self.get_reverse_balance(gle)
 
 	def get_reverse_balance(self, gle):
@@ -5,6 +5,7 @@ from frappe.utils import add_days, getdate, today
 
 from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.report.accounts_receivable import accounts_receivable
 from erpnext.accounts.report.accounts_receivable.accounts_receivable import execute
 
 
@@ -12,6 +13,7 @@ class TestAccountsReceivable(unittest.TestCase):
 	def test_accounts_receivable(self):
 		frappe.db.sql("delete from `tabSales Invoice` where company='_Test Company 2'")
 		frappe.db.sql("delete from `tabGL Entry` where company='_Test Company 2'")
+		frappe.db.sql("delete from `tabPayment Ledger Entry` where company='_Test Company 2'")
 
 		filters = {
 			'company': '_Test Company 2',
@@ -54,6 +56,29 @@ class TestAccountsReceivable(unittest.TestCase):
 		self.assertEqual(expected_data_after_credit_note,
 			[row.invoice_grand_total, row.invoiced, row.paid, row.credit_note, row.outstanding])
 
+	def test_accounts_receivable_in_chunks(self):
+		filters = {
+			'company': '_Test Company',
+			'report_date': today(),
+			'ageing_based_on': 'Posting Date'
+		}
+
+		# rows from the GL entries, read when remarks are asked for
+		expected = get_balances(execute(dict(filters, show_remarks=1))[1])
+
+		party_chunk_size = accounts_receivable.PARTY_CHUNK_SIZE
+		accounts_receivable.PARTY_CHUNK_SIZE = 1
+		try:
+			data = execute(filters)[1]
+		finally:
+			accounts_receivable.PARTY_CHUNK_SIZE = party_chunk_size
+
+		self.assertEqual(get_balances(data), expected)
+
+def get_balances(data):
+	return sorted((row.voucher_type, row.voucher_no, row.party, row.outstanding, row.age,
+		row.range1, row.range2, row.range3, row.range4, row.range5) for row in data if row.get("voucher_no"))
+
 def make_sales_invoice():
 	frappe.set_user("Administrator")
 
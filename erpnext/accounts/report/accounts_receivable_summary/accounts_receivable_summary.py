@@ -29,9 +29,11 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 	def get_data(self, args):
 		self.data = []
 
-		self.receivables = ReceivablePayableReport(self.filters).run(args)[1]
+		self.party_total = frappe._dict()
 
-		self.get_party_total(args)
+		# the rows of the receivables are summed up a chunk at a time
+		for receivables in ReceivablePayableReport(self.filters).iterate_data(args):
+			self.get_party_total(receivables)
 
 		party_advance_amount = get_partywise_advanced_payment_amount(self.party_type,
 			self.filters.report_date, self.filters.show_future_payments, self.filters.company) or {}
@@ -57,10 +59,8 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 
 			self.data.append(row)
 
-	def get_party_total(self, args):
-		self.party_total = frappe._dict()
-
-		for d in self.receivables:
+	def get_party_total(self, receivables):
+		for d in receivables:
 			self.init_party_total(d)
 
 			# Add all amount columns
@@ -0,0 +1,136 @@
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import cstr, nowdate
+
+from erpnext.accounts.general_ledger import (
+	has_gl_entry_hooks,
+	make_gl_entries,
+	make_reverse_gl_entries,
+	merge_similar_entries,
+)
+
+
+class TestGeneralLedger(unittest.TestCase):
+	def test_merge_similar_entries(self):
+		for rows in (100, 1000):
+			for dimensions in ([], ["location", "department"]):
+				with patch("erpnext.accounts.general_ledger.get_accounting_dimensions", return_value=dimensions):
+					merged_gl_map = merge_similar_entries(make_gl_map(rows, dimensions))
+
+				expected_gl_map = merge_by_scanning(make_gl_map(rows, dimensions), dimensions)
+
+				self.assertEqual(merged_gl_map, expected_gl_map,
+					msg="{0} rows with dimensions {1}".format(rows, dimensions))
+
+	def test_bulk_insert(self):
+		gl_entries = {}
+		for voucher_no, bulk_insert in (("_Test GL Per Row", False), ("_Test GL Bulk", True)):
+			frappe.db.sql("delete from `tabGL Entry` where voucher_no = %s", voucher_no)
+
+			make_gl_entries(make_voucher_gl_map(voucher_no, 50), merge_entries=False, bulk_insert=bulk_insert)
+			gl_entries[bulk_insert] = get_gl_entries(voucher_no)
+
+		self.assertEqual(len(gl_entries[True]), 50)
+		self.assertEqual(gl_entries[True], gl_entries[False])
+
+		for voucher_no, bulk_insert in (("_Test GL Per Row", False), ("_Test GL Bulk", True)):
+			make_reverse_gl_entries(voucher_type="Journal Entry", voucher_no=voucher_no, bulk_insert=bulk_insert)
+			gl_entries[bulk_insert] = get_gl_entries(voucher_no)
+
+		self.assertEqual(len(gl_entries[True]), 100)
+		self.assertEqual(gl_entries[True], gl_entries[False])
+
+	def test_gl_entry_hooks(self):
+		# entries with hooks, including wildcard hooks, are not inserted in bulk
+		for doc_events, has_hooks in (
+			({"*": {"validate": "erpnext.support.doctype.service_level_agreement.service_level_agreement.apply"}}, False),
+			({"*": {"on_submit": ["custom_app.hooks.on_submit"]}}, True),
+			({"GL Entry": {"on_submit": ["custom_app.hooks.on_submit"]}}, True)):
+			with patch("frappe.get_hooks", return_value=doc_events):
+				self.assertEqual(has_gl_entry_hooks(), has_hooks)
+
+def make_voucher_gl_map(voucher_no, rows):
+	gl_map = []
+	for i in range(rows // 2):
+		for account, debit, credit in (("_Test Bank - _TC", 0, 100 + i), ("Sales - _TC", 100 + i, 0)):
+			gl_map.append(frappe._dict({
+				"company": "_Test Company",
+				"posting_date": nowdate(),
+				"voucher_type": "Journal Entry",
+				"voucher_no": voucher_no,
+				"account": account,
+				"cost_center": "_Test Cost Center - _TC",
+				"debit": debit,
+				"credit": credit,
+				"debit_in_account_currency": debit,
+				"credit_in_account_currency": credit,
+				"remarks": "Row {0}".format(i)
+			}))
+
+	return gl_map
+
+def get_gl_entries(voucher_no):
+	return frappe.db.sql("""
+		select account, cost_center, debit, credit, debit_in_account_currency, credit_in_account_currency,
+			account_currency, fiscal_year, is_opening, is_advance, is_cancelled, to_rename, docstatus
+		from `tabGL Entry`
+		where voucher_type = 'Journal Entry' and voucher_no = %s
+		order by is_cancelled, remarks, account, debit""", voucher_no, as_dict=1)
+
+def make_gl_map(rows, dimensions):
+	gl_map = []
+	for i in range(rows):
+		entry = frappe._dict({
+			"company": "_Test Company",
+			"account": "_Test Account {0}".format(i % 7),
+			"cost_center": "_Test Cost Center {0}".format(i % 3),
+			"party_type": "Customer" if i % 5 == 0 else None,
+			"party": "_Test Customer" if i % 5 == 0 else "",
+			"debit": i % 2 and i * 10 or 0,
+			"credit": not i % 2 and i * 10 or 0,
+			"debit_in_account_currency": i % 2 and i * 10 or 0,
+			"credit_in_account_currency": not i % 2 and i * 10 or 0
+		})
+
+		for j, dimension in enumerate(dimensions):
+			entry[dimension] = "{0} {1}".format(dimension, (i + j) % 2)
+
+		gl_map.append(entry)
+
+	return gl_map
+
+def find_same_head(gle, gl_map, dimensions):
+	"""Frozen copy of the field by field scan `merge_similar_entries` used before the keyed merge"""
+	account_head_fieldnames = ['voucher_detail_no', 'party', 'against_voucher',
+			'cost_center', 'against_voucher_type', 'party_type', 'project', 'finance_book']
+
+	if dimensions:
+		account_head_fieldnames = account_head_fieldnames + dimensions
+
+	for e in gl_map:
+		same_head = True
+		if e.account != gle.account:
+			same_head = False
+			continue
+
+		for fieldname in account_head_fieldnames:
+			if cstr(e.get(fieldname)) != cstr(gle.get(fieldname)):
+				same_head = False
+				break
+
+		if same_head:
+			return e
+
+def merge_by_scanning(gl_map, dimensions):
+	merged_gl_map = []
+	for entry in gl_map:
+		same_head = find_same_head(entry, merged_gl_map, dimensions)
+		if same_head:
+			for field in ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency"):
+				same_head[field] = same_head[field] + entry[field]
+		else:
+			merged_gl_map.append(entry)
+
+	return [d for d in merged_gl_map if d.debit or d.credit]
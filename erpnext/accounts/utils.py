@@ -14,6 +14,14 @@ import erpnext
 
 # imported to enable erpnext.accounts.utils.get_account_currency
 from erpnext.accounts.doctype.account.account import get_account_currency  # noqa
+from erpnext.accounts.doctype.account_balance.account_balance import (
+	get_balance_periods,
+	update_account_balance_for_voucher,
+)
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import (
+	delete_payment_ledger_entries,
+	get_ledger_account_type,
+)
 from erpnext.stock import get_warehouse_account_map
 from erpnext.stock.utils import get_stock_value_on
 
@@ -128,10 +136,9 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 		cost_center = frappe.form_dict.get("cost_center")
 
 
-	cond = ["is_cancelled=0"]
-	if date:
-		cond.append("posting_date <= %s" % frappe.db.escape(cstr(date)))
-	else:
+	cond = []
+	from_date, to_date = None, date
+	if not date:
 		# get balance of all entries that exist
 		date = nowdate()
 
@@ -167,6 +174,7 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			cond.append("""gle.cost_center = %s """ % (frappe.db.escape(cost_center, percent=False), ))
 
 
+	exclude_period_closing_voucher = False
 	if account:
 
 		if not (frappe.flags.ignore_account_permission
@@ -175,8 +183,8 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 
 		if report_type == 'Profit and Loss':
 			# for pl accounts, get balance within a fiscal year
-			cond.append("posting_date >= '%s' and voucher_type != 'Period Closing Voucher'" \
-				% year_start_date)
+			from_date = year_start_date
+			exclude_period_closing_voucher = True
 		# different filter for group and ledger - improved performance
 		if acc.is_group:
 			cond.append("""exists (
@@ -203,13 +211,47 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			select_field = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
 		else:
 			select_field = "sum(debit) - sum(credit)"
-		bal = frappe.db.sql("""
+
+		return get_balance_from_ledger(select_field, cond, from_date, to_date,
+			exclude_period_closing_voucher)
+
+def get_balance_from_ledger(select_field, cond, from_date=None, to_date=None,
+	exclude_period_closing_voucher=False):
+	"""
+		Balance for the conditions on alias `gle` between the dates. Whole months are
+		read from the Account Balance, the partial months at either end from the GL Entry.
+	"""
+	periods, gl_ranges = get_balance_periods(from_date, to_date)
+
+	bal = 0.0
+	if periods:
+		# Account Balance has the same columns as GL Entry for the conditions
+		period_cond = cond + ["gle.is_period_closing_voucher = 0"] if exclude_period_closing_voucher else list(cond)
+		if periods[0]:
+			period_cond.append("gle.period_start >= %s" % frappe.db.escape(cstr(periods[0])))
+		if periods[1]:
+			period_cond.append("gle.period_start <= %s" % frappe.db.escape(cstr(periods[1])))
+
+		bal += flt(frappe.db.sql("""
+			SELECT {0}
+			FROM `tabAccount Balance` gle
+			WHERE {1}""".format(select_field, " and ".join(period_cond) or "1=1"))[0][0])
+
+	for gl_from_date, gl_to_date in gl_ranges:
+		gl_cond = cond + ["gle.is_cancelled=0"]
+		if exclude_period_closing_voucher:
+			gl_cond.append("gle.voucher_type != 'Period Closing Voucher'")
+		if gl_from_date:
+			gl_cond.append("gle.posting_date >= %s" % frappe.db.escape(cstr(gl_from_date)))
+		if gl_to_date:
+			gl_cond.append("gle.posting_date <= %s" % frappe.db.escape(cstr(gl_to_date)))
+
+		bal += flt(frappe.db.sql("""
 			SELECT {0}
 			FROM `tabGL Entry` gle
-			WHERE {1}""".format(select_field, " and ".join(cond)))[0][0]
+			WHERE {1}""".format(select_field, " and ".join(gl_cond)))[0][0])
 
-		# if bal is None, return 0
-		return flt(bal)
+	return bal
 
 def get_count_on(account, fieldname, date):
 	cond = ["is_cancelled=0"]
@@ -528,6 +570,13 @@ def unlink_ref_doc_from_payment_entries(ref_doc):
 		and voucher_no != ifnull(against_voucher, '')""",
 		(now(), frappe.session.user, ref_doc.doctype, ref_doc.name))
 
+	frappe.db.sql("""update `tabPayment Ledger Entry`
+		set against_voucher_type=null, against_voucher_no=null,
+		modified=%s, modified_by=%s
+		where against_voucher_type=%s and against_voucher_no=%s
+		and voucher_no != ifnull(against_voucher_no, '')""",
+		(now(), frappe.session.user, ref_doc.doctype, ref_doc.name))
+
 	if ref_doc.doctype in ("Sales Invoice", "Purchase Invoice"):
 		ref_doc.set("advances", [])
 
@@ -659,19 +708,22 @@ def get_outstanding_invoices(party_type, party, account, condition=None, filters
 	outstanding_invoices = []
 	precision = frappe.get_precision("Sales Invoice", "outstanding_amount") or 2
 
+	# the amounts of the payment ledger are debit - credit for receivable accounts
+	# and credit - debit for payable accounts
+	sign = 1
 	if account:
 		root_type, account_type = frappe.get_cached_value("Account", account, ["root_type", "account_type"])
 		party_account_type = "Receivable" if root_type == "Asset" else "Payable"
 		party_account_type = account_type or party_account_type
+
+		ledger_account_type = get_ledger_account_type(account_type, root_type)
+		if (party_account_type == "Receivable") != (ledger_account_type == "Receivable"):
+			sign = -1
 	else:
 		party_account_type = erpnext.get_party_account_type(party_type)
 
-	if party_account_type == 'Receivable':
-		dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
-		payment_dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-	else:
-		dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-		payment_dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
+	dr_or_cr = "{0} * amount_in_account_currency".format(sign)
+	payment_dr_or_cr = "{0} * amount_in_account_currency".format(-sign)
 
 	held_invoices = get_held_invoices(party_type, party)
 
@@ -681,14 +733,13 @@ def get_outstanding_invoices(party_type, party, account, condition=None, filters
 			ifnull(sum({dr_or_cr}), 0) as invoice_amount,
 			account_currency as currency
 		from
-			`tabGL Entry`
+			`tabPayment Ledger Entry`
 		where
 			party_type = %(party_type)s and party = %(party)s
 			and account = %(account)s and {dr_or_cr} > 0
-			and is_cancelled=0
+			and delinked = 0
 			{condition}
-			and ((voucher_type = 'Journal Entry'
-					and (against_voucher = '' or against_voucher is null))
+			and ((voucher_type = 'Journal Entry' and against_voucher_no is null)
 				or (voucher_type not in ('Journal Entry', 'Payment Entry')))
 		group by voucher_type, voucher_no
 		order by posting_date, name""".format(
@@ -701,15 +752,15 @@ def get_outstanding_invoices(party_type, party, account, condition=None, filters
 		}, as_dict=True)
 
 	payment_entries = frappe.db.sql("""
-		select against_voucher_type, against_voucher,
+		select against_voucher_type, against_voucher_no,
 			ifnull(sum({payment_dr_or_cr}), 0) as payment_amount
-		from `tabGL Entry`
+		from `tabPayment Ledger Entry`
 		where party_type = %(party_type)s and party = %(party)s
 			and account = %(account)s
 			and {payment_dr_or_cr} > 0
-			and against_voucher is not null and against_voucher != ''
-			and is_cancelled=0
-		group by against_voucher_type, against_voucher
+			and against_voucher_no is not null
+			and delinked = 0
+		group by against_voucher_type, against_voucher_no
 	""".format(payment_dr_or_cr=payment_dr_or_cr), {
 		"party_type": party_type,
 		"party": party,
@@ -718,7 +769,7 @@ def get_outstanding_invoices(party_type, party, account, condition=None, filters
 
 	pe_map = frappe._dict()
 	for d in payment_entries:
-		pe_map.setdefault((d.against_voucher_type, d.against_voucher), d.payment_amount)
+		pe_map.setdefault((d.against_voucher_type, d.against_voucher_no), d.payment_amount)
 
 	for d in invoice_list:
 		payment_amount = pe_map.get((d.voucher_type, d.voucher_no), 0)
@@ -924,6 +975,8 @@ def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for
 
 def repost_gle_for_stock_vouchers(stock_vouchers, posting_date, company=None, warehouse_account=None):
 	def _delete_gl_entries(voucher_type, voucher_no):
+		update_account_balance_for_voucher(voucher_type, voucher_no)
+		delete_payment_ledger_entries(voucher_type, voucher_no)
 		frappe.db.sql("""delete from `tabGL Entry`
 			where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
 
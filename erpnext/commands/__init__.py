@@ -1,6 +1,8 @@
 # Copyright (c) 2015, Web Notes Technologies Pvt. Ltd. and Contributors
 # MIT License. See license.txt
 
+import sys
+
 import click
 import frappe
 from frappe.commands import get_site, pass_context
@@ -44,6 +46,90 @@ def make_demo(context, site, domain='Manufacturing', days=100,
 			from erpnext.demo import demo
 			demo.make(domain, days)
 
+@click.command('verify-stock-closing-balance')
+@click.option('--closing-date', help='Closing date of the snapshot, defaults to the latest one')
+@pass_context
+def verify_stock_closing_balance(context, closing_date=None):
+	"Compare the stock closing balance snapshot with a full rescan of the stock ledger"
+	from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import (
+		get_closing_date,
+		verify_closing_balance,
+	)
+
+	site = get_site(context)
+	with frappe.init_site(site=site):
+		frappe.connect()
+		closing_date = closing_date or get_closing_date()
+		if not closing_date:
+			click.echo("No stock closing balance found")
+			return
+
+		mismatches = verify_closing_balance(closing_date)
+		for d in mismatches:
+			click.echo("{company} | {item_code} | {warehouse} | {batch_no}: "
+				"qty {snapshot_qty} != {expected_qty}, value {snapshot_value} != {expected_value}".format(**d))
+
+		click.echo("{0} mismatch(es) found in the stock closing balance as on {1}".format(
+			len(mismatches), closing_date))
+
+		if mismatches:
+			sys.exit(1)
+
+@click.command('rebuild-account-balance')
+@click.option('--company', help='Company to rebuild the account balance for, defaults to all')
+@click.option('--verify', is_flag=True, default=False, help='Only compare the account balance with the GL')
+@pass_context
+def rebuild_account_balance(context, company=None, verify=False):
+	"Rebuild the account balance from the GL, or verify it against the GL"
+	from erpnext.accounts.doctype.account_balance import account_balance
+
+	site = get_site(context)
+	with frappe.init_site(site=site):
+		frappe.connect()
+		if not verify:
+			account_balance.rebuild_account_balance(company)
+			click.echo("Account balance rebuilt")
+			return
+
+		mismatches = account_balance.verify_account_balance(company)
+		for d in mismatches:
+			click.echo("{company} | {account} | {party_type} {party} | {cost_center} | {period_start}: "
+				"balance {table_balance} != {expected_balance}".format(**d))
+
+		click.echo("{0} mismatch(es) found in the account balance".format(len(mismatches)))
+
+		if mismatches:
+			sys.exit(1)
+
+@click.command('rebuild-payment-ledger')
+@click.option('--company', help='Company to rebuild the payment ledger for, defaults to all')
+@click.option('--verify', is_flag=True, default=False, help='Only compare the payment ledger with the GL')
+@pass_context
+def rebuild_payment_ledger(context, company=None, verify=False):
+	"Rebuild the payment ledger from the party GL entries, or verify it against them"
+	from erpnext.accounts.doctype.payment_ledger_entry import payment_ledger_entry
+
+	site = get_site(context)
+	with frappe.init_site(site=site):
+		frappe.connect()
+		if not verify:
+			payment_ledger_entry.rebuild_payment_ledger(company)
+			click.echo("Payment ledger rebuilt")
+			return
+
+		mismatches = payment_ledger_entry.verify_payment_ledger(company)
+		for d in mismatches:
+			click.echo("{company} | {voucher_type} {voucher_no} | {account} | {party_type} {party} | "
+				"{against_voucher_type} {against_voucher_no}: amount {ledger_amount} != {expected_amount}".format(**d))
+
+		click.echo("{0} mismatch(es) found in the payment ledger".format(len(mismatches)))
+
+		if mismatches:
+			sys.exit(1)
+
 commands = [
-	make_demo
+	make_demo,
+	verify_stock_closing_balance,
+	rebuild_account_balance,
+	rebuild_payment_ledger
 ]
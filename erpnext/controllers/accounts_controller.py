@@ -22,9 +22,15 @@ from frappe.utils import (
 )
 
 import erpnext
+from erpnext.accounts.doctype.account_balance.account_balance import (
+	update_account_balance_for_voucher,
+)
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import (
 	get_accounting_dimensions,
 )
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import (
+	delete_payment_ledger_entries,
+)
 from erpnext.accounts.doctype.pricing_rule.utils import (
 	apply_pricing_rule_for_free_items,
 	apply_pricing_rule_on_transaction,
@@ -47,10 +53,12 @@ from erpnext.setup.utils import get_exchange_rate
 from erpnext.stock.doctype.packed_item.packed_item import make_packing_list
 from erpnext.stock.get_item_details import (
 	_get_item_tax_template,
+	clear_item_details_prefetch,
 	get_conversion_factor,
 	get_item_details,
 	get_item_tax_map,
 	get_item_warehouse,
+	prefetch_item_details,
 )
 from erpnext.utilities.transaction_base import TransactionBase
 
@@ -172,6 +180,8 @@ class AccountsController(TransactionBase):
 	def on_trash(self):
 		# delete sl and gl entries on deletion of transaction
 		if frappe.db.get_single_value('Accounts Settings', 'delete_linked_ledger_entries'):
+			update_account_balance_for_voucher(self.doctype, self.name)
+			delete_payment_ledger_entries(self.doctype, self.name)
 			frappe.db.sql("delete from `tabGL Entry` where voucher_type=%s and voucher_no=%s", (self.doctype, self.name))
 			frappe.db.sql("delete from `tabStock Ledger Entry` where voucher_type=%s and voucher_no=%s", (self.doctype, self.name))
 
@@ -346,8 +356,6 @@ class AccountsController(TransactionBase):
 
 	def set_missing_item_details(self, for_validate=False):
 		"""set missing item values"""
-		from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
-
 		if hasattr(self, "items"):
 			parent_dict = {}
 			for fieldname in self.meta.get_valid_columns():
@@ -362,54 +370,65 @@ class AccountsController(TransactionBase):
 				parent_dict.update({"customer": parent_dict.get("party_name")})
 
 			self.pricing_rules = []
-			for item in self.get("items"):
-				if item.get("item_code"):
-					args = parent_dict.copy()
-					args.update(item.as_dict())
+			prefetched = prefetch_item_details([dict(parent_dict, item_code=item.get("item_code"))
+				for item in self.get("items") if item.get("item_code")])
+			try:
+				self._set_missing_item_details(parent_dict)
+			finally:
+				if prefetched:
+					clear_item_details_prefetch()
+
+			if self.doctype == "Purchase Invoice":
+				self.set_expense_account(for_validate)
 
-					args["doctype"] = self.doctype
-					args["name"] = self.name
-					args["child_docname"] = item.name
-					args["ignore_pricing_rule"] = self.ignore_pricing_rule if hasattr(self, 'ignore_pricing_rule') else 0
+	def _set_missing_item_details(self, parent_dict):
+		from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
 
-					if not args.get("transaction_date"):
-						args["transaction_date"] = args.get("posting_date")
+		for item in self.get("items"):
+			if item.get("item_code"):
+				args = parent_dict.copy()
+				args.update(item.as_dict())
 
-					if self.get("is_subcontracted"):
-						args["is_subcontracted"] = self.is_subcontracted
+				args["doctype"] = self.doctype
+				args["name"] = self.name
+				args["child_docname"] = item.name
+				args["ignore_pricing_rule"] = self.ignore_pricing_rule if hasattr(self, 'ignore_pricing_rule') else 0
 
-					ret = get_item_details(args, self, for_validate=True, overwrite_warehouse=False)
+				if not args.get("transaction_date"):
+					args["transaction_date"] = args.get("posting_date")
 
-					for fieldname, value in ret.items():
-						if item.meta.get_field(fieldname) and value is not None:
-							if (item.get(fieldname) is None or fieldname in force_item_fields):
-								item.set(fieldname, value)
+				if self.get("is_subcontracted"):
+					args["is_subcontracted"] = self.is_subcontracted
 
-							elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
-								item.set(fieldname, value)
+				ret = get_item_details(args, self, for_validate=True, overwrite_warehouse=False)
 
-							elif fieldname == "serial_no":
-								# Ensure that serial numbers are matched against Stock UOM
-								item_conversion_factor = item.get("conversion_factor") or 1.0
-								item_qty = abs(item.get("qty")) * item_conversion_factor
+				for fieldname, value in ret.items():
+					if item.meta.get_field(fieldname) and value is not None:
+						if (item.get(fieldname) is None or fieldname in force_item_fields):
+							item.set(fieldname, value)
 
-								if item_qty != len(get_serial_nos(item.get('serial_no'))):
-									item.set(fieldname, value)
+						elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
+							item.set(fieldname, value)
 
-					if self.doctype in ["Purchase Invoice", "Sales Invoice"] and item.meta.get_field('is_fixed_asset'):
-						item.set('is_fixed_asset', ret.get('is_fixed_asset', 0))
+						elif fieldname == "serial_no":
+							# Ensure that serial numbers are matched against Stock UOM
+							item_conversion_factor = item.get("conversion_factor") or 1.0
+							item_qty = abs(item.get("qty")) * item_conversion_factor
 
-					# Double check for cost center
-					# Items add via promotional scheme may not have cost center set
-					if hasattr(item, 'cost_center') and not item.get('cost_center'):
-						item.set('cost_center', self.get('cost_center') or erpnext.get_default_cost_center(self.company))
+							if item_qty != len(get_serial_nos(item.get('serial_no'))):
+								item.set(fieldname, value)
 
-					if ret.get("pricing_rules"):
-						self.apply_pricing_rule_on_items(item, ret)
-						self.set_pricing_rule_details(item, ret)
+				if self.doctype in ["Purchase Invoice", "Sales Invoice"] and item.meta.get_field('is_fixed_asset'):
+					item.set('is_fixed_asset', ret.get('is_fixed_asset', 0))
 
-			if self.doctype == "Purchase Invoice":
-				self.set_expense_account(for_validate)
+				# Double check for cost center
+				# Items add via promotional scheme may not have cost center set
+				if hasattr(item, 'cost_center') and not item.get('cost_center'):
+					item.set('cost_center', self.get('cost_center') or erpnext.get_default_cost_center(self.company))
+
+				if ret.get("pricing_rules"):
+					self.apply_pricing_rule_on_items(item, ret)
+					self.set_pricing_rule_details(item, ret)
 
 	def apply_pricing_rule_on_items(self, item, pricing_rule_args):
 		if not pricing_rule_args.get("validate_applied_rule", 0):
@@ -582,6 +582,8 @@ def is_reposting_pending():
 		{'docstatus': 1, 'status': ['in', ['Queued','In Progress']]})
 
 def future_sle_exists(args, sl_entries=None):
+	from erpnext.stock.utils import get_combine_datetime
+
 	key = (args.voucher_type, args.voucher_no)
 
 	if validate_future_sle_not_exists(args, key, sl_entries):
@@ -598,16 +600,16 @@ def future_sle_exists(args, sl_entries=None):
 
 	data = frappe.db.sql("""
 		select item_code, warehouse, count(name) as total_row
-		from `tabStock Ledger Entry` force index (item_warehouse)
+		from `tabStock Ledger Entry` force index (item_warehouse_posting_datetime)
 		where
 			({})
-			and timestamp(posting_date, posting_time)
-				>= timestamp(%(posting_date)s, %(posting_time)s)
+			and posting_datetime >= %(posting_datetime)s
 			and voucher_no != %(voucher_no)s
 			and is_cancelled = 0
 		GROUP BY
 			item_code, warehouse
-		""".format(" or ".join(or_conditions)), args, as_dict=1)
+		""".format(" or ".join(or_conditions)), dict(args,
+			posting_datetime=get_combine_datetime(args.posting_date, args.posting_time)), as_dict=1)
 
 	for d in data:
 		frappe.local.future_sle[key][(d.item_code, d.warehouse)] = d.total_row
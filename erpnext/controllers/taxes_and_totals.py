@@ -16,12 +16,16 @@ from erpnext.controllers.accounts_controller import (
 	validate_inclusive_tax,
 	validate_taxes_and_charges,
 )
-from erpnext.stock.get_item_details import _get_item_tax_template
+from erpnext.stock.get_item_details import _get_item_tax_template, get_item_tax_index
+
+# documents with at least these many items compute the taxes one tax row at a time over item columns
+ITEM_COLUMNS_THRESHOLD = 100
 
 
 class calculate_taxes_and_totals(object):
 	def __init__(self, doc):
 		self.doc = doc
+		self._item_tax_maps = {}
 		frappe.flags.round_off_applicable_accounts = []
 		get_round_off_applicable_accounts(self.doc.company, frappe.flags.round_off_applicable_accounts)
 		self.calculate()
@@ -57,9 +61,10 @@ class calculate_taxes_and_totals(object):
 		self.calculate_total_net_weight()
 
 	def validate_item_tax_template(self):
+		index = get_item_tax_index(self.doc.get('company'))
+
 		for item in self.doc.get('items'):
 			if item.item_code and item.get('item_tax_template'):
-				item_doc = frappe.get_cached_doc("Item", item.item_code)
 				args = {
 					'net_rate': item.net_rate or item.rate,
 					'tax_category': self.doc.get('tax_category'),
@@ -69,15 +74,14 @@ class calculate_taxes_and_totals(object):
 					'company': self.doc.get('company')
 				}
 
-				item_group = item_doc.item_group
+				item_group = frappe.get_cached_value("Item", item.item_code, "item_group")
 				item_group_taxes = []
 
 				while item_group:
-					item_group_doc = frappe.get_cached_doc('Item Group', item_group)
-					item_group_taxes += item_group_doc.taxes or []
-					item_group = item_group_doc.parent_item_group
+					item_group_taxes += index.item_group_taxes.get(item_group, [])
+					item_group = index.parent_item_groups.get(item_group)
 
-				item_taxes = item_doc.taxes or []
+				item_taxes = index.item_taxes.get(item.item_code, [])
 
 				if not item_group_taxes and (not item_taxes):
 					# No validation if no taxes in item or item group
@@ -207,7 +211,14 @@ class calculate_taxes_and_totals(object):
 				self._set_in_company_currency(item, ["net_rate", "net_amount"])
 
 	def _load_item_tax_rate(self, item_tax_rate):
-		return json.loads(item_tax_rate) if item_tax_rate else {}
+		if not item_tax_rate:
+			return {}
+
+		# rows with the same item tax template share the parsed map, it is only read
+		if item_tax_rate not in self._item_tax_maps:
+			self._item_tax_maps[item_tax_rate] = json.loads(item_tax_rate)
+
+		return self._item_tax_maps[item_tax_rate]
 
 	def get_current_tax_fraction(self, tax, item_tax_map):
 		"""
@@ -266,6 +277,10 @@ class calculate_taxes_and_totals(object):
 		actual_tax_dict = dict([[tax.idx, flt(tax.tax_amount, tax.precision("tax_amount"))]
 			for tax in self.doc.get("taxes") if tax.charge_type == "Actual"])
 
+		if len(self.doc.get("items")) >= ITEM_COLUMNS_THRESHOLD and self.can_calculate_taxes_in_columns():
+			self.calculate_taxes_in_columns(actual_tax_dict)
+			return
+
 		for n, item in enumerate(self.doc.get("items")):
 			item_tax_map = self._load_item_tax_rate(item.item_tax_rate)
 			for i, tax in enumerate(self.doc.get("taxes")):
@@ -302,23 +317,122 @@ class calculate_taxes_and_totals(object):
 
 				# set precision in the last item iteration
 				if n == len(self.doc.get("items")) - 1:
-					self.round_off_totals(tax)
-					self._set_in_company_currency(tax,
-						["tax_amount", "tax_amount_after_discount_amount"])
-
-					self.round_off_base_values(tax)
-					self.set_cumulative_total(i, tax)
-
-					self._set_in_company_currency(tax, ["total"])
-
-					# adjust Discount Amount loss in last tax iteration
-					if i == (len(self.doc.get("taxes")) - 1) and self.discount_amount_applied \
-						and self.doc.discount_amount \
-						and self.doc.apply_discount_on == "Grand Total" \
-						and not self.doc.get('is_consolidated'):
-							self.doc.rounding_adjustment = flt(self.doc.grand_total
-								- flt(self.doc.discount_amount) - tax.total,
-								self.doc.precision("rounding_adjustment"))
+					self.set_tax_totals(i, tax)
+
+	def set_tax_totals(self, row_idx, tax):
+		self.round_off_totals(tax)
+		self._set_in_company_currency(tax,
+			["tax_amount", "tax_amount_after_discount_amount"])
+
+		self.round_off_base_values(tax)
+		self.set_cumulative_total(row_idx, tax)
+
+		self._set_in_company_currency(tax, ["total"])
+
+		# adjust Discount Amount loss in last tax iteration
+		if row_idx == (len(self.doc.get("taxes")) - 1) and self.discount_amount_applied \
+			and self.doc.discount_amount \
+			and self.doc.apply_discount_on == "Grand Total" \
+			and not self.doc.get('is_consolidated'):
+				self.doc.rounding_adjustment = flt(self.doc.grand_total
+					- flt(self.doc.discount_amount) - tax.total,
+					self.doc.precision("rounding_adjustment"))
+
+	def can_calculate_taxes_in_columns(self):
+		# previous row taxes must refer to an earlier row
+		for i, tax in enumerate(self.doc.get("taxes")):
+			if tax.charge_type in ["On Previous Row Amount", "On Previous Row Total"] \
+				and not 0 <= cint(tax.row_id) - 1 < i:
+				return False
+
+		return True
+
+	def calculate_taxes_in_columns(self, actual_tax_dict):
+		"""
+			Same as the item by item loop of `calculate_taxes`, computed one tax row at a time
+			over columns of item values. Every amount is added up in item order, so the totals,
+			divisional loss and item wise tax detail come out exactly the same.
+		"""
+		items = self.doc.get("items")
+		net_amounts = [item.net_amount for item in items]
+		item_tax_maps = [self._load_item_tax_rate(item.item_tax_rate) for item in items]
+		apply_on_tax_amount = not (self.discount_amount_applied and self.doc.apply_discount_on=="Grand Total")
+
+		# tax amount and grand total of every item, per tax row
+		tax_amount_columns = []
+		grand_total_columns = []
+
+		for i, tax in enumerate(self.doc.get("taxes")):
+			tax_rates = self.get_tax_rate_column(tax, item_tax_maps)
+
+			if tax.charge_type == "Actual":
+				# distribute the tax amount proportionally to each item row
+				actual = flt(tax.tax_amount, tax.precision("tax_amount"))
+				net_total = self.doc.net_total
+				current_tax_amounts = [net_amount*actual / net_total if net_total else 0.0
+					for net_amount in net_amounts]
+			elif tax.charge_type == "On Net Total":
+				current_tax_amounts = [(tax_rate / 100.0) * net_amount
+					for tax_rate, net_amount in zip(tax_rates, net_amounts)]
+			elif tax.charge_type == "On Previous Row Amount":
+				current_tax_amounts = [(tax_rate / 100.0) * previous_row_amount
+					for tax_rate, previous_row_amount in zip(tax_rates, tax_amount_columns[cint(tax.row_id) - 1])]
+			elif tax.charge_type == "On Previous Row Total":
+				current_tax_amounts = [(tax_rate / 100.0) * previous_row_total
+					for tax_rate, previous_row_total in zip(tax_rates, grand_total_columns[cint(tax.row_id) - 1])]
+			elif tax.charge_type == "On Item Quantity":
+				current_tax_amounts = [tax_rate * item.qty for tax_rate, item in zip(tax_rates, items)]
+			else:
+				current_tax_amounts = [0.0] * len(items)
+
+			if not (self.doc.get("is_consolidated") or tax.get("dont_recompute_tax")):
+				for item, tax_rate, current_tax_amount in zip(items, tax_rates, current_tax_amounts):
+					self.set_item_wise_tax(item, tax, tax_rate, current_tax_amount)
+
+			# Adjust divisional loss to the last item
+			if tax.charge_type == "Actual":
+				for current_tax_amount in current_tax_amounts:
+					actual_tax_dict[tax.idx] -= current_tax_amount
+				current_tax_amounts[-1] += actual_tax_dict[tax.idx]
+
+			tax_amount, tax_amount_after_discount_amount = tax.tax_amount, tax.tax_amount_after_discount_amount
+			for current_tax_amount in current_tax_amounts:
+				tax_amount += current_tax_amount
+				tax_amount_after_discount_amount += current_tax_amount
+
+			if tax.charge_type != "Actual" and apply_on_tax_amount:
+				tax.tax_amount = tax_amount
+			tax.tax_amount_after_discount_amount = tax_amount_after_discount_amount
+
+			# 1.0, -1.0 for deductions or 0.0 for valuation only
+			factor = self.get_tax_amount_if_for_valuation_or_deduction(1.0, tax)
+			previous_grand_totals = grand_total_columns[i-1] if i else net_amounts
+			grand_totals = [flt(previous_grand_total + current_tax_amount * factor)
+				for previous_grand_total, current_tax_amount in zip(previous_grand_totals, current_tax_amounts)]
+
+			tax_amount_columns.append(current_tax_amounts)
+			grand_total_columns.append(grand_totals)
+
+			tax.tax_amount_for_current_item = current_tax_amounts[-1]
+			tax.grand_total_for_current_item = grand_totals[-1]
+
+			self.set_tax_totals(i, tax)
+
+	def get_tax_rate_column(self, tax, item_tax_maps):
+		tax_rates = {}
+		precision = self.doc.precision("rate", tax)
+
+		def get_tax_rate(item_tax_map):
+			if tax.account_head not in item_tax_map:
+				return tax.rate
+
+			key = id(item_tax_map)
+			if key not in tax_rates:
+				tax_rates[key] = flt(item_tax_map.get(tax.account_head), precision)
+
+			return tax_rates[key]
+
+		return [get_tax_rate(item_tax_map) for item_tax_map in item_tax_maps]
 
 	def get_tax_amount_if_for_valuation_or_deduction(self, tax_amount, tax):
 		# if just for valuation, do not add the tax amount in total
@@ -0,0 +1,79 @@
+import json
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from erpnext.controllers import taxes_and_totals
+
+test_dependencies = ["Sales Invoice", "Purchase Invoice"]
+
+ITEM_FIELDS = ["net_rate", "net_amount", "base_net_rate", "base_net_amount", "amount", "base_amount"]
+TAX_FIELDS = ["tax_amount", "tax_amount_after_discount_amount", "base_tax_amount",
+	"base_tax_amount_after_discount_amount", "total", "base_total", "tax_amount_for_current_item",
+	"grand_total_for_current_item", "item_wise_tax_detail"]
+DOC_FIELDS = ["net_total", "total_taxes_and_charges", "grand_total", "rounding_adjustment"]
+
+
+class TestTaxesAndTotals(unittest.TestCase):
+	def test_sales_invoice_tax_columns(self):
+		si = frappe.copy_doc(frappe.get_test_records("Sales Invoice")[2])
+		si.append("taxes", {
+			"account_head": "_Test Account Service Tax - _TC",
+			"charge_type": "On Item Quantity",
+			"cost_center": "_Test Cost Center - _TC",
+			"description": "Service Tax",
+			"rate": 0.35
+		})
+		self.add_items(si)
+		self.assert_same_totals(si)
+
+		si.apply_discount_on = "Grand Total"
+		si.discount_amount = 123.45
+		self.assert_same_totals(si)
+
+	def test_purchase_invoice_tax_columns(self):
+		pi = frappe.copy_doc(frappe.get_test_records("Purchase Invoice")[0])
+		self.add_items(pi)
+		self.assert_same_totals(pi)
+
+	def test_inclusive_tax_columns(self):
+		si = frappe.copy_doc(frappe.get_test_records("Sales Invoice")[2])
+		si.taxes = [tax for tax in si.taxes if tax.charge_type != "Actual"]
+		for tax in si.taxes:
+			tax.included_in_print_rate = 1
+
+		self.add_items(si)
+		self.assert_same_totals(si)
+
+	def add_items(self, doc):
+		item = doc.items[0].as_dict()
+		doc.items = []
+		for i in range(taxes_and_totals.ITEM_COLUMNS_THRESHOLD + 17):
+			doc.append("items", dict(item,
+				name=None,
+				qty=(i % 7) + 1,
+				rate=round(10.0 + i * 3.37, 2),
+				price_list_rate=round(10.0 + i * 3.37, 2),
+				item_tax_rate=json.dumps({"_Test Account Excise Duty - _TC": 3.333}) if i % 3 == 0 else None
+			))
+
+	def assert_same_totals(self, doc):
+		by_rows = frappe.copy_doc(doc)
+		with patch.object(taxes_and_totals, "ITEM_COLUMNS_THRESHOLD", len(doc.items) + 1):
+			by_rows.calculate_taxes_and_totals()
+
+		by_columns = frappe.copy_doc(doc)
+		with patch.object(taxes_and_totals, "ITEM_COLUMNS_THRESHOLD", 1):
+			by_columns.calculate_taxes_and_totals()
+
+		for fieldname in DOC_FIELDS:
+			self.assertEqual(by_rows.get(fieldname), by_columns.get(fieldname), fieldname)
+
+		for expected, actual in zip(by_rows.items, by_columns.items):
+			for fieldname in ITEM_FIELDS:
+				self.assertEqual(expected.get(fieldname), actual.get(fieldname), fieldname)
+
+		for expected, actual in zip(by_rows.taxes, by_columns.taxes):
+			for fieldname in TAX_FIELDS:
+				self.assertEqual(expected.get(fieldname), actual.get(fieldname), fieldname)
@@ -965,14 +965,13 @@ def get_children(doctype, parent=None, is_root=False, **filters):
 		return bom_items
 
 def get_boms_in_bottom_up_order(bom_no=None):
-	def _get_parent(bom_no):
+	def _get_parents(bom_list):
 		return frappe.db.sql_list("""
 			select distinct bom_item.parent from `tabBOM Item` bom_item
-			where bom_item.bom_no = %s and bom_item.docstatus=1 and bom_item.parenttype='BOM'
+			where bom_item.bom_no in %s and bom_item.docstatus=1 and bom_item.parenttype='BOM'
 				and exists(select bom.name from `tabBOM` bom where bom.name=bom_item.parent and bom.is_active=1)
-		""", bom_no)
+		""", [bom_list])
 
-	count = 0
 	bom_list = []
 	if bom_no:
 		bom_list.append(bom_no)
@@ -983,11 +982,13 @@ def get_boms_in_bottom_up_order(bom_no=None):
 				and not exists(select bom_no from `tabBOM Item`
 					where parent=bom.name and ifnull(bom_no, '')!='')""")
 
-	while(count < len(bom_list)):
-		for child_bom in _get_parent(bom_list[count]):
-			if child_bom not in bom_list:
-				bom_list.append(child_bom)
-		count += 1
+	# parents of one level at a time
+	seen = set(bom_list)
+	level = bom_list
+	while level:
+		level = [parent for parent in _get_parents(level) if parent not in seen]
+		seen.update(level)
+		bom_list.extend(level)
 
 	return bom_list
 
@@ -0,0 +1,355 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+from collections import deque
+
+import frappe
+from frappe import _
+from frappe.model.meta import get_field_precision
+from frappe.utils import flt
+
+from erpnext.manufacturing.doctype.bom.bom import get_bom_item_rate
+
+BOM_COST_FIELDS = ["operating_cost", "base_operating_cost", "raw_material_cost", "base_raw_material_cost",
+	"scrap_material_cost", "base_scrap_material_cost", "total_cost", "base_total_cost"]
+BOM_ITEM_COST_FIELDS = ["rate", "amount", "base_rate", "base_amount", "qty_consumed_per_unit"]
+BOM_OPERATION_COST_FIELDS = ["hour_rate", "base_hour_rate", "time_in_mins", "operating_cost",
+	"base_operating_cost", "cost_per_unit", "base_cost_per_unit"]
+BOM_SCRAP_ITEM_COST_FIELDS = ["base_rate", "amount", "base_amount"]
+
+BULK_UPDATE_CHUNK_SIZE = 500
+
+
+class BOMCostRollup:
+	"""
+		Update the cost of all active submitted BOMs from the latest raw material rates and
+		workstation hour rates, as `BOM.update_cost` does for one BOM.
+
+		The BOMs with their items, operations and scrap items and the rates are loaded with a
+		few queries. Costs are computed in memory, sub-assembly BOMs before the BOMs using them,
+		and only the rows whose cost changed are written back. In a dry run nothing is written.
+
+		`run` returns the BOMs whose total cost changed, with the old and new cost.
+	"""
+	def __init__(self, dry_run=False):
+		self.dry_run = dry_run
+
+	def run(self):
+		self.load_boms()
+		self.load_rates()
+
+		self.exploded_items_changed = set()
+		for name in self.get_boms_in_topological_order():
+			self.calculate_cost(self.boms[name])
+
+		if not self.dry_run:
+			self.write_changes()
+
+		return self.get_cost_changes()
+
+	def load_boms(self):
+		self.boms = frappe._dict()
+		for d in frappe.db.sql("""
+			select
+				name, item, company, currency, quantity, conversion_rate, plc_conversion_rate,
+				rm_cost_as_per, buying_price_list, set_rate_of_sub_assembly_item_based_on_bom,
+				routing, {0}
+			from `tabBOM`
+			where docstatus = 1 and is_active = 1
+			order by name""".format(", ".join(BOM_COST_FIELDS)), as_dict=1):
+			d.update({"items": [], "operations": [], "scrap_items": []})
+			self.set_original_values(d, BOM_COST_FIELDS)
+			self.boms[d.name] = d
+
+		# unit cost of the sub-assembly BOMs, including active BOMs which are not submitted
+		self.unit_costs = {}
+		for d in frappe.db.sql("""select name, base_total_cost, quantity
+			from `tabBOM` where is_active = 1""", as_dict=1):
+			self.unit_costs[d.name] = flt(d.base_total_cost) / flt(d.quantity) if flt(d.quantity) else 0
+
+		for table_field, doctype, fields in (
+			("items", "BOM Item", ["item_code", "bom_no", "qty", "uom", "stock_qty", "stock_uom",
+				"conversion_factor", "sourced_by_supplier"] + BOM_ITEM_COST_FIELDS),
+			("operations", "BOM Operation", ["workstation", "operation", "batch_size",
+				"set_cost_based_on_bom_qty"] + BOM_OPERATION_COST_FIELDS),
+			("scrap_items", "BOM Scrap Item", ["rate", "stock_qty"] + BOM_SCRAP_ITEM_COST_FIELDS)):
+			cost_fields = {
+				"items": BOM_ITEM_COST_FIELDS,
+				"operations": BOM_OPERATION_COST_FIELDS,
+				"scrap_items": BOM_SCRAP_ITEM_COST_FIELDS
+			}[table_field]
+
+			for d in frappe.db.sql("""
+				select child.name, child.parent, {fields}
+				from `tab{doctype}` child, `tabBOM` bom
+				where child.parent = bom.name and child.parenttype = 'BOM'
+					and bom.docstatus = 1 and bom.is_active = 1
+				order by child.parent, child.idx""".format( #nosec
+					fields=", ".join("child.`{0}`".format(f) for f in set(fields)), doctype=doctype), as_dict=1):
+				self.set_original_values(d, cost_fields)
+				self.boms[d.parent][table_field].append(d)
+
+		self.precisions = frappe._dict()
+		for doctype, fieldnames in (("BOM", ["quantity", "conversion_rate"]),
+			("BOM Item", ["rate", "qty", "stock_qty"]),
+			("BOM Scrap Item", ["rate", "stock_qty", "amount"])):
+			meta = frappe.get_meta(doctype)
+			for fieldname in fieldnames:
+				self.precisions[(doctype, fieldname)] = get_field_precision(meta.get_field(fieldname))
+
+	def set_original_values(self, row, fields):
+		row.original_values = {fieldname: row.get(fieldname) for fieldname in fields}
+
+	def load_rates(self):
+		self.item_details = {d.name: d for d in frappe.db.sql("""
+			select name, is_customer_provided_item, last_purchase_rate, valuation_rate
+			from `tabItem` item
+			where exists(select name from `tabBOM Item` bom_item
+				where bom_item.item_code = item.name and bom_item.parenttype = 'BOM')""", as_dict=1)}
+
+		self.hour_rates = dict(frappe.db.sql("select name, hour_rate from `tabWorkstation`"))
+
+		self.routing_times = {}
+		for d in frappe.db.sql("""
+			select parent, workstation, operation, time_in_mins
+			from `tabBOM Operation` where parenttype = 'Routing'
+			order by parent, idx""", as_dict=1):
+			self.routing_times.setdefault((d.parent, d.workstation, d.operation), d.time_in_mins)
+
+		# weighted average valuation rate of the item in the warehouses of the company
+		self.bin_rates = {}
+		for d in frappe.db.sql("""
+			select bin.item_code, warehouse.company,
+				sum(bin.actual_qty) as actual_qty, sum(bin.stock_value) as stock_value
+			from `tabBin` bin, `tabWarehouse` warehouse
+			where bin.warehouse = warehouse.name
+				and exists(select name from `tabBOM Item` bom_item
+					where bom_item.item_code = bin.item_code and bom_item.parenttype = 'BOM')
+			group by bin.item_code, warehouse.company""", as_dict=1):
+			if flt(d.actual_qty):
+				self.bin_rates[(d.item_code, d.company)] = flt(d.stock_value) / flt(d.actual_qty)
+
+		# last valuation rate of any company, for the items without a positive rate in the bins
+		# of the company of the BOM
+		self.last_valuation_rates = {}
+		item_companies = {(d.item_code, bom.company) for bom in self.boms.values() for d in bom["items"]
+			if d.item_code and self.bin_rates.get((d.item_code, bom.company), 0.0) <= 0}
+		item_codes = list({item_code for item_code, company in item_companies})
+
+		if item_codes:
+			# entries at the last posting datetime of each item, the one created last wins
+			last_rates = dict(frappe.db.sql("""
+				select sle.item_code, sle.valuation_rate
+				from `tabStock Ledger Entry` sle
+				join (
+					select item_code, max(posting_datetime) as posting_datetime
+					from `tabStock Ledger Entry`
+					where item_code in %(item_codes)s and valuation_rate > 0 and is_cancelled = 0
+					group by item_code
+				) last_sle on sle.item_code = last_sle.item_code and sle.posting_datetime = last_sle.posting_datetime
+				where sle.valuation_rate > 0 and sle.is_cancelled = 0
+				order by sle.creation""", {"item_codes": item_codes}))
+
+			for item_code, company in item_companies:
+				if item_code in last_rates:
+					self.last_valuation_rates[(item_code, company)] = last_rates[item_code]
+
+	def get_boms_in_topological_order(self):
+		"""BOMs in the order of their sub-assembly BOMs first"""
+		parents, pending_children = {}, {}
+		for name, bom in self.boms.items():
+			children = {d.bom_no for d in bom["items"] if d.bom_no in self.boms and d.bom_no != name}
+			pending_children[name] = len(children)
+			for child in children:
+				parents.setdefault(child, []).append(name)
+
+		queue = deque(name for name, count in pending_children.items() if not count)
+		bom_list = []
+		while queue:
+			name = queue.popleft()
+			bom_list.append(name)
+			for parent in parents.get(name, []):
+				pending_children[parent] -= 1
+				if not pending_children[parent]:
+					queue.append(parent)
+
+		if len(bom_list) < len(self.boms):
+			recursive_boms = sorted(set(self.boms) - set(bom_list))
+			frappe.log_error(_("BOM recursion, cost not updated for: {0}").format(", ".join(recursive_boms)),
+				_("BOM Cost Update"))
+
+		return bom_list
+
+	def calculate_cost(self, bom):
+		for d in bom["items"]:
+			if not d.item_code:
+				continue
+
+			rate = self.get_rm_rate(bom, d)
+			if rate:
+				d.rate = rate
+
+		self.calculate_op_cost(bom)
+		self.calculate_rm_cost(bom)
+		self.calculate_sm_cost(bom)
+
+		bom.total_cost = bom.operating_cost + bom.raw_material_cost - bom.scrap_material_cost
+		bom.base_total_cost = bom.base_operating_cost + bom.base_raw_material_cost - bom.base_scrap_material_cost
+
+		self.unit_costs[bom.name] = flt(bom.base_total_cost) / flt(bom.quantity) if flt(bom.quantity) else 0
+
+		# the exploded items carry the rates of the raw materials and of the sub-assembly BOMs' exploded items
+		if any(d.bom_no in self.exploded_items_changed if d.bom_no
+			else self.has_changed(d, ["base_rate"]) for d in bom["items"]):
+			self.exploded_items_changed.add(bom.name)
+
+	def get_rm_rate(self, bom, row):
+		"""Rate of the raw material as in `BOM.get_rm_rate`"""
+		rate = 0
+		item = self.item_details.get(row.item_code) or frappe._dict()
+
+		# Customer Provided parts and Supplier sourced parts will have zero rate
+		if not item.is_customer_provided_item and not row.sourced_by_supplier:
+			if row.bom_no and bom.set_rate_of_sub_assembly_item_based_on_bom:
+				rate = flt(self.unit_costs.get(row.bom_no)) * (row.conversion_factor or 1)
+			elif (bom.rm_cost_as_per or "Valuation Rate") == "Valuation Rate":
+				rate = self.get_valuation_rate(row.item_code, bom.company) * (row.conversion_factor or 1)
+			elif bom.rm_cost_as_per == "Last Purchase Rate":
+				rate = flt(item.last_purchase_rate) * (row.conversion_factor or 1)
+			else:
+				rate = get_bom_item_rate({
+					"company": bom.company,
+					"item_code": row.item_code,
+					"bom_no": row.bom_no,
+					"qty": row.qty,
+					"uom": row.uom,
+					"stock_uom": row.stock_uom,
+					"conversion_factor": row.conversion_factor,
+					"sourced_by_supplier": row.sourced_by_supplier
+				}, bom)
+
+		return flt(rate) * flt(bom.plc_conversion_rate or 1) / (bom.conversion_rate or 1)
+
+	def get_valuation_rate(self, item_code, company):
+		"""Valuation rate of the item as in `bom.get_valuation_rate`"""
+		valuation_rate = self.bin_rates.get((item_code, company), 0.0)
+
+		if valuation_rate <= 0:
+			valuation_rate = flt(self.last_valuation_rates.get((item_code, company)))
+
+		if not valuation_rate:
+			valuation_rate = (self.item_details.get(item_code) or {}).get("valuation_rate")
+
+		return flt(valuation_rate)
+
+	def calculate_op_cost(self, bom):
+		bom.operating_cost = bom.base_operating_cost = 0
+
+		for d in bom["operations"]:
+			if d.workstation:
+				self.update_rate_and_time(bom, d)
+
+			operating_cost = d.operating_cost
+			base_operating_cost = d.base_operating_cost
+			if d.set_cost_based_on_bom_qty:
+				operating_cost = flt(d.cost_per_unit) * flt(bom.quantity)
+				base_operating_cost = flt(d.base_cost_per_unit) * flt(bom.quantity)
+
+			bom.operating_cost += flt(operating_cost)
+			bom.base_operating_cost += flt(base_operating_cost)
+
+	def update_rate_and_time(self, bom, row):
+		hour_rate = flt(self.hour_rates.get(row.workstation))
+		if hour_rate:
+			row.hour_rate = (hour_rate / flt(bom.conversion_rate)
+				if bom.conversion_rate and hour_rate else hour_rate)
+
+		if bom.routing:
+			time_in_mins = flt(self.routing_times.get((bom.routing, row.workstation, row.operation)))
+			if time_in_mins:
+				row.time_in_mins = time_in_mins
+
+		if row.hour_rate and row.time_in_mins:
+			row.base_hour_rate = flt(row.hour_rate) * flt(bom.conversion_rate)
+			row.operating_cost = flt(row.hour_rate) * flt(row.time_in_mins) / 60.0
+			row.base_operating_cost = flt(row.operating_cost) * flt(bom.conversion_rate)
+			row.cost_per_unit = row.operating_cost / (row.batch_size or 1.0)
+			row.base_cost_per_unit = row.base_operating_cost / (row.batch_size or 1.0)
+
+	def calculate_rm_cost(self, bom):
+		bom.raw_material_cost = bom.base_raw_material_cost = 0
+		precision = self.precisions
+
+		for d in bom["items"]:
+			d.base_rate = flt(d.rate) * flt(bom.conversion_rate)
+			d.amount = flt(d.rate, precision[("BOM Item", "rate")]) * flt(d.qty, precision[("BOM Item", "qty")])
+			d.base_amount = d.amount * flt(bom.conversion_rate)
+			d.qty_consumed_per_unit = flt(d.stock_qty, precision[("BOM Item", "stock_qty")]) \
+				/ flt(bom.quantity, precision[("BOM", "quantity")])
+
+			bom.raw_material_cost += d.amount
+			bom.base_raw_material_cost += d.base_amount
+
+	def calculate_sm_cost(self, bom):
+		bom.scrap_material_cost = bom.base_scrap_material_cost = 0
+		precision = self.precisions
+		conversion_rate = flt(bom.conversion_rate, precision[("BOM", "conversion_rate")])
+
+		for d in bom["scrap_items"]:
+			d.base_rate = flt(d.rate, precision[("BOM Scrap Item", "rate")]) * conversion_rate
+			d.amount = flt(d.rate, precision[("BOM Scrap Item", "rate")]) \
+				* flt(d.stock_qty, precision[("BOM Scrap Item", "stock_qty")])
+			d.base_amount = flt(d.amount, precision[("BOM Scrap Item", "amount")]) * conversion_rate
+
+			bom.scrap_material_cost += d.amount
+			bom.base_scrap_material_cost += d.base_amount
+
+	def has_changed(self, row, fields):
+		return any(flt(row.get(fieldname), 9) != flt(row.original_values.get(fieldname), 9)
+			for fieldname in fields)
+
+	def write_changes(self):
+		for table_field, doctype, fields in (
+			("items", "BOM Item", BOM_ITEM_COST_FIELDS),
+			("operations", "BOM Operation", BOM_OPERATION_COST_FIELDS),
+			("scrap_items", "BOM Scrap Item", BOM_SCRAP_ITEM_COST_FIELDS)):
+			bulk_update(doctype, [d for bom in self.boms.values() for d in bom[table_field]
+				if self.has_changed(d, fields)], fields)
+
+		bulk_update("BOM", [bom for bom in self.boms.values() if self.has_changed(bom, BOM_COST_FIELDS)],
+			BOM_COST_FIELDS)
+
+		# rebuilt from the saved rates, sub-assembly BOMs first
+		for name in self.get_boms_in_topological_order():
+			if name in self.exploded_items_changed:
+				frappe.get_doc("BOM", name).update_exploded_items(save=True)
+
+	def get_cost_changes(self):
+		return [frappe._dict({
+			"bom": bom.name,
+			"item": bom.item,
+			"company": bom.company,
+			"currency": bom.currency,
+			"old_cost": flt(bom.original_values["total_cost"]),
+			"new_cost": flt(bom.total_cost),
+			"difference": flt(bom.total_cost) - flt(bom.original_values["total_cost"])
+		}) for bom in self.boms.values() if self.has_changed(bom, ["total_cost", "base_total_cost"])]
+
+def bulk_update(doctype, rows, fields):
+	"""Set the fields of the rows by name, with one query per chunk of rows"""
+	for start in range(0, len(rows), BULK_UPDATE_CHUNK_SIZE):
+		chunk = rows[start:start + BULK_UPDATE_CHUNK_SIZE]
+
+		values = []
+		set_values = []
+		for fieldname in fields:
+			set_values.append("`{0}` = case name {1} end".format(fieldname,
+				" ".join(["when %s then %s"] * len(chunk))))
+			for d in chunk:
+				values.extend([d.name, d.get(fieldname)])
+
+		values.extend(d.name for d in chunk)
+
+		frappe.db.sql("""update `tab{0}` set {1} where name in ({2})""".format(doctype, #nosec
+			", ".join(set_values), ", ".join(["%s"] * len(chunk))), values)
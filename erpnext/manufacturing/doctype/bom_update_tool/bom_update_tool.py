@@ -10,7 +10,7 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import cstr, flt
 
-from erpnext.manufacturing.doctype.bom.bom import get_boms_in_bottom_up_order
+from erpnext.manufacturing.doctype.bom_update_tool.bom_cost_rollup import BOMCostRollup
 
 
 class BOMUpdateTool(Document):
@@ -106,8 +106,6 @@ def replace_bom(args):
 
 def update_cost():
 	frappe.db.auto_commit_on_many_writes = 1
-	bom_list = get_boms_in_bottom_up_order()
-	for bom in bom_list:
-		frappe.get_doc("BOM", bom).update_cost(update_parent=False, from_child_bom=True)
+	BOMCostRollup().run()
 
 	frappe.db.auto_commit_on_many_writes = 0
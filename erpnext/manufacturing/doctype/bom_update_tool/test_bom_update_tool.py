@@ -7,9 +7,12 @@ import unittest
 
 import frappe
 
+from erpnext.manufacturing.doctype.bom.bom import get_valuation_rate
+from erpnext.manufacturing.doctype.bom_update_tool.bom_cost_rollup import BOMCostRollup
 from erpnext.manufacturing.doctype.bom_update_tool.bom_update_tool import update_cost
 from erpnext.manufacturing.doctype.production_plan.test_production_plan import make_bom
 from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
 
 test_records = frappe.get_test_records('BOM')
 
@@ -60,3 +63,60 @@ class TestBOMUpdateTool(unittest.TestCase):
 
 		doc.load_from_db()
 		self.assertEqual(doc.total_cost, 200)
+
+	def test_bom_cost_dry_run(self):
+		for item in ["BOM Cost Test Item 4", "BOM Cost Test Item 5", "BOM Cost Test Item 6"]:
+			create_item(item, valuation_rate=100)
+			frappe.db.set_value("Item", item, "valuation_rate", 100)
+
+		sub_assembly_bom = frappe.db.get_value("BOM", {"item": "BOM Cost Test Item 5", "docstatus": 1})
+		if not sub_assembly_bom:
+			sub_assembly_bom = make_bom(item="BOM Cost Test Item 5",
+				raw_materials=["BOM Cost Test Item 6"], currency="INR").name
+
+		bom_no = frappe.db.get_value("BOM", {"item": "BOM Cost Test Item 4", "docstatus": 1})
+		if not bom_no:
+			bom = make_bom(item="BOM Cost Test Item 4", raw_materials=["BOM Cost Test Item 5"],
+				currency="INR", do_not_submit=True)
+			bom.items[0].bom_no = sub_assembly_bom
+			bom.set_rate_of_sub_assembly_item_based_on_bom = 1
+			bom.submit()
+			bom_no = bom.name
+
+		update_cost()
+		self.assertEqual(frappe.db.get_value("BOM", bom_no, "total_cost"), 100)
+
+		frappe.db.set_value("Item", "BOM Cost Test Item 6", "valuation_rate", 150)
+		changes = {d.bom: d for d in BOMCostRollup(dry_run=True).run()}
+
+		# the change is carried from the sub-assembly BOM to its parent, but not saved
+		self.assertEqual(changes[sub_assembly_bom].new_cost, 150)
+		self.assertEqual(changes[bom_no].old_cost, 100)
+		self.assertEqual(changes[bom_no].new_cost, 150)
+		self.assertEqual(frappe.db.get_value("BOM", bom_no, "total_cost"), 100)
+
+		update_cost()
+		self.assertEqual(frappe.db.get_value("BOM", bom_no, "total_cost"), 150)
+		self.assertEqual(frappe.db.get_value("BOM Explosion Item",
+			{"parent": bom_no, "item_code": "BOM Cost Test Item 6"}, "rate"), 150)
+
+		frappe.db.set_value("Item", "BOM Cost Test Item 6", "valuation_rate", 100)
+		update_cost()
+		self.assertEqual(frappe.db.get_value("BOM", bom_no, "total_cost"), 100)
+		self.assertNotIn(bom_no, [d.bom for d in BOMCostRollup(dry_run=True).run()])
+
+		# an item in stock in one company only, the BOMs of the other company use its last valuation rate
+		create_item("BOM Cost Test Item 7", valuation_rate=100)
+		create_item("BOM Cost Test Item 8", valuation_rate=100)
+		if not frappe.db.get_value("BOM", {"item": "BOM Cost Test Item 8", "company": "_Test Company 1", "docstatus": 1}):
+			make_bom(item="BOM Cost Test Item 8", raw_materials=["BOM Cost Test Item 7"],
+				company="_Test Company 1", currency="USD")
+
+		make_stock_entry(item_code="BOM Cost Test Item 7", target="_Test Warehouse - _TC", qty=1, basic_rate=200)
+
+		rollup = BOMCostRollup(dry_run=True)
+		rollup.run()
+		for company in ("_Test Company", "_Test Company 1"):
+			self.assertEqual(rollup.get_valuation_rate("BOM Cost Test Item 7", company),
+				get_valuation_rate({"item_code": "BOM Cost Test Item 7", "company": company}))
+		self.assertEqual(rollup.get_valuation_rate("BOM Cost Test Item 7", "_Test Company 1"), 200)
@@ -303,7 +303,19 @@ frappe.ui.form.on('Production Plan', {
 	get_items_for_material_requests: function(frm, warehouses) {
 		const set_fields = ['actual_qty', 'item_code','item_name', 'description', 'uom', 'from_warehouse',
 			'min_order_qty', 'required_bom_qty', 'quantity', 'sales_order', 'warehouse', 'projected_qty', 'ordered_qty',
-			'reserved_qty_for_production', 'material_request_type'];
+			'reserved_qty_for_production', 'material_request_type', 'schedule_date'];
+
+		if (!frm.is_dirty() && !frm.is_new() && (frm.doc.po_items || []).length > 100) {
+			// plan large production plans in the background
+			frappe.call({
+				method: "erpnext.manufacturing.doctype.production_plan.production_plan.enqueue_material_request_planning",
+				args: {
+					production_plan: frm.doc.name,
+					warehouses: warehouses || []
+				}
+			});
+			return;
+		}
 
 		frappe.call({
 			method: "erpnext.manufacturing.doctype.production_plan.production_plan.get_items_for_material_requests",
@@ -501,7 +501,7 @@ class ProductionPlan(Document):
 
 			# key for Sales Order:Material Request Type:Customer
 			key = '{}:{}:{}'.format(item.sales_order, material_request_type, item_doc.customer or '')
-			schedule_date = add_days(nowdate(), cint(item_doc.lead_time_days))
+			schedule_date = item.schedule_date or add_days(nowdate(), cint(item_doc.lead_time_days))
 
 			if not key in material_request_map:
 				# make a new MR for the combination
@@ -642,7 +642,37 @@ def get_uom_conversion_factor(item_code, uom):
 
 def get_subitems(doc, data, item_details, bom_no, company, include_non_stock_items,
 	include_subcontracted_items, parent_qty, planned_qty=1):
-	items = frappe.db.sql("""
+	if data.get('include_exploded_items') and flt(parent_qty) * flt(planned_qty) > 0:
+		# multi-level explosion, qty per unit of the BOM
+		for d in get_bom_explosion(bom_no, company, include_non_stock_items, include_subcontracted_items):
+			d = frappe._dict(d, qty=d.qty * flt(parent_qty) * flt(planned_qty))
+			if d.item_code in item_details:
+				item_details[d.item_code].qty = item_details[d.item_code].qty + d.qty
+			else:
+				item_details[d.item_code] = d
+
+		return item_details
+
+	for d in get_bom_subitems(bom_no, company, include_non_stock_items, parent_qty, planned_qty):
+		if not data.get('include_exploded_items') or not d.default_bom:
+			if d.item_code in item_details:
+				item_details[d.item_code].qty = item_details[d.item_code].qty + d.qty
+			else:
+				if not d.conversion_factor and d.purchase_uom:
+					d.conversion_factor = get_uom_conversion_factor(d.item_code, d.purchase_uom)
+
+				item_details[d.item_code] = d
+
+		if data.get('include_exploded_items') and d.default_bom:
+			if ((d.default_material_request_type in ["Manufacture", "Purchase"] and
+				not d.is_sub_contracted) or (d.is_sub_contracted and include_subcontracted_items)):
+				if d.qty > 0:
+					get_subitems(doc, data, item_details, d.default_bom, company,
+						include_non_stock_items, include_subcontracted_items, d.qty)
+	return item_details
+
+def get_bom_subitems(bom_no, company, include_non_stock_items, parent_qty, planned_qty=1):
+	return frappe.db.sql("""
 		SELECT
 			bom_item.item_code, default_material_request_type, item.item_name,
 			ifnull(%(parent_qty)s * sum(bom_item.stock_qty/ifnull(bom.quantity, 1)) * %(planned_qty)s, 0) as qty,
@@ -669,23 +699,61 @@ def get_subitems(doc, data, item_details, bom_no, company, include_non_stock_ite
 			'company': company
 		}, as_dict=1)
 
-	for d in items:
-		if not data.get('include_exploded_items') or not d.default_bom:
-			if d.item_code in item_details:
-				item_details[d.item_code].qty = item_details[d.item_code].qty + d.qty
-			else:
+def get_bom_explosion(bom_no, company, include_non_stock_items, include_subcontracted_items):
+	"""
+		Items of the BOM exploded through the default BOMs of its sub-assemblies, as `get_subitems`
+		does with `include_exploded_items`, with the qty per unit of the BOM.
+
+		The explosion is cached along with the modified timestamps of the BOMs it was built from
+		and of all their items, including the ones left out as non-stock items, and rebuilt when
+		any of them has changed. UOM conversion factors and defaults are child rows of the item.
+	"""
+	key = "{0}::{1}::{2}::{3}".format(bom_no, company, cint(include_non_stock_items),
+		cint(include_subcontracted_items))
+
+	explosion = frappe.cache().hget("bom_explosion", key)
+	if not explosion or any(get_modified_timestamps(doctype, timestamps) != timestamps
+		for doctype, timestamps in explosion["versions"].items()):
+		explosion = build_bom_explosion(bom_no, company, include_non_stock_items, include_subcontracted_items)
+		frappe.cache().hset("bom_explosion", key, explosion)
+
+	return explosion["rows"]
+
+def build_bom_explosion(bom_no, company, include_non_stock_items, include_subcontracted_items):
+	rows, boms = [], set()
+
+	def _explode(bom_no, parent_qty):
+		boms.add(bom_no)
+		for d in get_bom_subitems(bom_no, company, include_non_stock_items, parent_qty):
+			if not d.default_bom:
 				if not d.conversion_factor and d.purchase_uom:
 					d.conversion_factor = get_uom_conversion_factor(d.item_code, d.purchase_uom)
 
-				item_details[d.item_code] = d
-
-		if data.get('include_exploded_items') and d.default_bom:
-			if ((d.default_material_request_type in ["Manufacture", "Purchase"] and
+				rows.append(d)
+			elif ((d.default_material_request_type in ["Manufacture", "Purchase"] and
 				not d.is_sub_contracted) or (d.is_sub_contracted and include_subcontracted_items)):
 				if d.qty > 0:
-					get_subitems(doc, data, item_details, d.default_bom, company,
-						include_non_stock_items, include_subcontracted_items, d.qty)
-	return item_details
+					_explode(d.default_bom, d.qty)
+
+	_explode(bom_no, 1)
+
+	items = frappe.get_all("BOM Item", filters={"parent": ("in", list(boms))},
+		pluck="item_code", distinct=True)
+
+	return {
+		"rows": rows,
+		"versions": {
+			"BOM": get_modified_timestamps("BOM", boms),
+			"Item": get_modified_timestamps("Item", items)
+		}
+	}
+
+def get_modified_timestamps(doctype, names):
+	if not names:
+		return {}
+
+	return dict(frappe.db.sql("""select name, modified from `tab{0}`
+		where name in %s""".format(doctype), [list(names)])) #nosec
 
 def get_material_request_items(row, sales_order, company,
 	ignore_existing_ordered_qty, include_safety_stock, warehouse, bin_dict):
@@ -710,7 +778,7 @@ def get_material_request_items(row, sales_order, company,
 
 			required_qty = required_qty / row['conversion_factor']
 
-	if frappe.db.get_value("UOM", row['purchase_uom'], "must_be_whole_number"):
+	if frappe.get_cached_value("UOM", row['purchase_uom'], "must_be_whole_number"):
 		required_qty = ceil(required_qty)
 
 	if include_safety_stock:
@@ -804,6 +872,49 @@ def get_bin_details(row, company, for_warehouse=None, all_warehouse=False):
 		group by item_code, warehouse
 	""".format(conditions=conditions), { "item_code": row['item_code'] }, as_dict=1)
 
+def get_bin_details_for_rows(rows, company, for_warehouse=None):
+	"""First bin of each row as returned by `get_bin_details`, with the bins of all rows fetched together"""
+	item_codes = list({row['item_code'] for row in rows})
+	if not item_codes:
+		return []
+
+	bins = {}
+	for d in frappe.db.sql("""
+		select
+			bin.item_code, bin.warehouse, warehouse.lft, warehouse.rgt,
+			ifnull(bin.projected_qty, 0) as projected_qty, ifnull(bin.actual_qty, 0) as actual_qty,
+			ifnull(bin.ordered_qty, 0) as ordered_qty, ifnull(bin.planned_qty, 0) as planned_qty,
+			ifnull(bin.reserved_qty_for_production, 0) as reserved_qty_for_production
+		from `tabBin` bin, `tabWarehouse` warehouse
+		where bin.warehouse = warehouse.name
+			and warehouse.company = %s
+			and bin.item_code in %s
+		order by bin.item_code, bin.warehouse""", (company, item_codes), as_dict=1):
+		bins.setdefault(d.pop("item_code"), []).append(d)
+
+	warehouses = list({for_warehouse or row.get('source_warehouse') or row.get('default_warehouse')
+		for row in rows} - {None, ""})
+	warehouse_bounds = {d.name: (d.lft, d.rgt) for d in frappe.db.sql("""
+		select name, lft, rgt from `tabWarehouse` where name in %s""", [warehouses], as_dict=1)} if warehouses else {}
+
+	bin_details = []
+	for row in rows:
+		item_bins = bins.get(row['item_code'], [])
+
+		warehouse = for_warehouse or row.get('source_warehouse') or row.get('default_warehouse')
+		if warehouse:
+			lft, rgt = warehouse_bounds.get(warehouse, (None, None))
+			item_bins = [d for d in item_bins if lft is not None and d.lft >= lft and d.rgt <= rgt]
+
+		if item_bins:
+			bin_dict = item_bins[0].copy()
+			del bin_dict["lft"], bin_dict["rgt"]
+			bin_details.append(bin_dict)
+		else:
+			bin_details.append({})
+
+	return bin_details
+
 @frappe.whitelist()
 def get_so_details(sales_order):
 	return frappe.db.get_value("Sales Order", sales_order,
@@ -826,7 +937,7 @@ def get_warehouse_list(warehouses):
 	return warehouse_list
 
 @frappe.whitelist()
-def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_data=None):
+def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_data=None, publish_progress=False):
 	if isinstance(doc, str):
 		doc = frappe._dict(json.loads(doc))
 
@@ -849,6 +960,7 @@ def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_d
 	include_safety_stock = doc.get('include_safety_stock')
 
 	so_item_details = frappe._dict()
+	requirements = []
 	for data in po_items:
 		if not data.get("include_exploded_items") and doc.get("sub_assembly_items"):
 			data["include_exploded_items"] = 1
@@ -905,6 +1017,10 @@ def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_d
 
 		sales_order = doc.get("sales_order")
 
+		required_date = getdate(data.get("planned_start_date") or doc.get("posting_date") or nowdate())
+		for details in item_details.values():
+			requirements.append((frappe._dict(details), required_date))
+
 		for item_code, details in item_details.items():
 			so_item_details.setdefault(sales_order, frappe._dict())
 			if item_code in so_item_details.get(sales_order, {}):
@@ -912,18 +1028,25 @@ def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_d
 			else:
 				so_item_details[sales_order][item_code] = details
 
-	mr_items = []
-	for sales_order, item_code in so_item_details.items():
-		item_dict = so_item_details[sales_order]
-		for details in item_dict.values():
-			bin_dict = get_bin_details(details, doc.company, warehouse)
-			bin_dict = bin_dict[0] if bin_dict else {}
+	if doc.get("time_phased_planning"):
+		from erpnext.manufacturing.doctype.production_plan.time_phased_planning import TimePhasedPlanning
+
+		mr_items = TimePhasedPlanning(doc, [(details, required_date) for details, required_date in requirements
+			if details.qty > 0], ignore_existing_ordered_qty, include_safety_stock).get_material_request_items()
+	else:
+		rows = [(sales_order, details) for sales_order, item_dict in so_item_details.items()
+			for details in item_dict.values() if details.qty > 0]
+		bin_details = get_bin_details_for_rows([details for sales_order, details in rows], doc.company, warehouse)
 
-			if details.qty > 0:
-				items = get_material_request_items(details, sales_order, company,
-					ignore_existing_ordered_qty, include_safety_stock, warehouse, bin_dict)
-				if items:
-					mr_items.append(items)
+		mr_items = []
+		for idx, (sales_order, details) in enumerate(rows):
+			items = get_material_request_items(details, sales_order, company,
+				ignore_existing_ordered_qty, include_safety_stock, warehouse, bin_details[idx])
+			if items:
+				mr_items.append(items)
+
+			if publish_progress and idx % 100 == 0:
+				frappe.publish_progress(idx * 100 / len(rows), title=_("Planning Material Requests..."))
 
 	if (not ignore_existing_ordered_qty or get_parent_warehouse_data) and warehouses:
 		new_mr_items = []
@@ -942,6 +1065,25 @@ def get_items_for_material_requests(doc, warehouses=None, get_parent_warehouse_d
 
 	return mr_items
 
+@frappe.whitelist()
+def enqueue_material_request_planning(production_plan, warehouses=None):
+	frappe.enqueue(set_material_request_plan_items, queue="long", timeout=3600,
+		production_plan=production_plan, warehouses=warehouses)
+	frappe.msgprint(_("Material Request Plan Items are being fetched in the background. "
+		"The Production Plan will be updated when they are ready."))
+
+def set_material_request_plan_items(production_plan, warehouses=None):
+	doc = frappe.get_doc("Production Plan", production_plan)
+
+	mr_items = get_items_for_material_requests(doc.as_dict(), warehouses=warehouses, publish_progress=True)
+
+	doc.set("mr_items", [])
+	for d in mr_items:
+		doc.append("mr_items", d)
+
+	doc.save()
+	doc.notify_update()
+
 def get_materials_from_other_locations(item, warehouses, new_mr_items, company):
 	from erpnext.stock.doctype.pick_list.pick_list import get_available_item_locations
 	locations = get_available_item_locations(item.get("item_code"),
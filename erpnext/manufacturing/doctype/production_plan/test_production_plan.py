@@ -4,16 +4,20 @@
 import unittest
 
 import frappe
-from frappe.utils import add_to_date, flt, now_datetime, nowdate
+from frappe.utils import add_to_date, flt, getdate, now_datetime, nowdate
 
 from erpnext.controllers.item_variant import create_variant
 from erpnext.manufacturing.doctype.production_plan.production_plan import (
+	get_bin_details,
+	get_bin_details_for_rows,
 	get_items_for_material_requests,
 	get_sales_orders,
+	get_subitems,
 	get_warehouse_list,
 )
 from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
 from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.material_request.test_material_request import make_material_request
 from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import (
 	create_stock_reconciliation,
 )
@@ -273,6 +277,121 @@ class TestProductionPlan(unittest.TestCase):
 		pln.cancel()
 		frappe.delete_doc("Production Plan", pln.name)
 
+	def test_cached_bom_explosion(self):
+		for item_code in ["Test BOM 4", "Test BOM 5", "Test BOM 6", "Test RM BOM 2"]:
+			create_item(item_code, is_stock_item=1)
+
+		if not frappe.db.get_value('BOM', {'item': "Test BOM 6"}):
+			make_bom(item = "Test BOM 6", raw_materials = ["Test RM BOM 2"], rm_qty=3)
+
+		if not frappe.db.get_value('BOM', {'item': "Test BOM 5"}):
+			make_bom(item = "Test BOM 5", raw_materials = ["Test BOM 6", "Test RM BOM 2"], rm_qty=3)
+
+		if not frappe.db.get_value('BOM', {'item': "Test BOM 4"}):
+			make_bom(item = "Test BOM 4", raw_materials = ["Test BOM 5"], rm_qty=2)
+
+		def _get_subitems():
+			return get_subitems(None, {"include_exploded_items": 1}, {},
+				frappe.db.get_value('BOM', {'item': "Test BOM 4"}), "_Test Company", 0, 0, 1, planned_qty=2)
+
+		# built, then read from the cache
+		for i in range(2):
+			item_details = _get_subitems()
+			self.assertEqual(list(item_details), ["Test RM BOM 2"])
+			self.assertEqual(item_details["Test RM BOM 2"].qty, 2 * 2 * (3 * 3 + 3))
+
+		# a change in a sub-assembly item is picked up
+		frappe.db.set_value("Item", "Test BOM 6", "default_material_request_type", "Material Transfer")
+		item_details = _get_subitems()
+		self.assertEqual(item_details["Test RM BOM 2"].qty, 2 * 2 * 3)
+
+		frappe.db.set_value("Item", "Test BOM 6", "default_material_request_type", "Purchase")
+
+		# so is a change in an item left out of the explosion
+		frappe.db.set_value("Item", "Test RM BOM 2", "is_stock_item", 0)
+		self.assertEqual(list(_get_subitems()), [])
+
+		frappe.db.set_value("Item", "Test RM BOM 2", "is_stock_item", 1)
+		self.assertEqual(_get_subitems()["Test RM BOM 2"].qty, 2 * 2 * (3 * 3 + 3))
+
+	def test_bin_details_for_rows(self):
+		from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+
+		make_stock_entry(item_code="Raw Material Item 1", target="_Test Warehouse - _TC", qty=5, rate=100)
+		make_stock_entry(item_code="Raw Material Item 1", target="_Test Warehouse 1 - _TC", qty=7, rate=100)
+
+		rows = [
+			frappe._dict(item_code="Raw Material Item 1"),
+			frappe._dict(item_code="Raw Material Item 1", source_warehouse="_Test Warehouse 1 - _TC"),
+			frappe._dict(item_code="Raw Material Item 1", default_warehouse="All Warehouses - _TC"),
+			frappe._dict(item_code="Raw Material Item 2", default_warehouse="_Test Warehouse - _TC")
+		]
+
+		for for_warehouse in (None, "_Test Warehouse 1 - _TC"):
+			bin_details = get_bin_details_for_rows(rows, "_Test Company", for_warehouse)
+			for row, bin_dict in zip(rows, bin_details):
+				expected = get_bin_details(row, "_Test Company", for_warehouse)
+				self.assertEqual(bin_dict, expected[0] if expected else {})
+
+	def test_time_phased_planning(self):
+		for item_code in ["Time Phased FG", "Time Phased RM"]:
+			create_item(item_code, is_stock_item=1)
+
+		bom_no = frappe.db.get_value('BOM', {'item': "Time Phased FG", "docstatus": 1})
+		if not bom_no:
+			bom_no = make_bom(item = "Time Phased FG", raw_materials = ["Time Phased RM"], rm_qty=2).name
+
+		pln = frappe.new_doc('Production Plan')
+		pln.company = "_Test Company"
+		pln.posting_date = nowdate()
+		pln.time_phased_planning = 1
+		pln.ignore_existing_ordered_qty = 1
+		for planned_qty, days in ((2, 0), (3, 3)):
+			pln.append("po_items", {
+				"item_code": "Time Phased FG",
+				"bom_no": bom_no,
+				"planned_qty": planned_qty,
+				"planned_start_date": add_to_date(nowdate(), days=days)
+			})
+
+		mr_items = get_items_for_material_requests(pln.as_dict())
+		self.assertEqual([(d["quantity"], d["schedule_date"]) for d in mr_items],
+			[(4, getdate()), (6, getdate(add_to_date(nowdate(), days=3)))])
+
+		pln.planning_bucket = "Week"
+		mr_items = get_items_for_material_requests(pln.as_dict())
+		self.assertEqual([(d["quantity"], d["schedule_date"]) for d in mr_items], [(10, getdate())])
+
+	def test_time_phased_planning_with_material_requests(self):
+		for item_code in ["Time Phased MR FG", "Time Phased MR RM"]:
+			create_item(item_code, is_stock_item=1)
+
+		bom_no = frappe.db.get_value('BOM', {'item': "Time Phased MR FG", "docstatus": 1})
+		if not bom_no:
+			bom_no = make_bom(item = "Time Phased MR FG", raw_materials = ["Time Phased MR RM"], rm_qty=2).name
+
+		# the requested qty covers the requirement of the first day
+		mr = make_material_request(item_code="Time Phased MR RM", qty=4,
+			uom=frappe.db.get_value("Item", "Time Phased MR RM", "stock_uom"), schedule_date=nowdate())
+
+		pln = frappe.new_doc('Production Plan')
+		pln.company = "_Test Company"
+		pln.posting_date = nowdate()
+		pln.time_phased_planning = 1
+		for planned_qty, days in ((2, 0), (3, 3)):
+			pln.append("po_items", {
+				"item_code": "Time Phased MR FG",
+				"bom_no": bom_no,
+				"planned_qty": planned_qty,
+				"planned_start_date": add_to_date(nowdate(), days=days)
+			})
+
+		mr_items = get_items_for_material_requests(pln.as_dict())
+		self.assertEqual([(d["quantity"], d["schedule_date"]) for d in mr_items],
+			[(6, getdate(add_to_date(nowdate(), days=3)))])
+
+		mr.cancel()
+
 	def test_get_warehouse_list_group(self):
 		"""Check if required warehouses are returned"""
 		warehouse_json = '[{\"warehouse\":\"_Test Warehouse Group - _TC\"}]'
@@ -0,0 +1,191 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+from array import array
+
+import frappe
+from frappe.utils import add_days, cint, date_diff, flt, getdate, nowdate
+
+
+class TimePhasedPlanning:
+	"""
+		Net the material requirements of a Production Plan per day or week bucket.
+
+		Stock in hand is carried from bucket to bucket with the receipts of open Purchase Orders,
+		Work Orders and Material Requests and the demand of open Sales Orders, Work Order materials
+		and Material Issue requests on their dates. A planned order is made in every bucket where
+		the projected balance would fall below zero, or below the safety stock if it is included.
+
+		The ledger keeps one flat array per kind of movement with a cell per item and bucket,
+		loaded with one query per kind of document.
+	"""
+	def __init__(self, doc, requirements, ignore_existing_ordered_qty=False, include_safety_stock=False):
+		self.doc = doc
+		self.company = doc.get("company")
+		self.warehouse = doc.get("for_warehouse")
+		self.start_date = getdate(doc.get("posting_date") or nowdate())
+		self.days_per_bucket = 7 if doc.get("planning_bucket") == "Week" else 1
+		self.ignore_existing_ordered_qty = ignore_existing_ordered_qty
+		self.include_safety_stock = include_safety_stock
+
+		# requirements: (item details, required date)
+		self.requirements = requirements
+
+	def get_material_request_items(self):
+		if not self.requirements:
+			return []
+
+		self.build_ledger()
+
+		if not self.ignore_existing_ordered_qty:
+			self.load_stock_in_hand()
+			self.load_movements()
+
+		return self.make_planned_orders()
+
+	def build_ledger(self):
+		self.item_details = {}
+		for details, required_date in self.requirements:
+			self.item_details.setdefault(details.item_code, details)
+
+		self.item_index = {item_code: i for i, item_code in enumerate(self.item_details)}
+		self.bucket_count = max(self.get_bucket(required_date) for details, required_date in self.requirements) + 1
+		self.end_date = add_days(self.get_bucket_date(self.bucket_count), -1)
+
+		cells = len(self.item_index) * self.bucket_count
+		self.gross_requirements = array("d", [0.0]) * cells
+		self.receipts = array("d", [0.0]) * cells
+		self.demand = array("d", [0.0]) * cells
+		self.stock_in_hand = array("d", [0.0]) * len(self.item_index)
+
+		for details, required_date in self.requirements:
+			self.gross_requirements[self.get_cell(details.item_code, required_date)] += flt(details.qty)
+
+	def get_bucket(self, date):
+		# past dates fall in the first bucket
+		return max(date_diff(date, self.start_date), 0) // self.days_per_bucket
+
+	def get_bucket_date(self, bucket):
+		return getdate(add_days(self.start_date, bucket * self.days_per_bucket))
+
+	def get_cell(self, item_code, date):
+		return self.item_index[item_code] * self.bucket_count + self.get_bucket(date)
+
+	def get_conditions(self, warehouse_field):
+		conditions = " and {0} in (select name from `tabWarehouse` where company = %(company)s {1})".format(
+			warehouse_field, "and lft >= %(lft)s and rgt <= %(rgt)s" if self.warehouse else "")
+
+		values = {"company": self.company, "item_codes": list(self.item_index), "end_date": self.end_date}
+		if self.warehouse:
+			values.update(frappe.db.get_value("Warehouse", self.warehouse, ["lft", "rgt"], as_dict=1))
+
+		return conditions, values
+
+	def load_stock_in_hand(self):
+		conditions, values = self.get_conditions("warehouse")
+		for item_code, actual_qty in frappe.db.sql("""
+			select item_code, sum(actual_qty) from `tabBin`
+			where item_code in %(item_codes)s {0}
+			group by item_code""".format(conditions), values): #nosec
+			self.stock_in_hand[self.item_index[item_code]] = flt(actual_qty)
+
+	def load_movements(self):
+		for ledger, query, warehouse_field in (
+			(self.receipts, """
+				select po_item.item_code, po_item.schedule_date as date,
+					sum((po_item.qty - po_item.received_qty) * po_item.conversion_factor) as qty
+				from `tabPurchase Order Item` po_item, `tabPurchase Order` po
+				where po_item.parent = po.name and po.docstatus = 1
+					and po.status not in ('Closed', 'On Hold', 'Completed', 'Delivered')
+					and po_item.qty > po_item.received_qty and po_item.delivered_by_supplier = 0
+					and po_item.item_code in %(item_codes)s and po_item.schedule_date <= %(end_date)s {conditions}
+				group by po_item.item_code, po_item.schedule_date""", "po_item.warehouse"),
+			(self.receipts, """
+				select production_item as item_code,
+					date(ifnull(expected_delivery_date, ifnull(planned_end_date, planned_start_date))) as date,
+					sum(qty - produced_qty) as qty
+				from `tabWork Order`
+				where docstatus = 1 and status not in ('Stopped', 'Completed', 'Closed')
+					and qty > produced_qty and production_item in %(item_codes)s
+					and date(ifnull(expected_delivery_date, ifnull(planned_end_date, planned_start_date))) <= %(end_date)s
+					{conditions}
+				group by 1, 2""", "fg_warehouse"),
+			# pending qty of the requests, as in the requested (indented) qty of the bins
+			(self.receipts, """
+				select mr_item.item_code, mr_item.schedule_date as date,
+					sum(mr_item.stock_qty - mr_item.ordered_qty) as qty
+				from `tabMaterial Request Item` mr_item, `tabMaterial Request` mr
+				where mr_item.parent = mr.name and mr.docstatus = 1 and mr.status != 'Stopped'
+					and mr.material_request_type in ('Purchase', 'Manufacture', 'Customer Provided', 'Material Transfer')
+					and mr_item.stock_qty > mr_item.ordered_qty
+					and mr_item.item_code in %(item_codes)s and mr_item.schedule_date <= %(end_date)s {conditions}
+				group by mr_item.item_code, mr_item.schedule_date""", "mr_item.warehouse"),
+			(self.demand, """
+				select mr_item.item_code, mr_item.schedule_date as date,
+					sum(mr_item.stock_qty - mr_item.ordered_qty) as qty
+				from `tabMaterial Request Item` mr_item, `tabMaterial Request` mr
+				where mr_item.parent = mr.name and mr.docstatus = 1 and mr.status != 'Stopped'
+					and mr.material_request_type = 'Material Issue'
+					and mr_item.stock_qty > mr_item.ordered_qty
+					and mr_item.item_code in %(item_codes)s and mr_item.schedule_date <= %(end_date)s {conditions}
+				group by mr_item.item_code, mr_item.schedule_date""", "mr_item.warehouse"),
+			(self.demand, """
+				select so_item.item_code, so_item.delivery_date as date,
+					sum((so_item.qty - so_item.delivered_qty) * so_item.conversion_factor) as qty
+				from `tabSales Order Item` so_item, `tabSales Order` so
+				where so_item.parent = so.name and so.docstatus = 1
+					and so.status not in ('Closed', 'On Hold', 'Completed')
+					and so_item.qty > so_item.delivered_qty and so_item.delivered_by_supplier = 0
+					and so_item.item_code in %(item_codes)s and so_item.delivery_date <= %(end_date)s {conditions}
+				group by so_item.item_code, so_item.delivery_date""", "so_item.warehouse"),
+			(self.demand, """
+				select wo_item.item_code, date(wo.planned_start_date) as date,
+					sum(wo_item.required_qty - wo_item.transferred_qty) as qty
+				from `tabWork Order Item` wo_item, `tabWork Order` wo
+				where wo_item.parent = wo.name and wo.docstatus = 1
+					and wo.status not in ('Stopped', 'Completed', 'Closed')
+					and wo_item.required_qty > wo_item.transferred_qty
+					and wo_item.item_code in %(item_codes)s and date(wo.planned_start_date) <= %(end_date)s
+					{conditions}
+				group by 1, 2""", "wo_item.source_warehouse")):
+			conditions, values = self.get_conditions(warehouse_field)
+			for d in frappe.db.sql(query.format(conditions=conditions), values, as_dict=1): #nosec
+				ledger[self.get_cell(d.item_code, d.date)] += flt(d.qty)
+
+	def make_planned_orders(self):
+		from erpnext.manufacturing.doctype.production_plan.production_plan import (
+			get_material_request_items,
+		)
+
+		mr_items = []
+		for item_code, i in self.item_index.items():
+			details = self.item_details[item_code]
+			lead_time_days = cint(frappe.get_cached_value("Item", item_code, "lead_time_days"))
+			minimum_balance = flt(details.safety_stock) if self.include_safety_stock else 0.0
+
+			balance = self.stock_in_hand[i]
+			for bucket in range(self.bucket_count):
+				cell = i * self.bucket_count + bucket
+				balance += self.receipts[cell] - self.demand[cell] - self.gross_requirements[cell]
+				if balance >= minimum_balance:
+					continue
+
+				# shortfall in the bucket, planned in the same way as without time phasing
+				bucket_date = self.get_bucket_date(bucket)
+				row = get_material_request_items(frappe._dict(details, qty=minimum_balance - balance),
+					self.doc.get("sales_order"), self.company, True, False, self.warehouse, {
+						"actual_qty": self.stock_in_hand[i],
+						"projected_qty": balance
+					})
+
+				if row:
+					balance += row["quantity"]
+					row.update({
+						"required_bom_qty": self.gross_requirements[cell],
+						# the material can not arrive before its lead time
+						"schedule_date": max(bucket_date, getdate(add_days(nowdate(), lead_time_days)))
+					})
+					mr_items.append(row)
+
+		return mr_items
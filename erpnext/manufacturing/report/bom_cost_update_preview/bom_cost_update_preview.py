@@ -0,0 +1,67 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+from frappe import _
+
+from erpnext.manufacturing.doctype.bom_update_tool.bom_cost_rollup import BOMCostRollup
+
+
+def execute(filters=None):
+	filters = filters or {}
+	columns = get_columns()
+	data = get_data(filters)
+	return columns, data
+
+def get_data(filters):
+	data = BOMCostRollup(dry_run=True).run()
+	if filters.get("company"):
+		data = [d for d in data if d.company == filters.get("company")]
+
+	return sorted(data, key=lambda d: abs(d.difference), reverse=True)
+
+def get_columns():
+	return [
+		{
+			"label": _("BOM"),
+			"fieldname": "bom",
+			"fieldtype": "Link",
+			"options": "BOM",
+			"width": 200
+		},
+		{
+			"label": _("Item"),
+			"fieldname": "item",
+			"fieldtype": "Link",
+			"options": "Item",
+			"width": 150
+		},
+		{
+			"label": _("Currency"),
+			"fieldname": "currency",
+			"fieldtype": "Link",
+			"options": "Currency",
+			"hidden": 1
+		},
+		{
+			"label": _("Current Cost"),
+			"fieldname": "old_cost",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 140
+		},
+		{
+			"label": _("Updated Cost"),
+			"fieldname": "new_cost",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 140
+		},
+		{
+			"label": _("Difference"),
+			"fieldname": "difference",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 140
+		}
+	]
@@ -15,27 +15,40 @@ def get_data(filters, data):
 	get_exploded_items(filters.bom, data)
 
 def get_exploded_items(bom, data, indent=0, qty=1):
-	exploded_items = frappe.get_all("BOM Item",
-		filters={"parent": bom},
-		fields= ['qty','bom_no','qty','scrap','item_code','item_name','description','uom'])
+	bom_items = get_bom_items_of_tree(bom)
 
-	for item in exploded_items:
-		print(item.bom_no, indent)
-		item["indent"] = indent
-		data.append({
-			'item_code': item.item_code,
-			'item_name': item.item_name,
-			'indent': indent,
-			'bom_level': (frappe.get_cached_value("BOM", item.bom_no, "bom_level")
-				if item.bom_no else ""),
-			'bom': item.bom_no,
-			'qty': item.qty * qty,
-			'uom': item.uom,
-			'description': item.description,
-			'scrap': item.scrap
-		})
-		if item.bom_no:
-			get_exploded_items(item.bom_no, data, indent=indent+1, qty=item.qty)
+	def _append_items(bom, indent, qty):
+		for item in bom_items.get(bom, []):
+			data.append({
+				'item_code': item.item_code,
+				'item_name': item.item_name,
+				'indent': indent,
+				'bom_level': (frappe.get_cached_value("BOM", item.bom_no, "bom_level")
+					if item.bom_no else ""),
+				'bom': item.bom_no,
+				'qty': item.qty * qty,
+				'uom': item.uom,
+				'description': item.description,
+				'scrap': item.scrap
+			})
+			if item.bom_no:
+				_append_items(item.bom_no, indent + 1, item.qty)
+
+	_append_items(bom, indent, qty)
+
+def get_bom_items_of_tree(bom):
+	"""BOM Items of the BOM and of its sub-assembly BOMs by BOM, with one query per level of the tree"""
+	bom_items = {}
+	boms = [bom]
+	while boms:
+		for item in frappe.get_all("BOM Item", filters={"parent": ("in", boms)},
+			fields=['parent', 'qty', 'bom_no', 'scrap', 'item_code', 'item_name', 'description', 'uom']):
+			bom_items.setdefault(item.parent, []).append(item)
+
+		boms = list({item.bom_no for bom in boms for item in bom_items.get(bom, [])
+			if item.bom_no and item.bom_no not in bom_items})
+
+	return bom_items
 
 def get_columns():
 	return [
@@ -0,0 +1,9 @@
+import frappe
+
+from erpnext.stock.stock_queue import convert_stock_queue
+
+
+def execute():
+	frappe.reload_doc('stock', 'doctype', 'stock_settings')
+
+	convert_stock_queue()
@@ -0,0 +1,9 @@
+import frappe
+
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import rebuild_payment_ledger
+
+
+def execute():
+	frappe.reload_doc('accounts', 'doctype', 'payment_ledger_entry')
+
+	rebuild_payment_ledger()
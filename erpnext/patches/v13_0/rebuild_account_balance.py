@@ -0,0 +1,9 @@
+import frappe
+
+from erpnext.accounts.doctype.account_balance.account_balance import rebuild_account_balance
+
+
+def execute():
+	frappe.reload_doc('accounts', 'doctype', 'account_balance')
+
+	rebuild_account_balance()
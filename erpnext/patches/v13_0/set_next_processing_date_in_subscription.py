@@ -0,0 +1,11 @@
+import frappe
+from frappe.utils import nowdate
+
+
+def execute():
+	frappe.reload_doc('accounts', 'doctype', 'subscription')
+
+	# the subscriptions get their actual date when they are next processed
+	frappe.db.sql("""
+		update `tabSubscription` set next_processing_date = %s
+		where status not in ('Cancelled', 'Completed')""", nowdate())
@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+	frappe.reload_doc('stock', 'doctype', 'stock_ledger_entry')
+
+	frappe.db.sql("""
+		update `tabStock Ledger Entry`
+		set posting_datetime = timestamp(posting_date, posting_time)
+		where posting_datetime is null""")
@@ -46,6 +46,7 @@ class ItemGroup(NestedSet, WebsiteGenerator):
 		self.validate_name_with_item()
 		self.validate_one_root()
 		self.delete_child_item_groups_key()
+		self.clear_item_tax_index()
 
 	def make_route(self):
 		'''Make website route'''
@@ -66,6 +67,16 @@ class ItemGroup(NestedSet, WebsiteGenerator):
 		NestedSet.on_trash(self)
 		WebsiteGenerator.on_trash(self)
 		self.delete_child_item_groups_key()
+		self.clear_item_tax_index()
+
+	def after_rename(self, olddn, newdn, merge=False):
+		NestedSet.after_rename(self, olddn, newdn, merge)
+		self.clear_item_tax_index()
+
+	def clear_item_tax_index(self):
+		from erpnext.stock.get_item_details import clear_item_tax_index
+
+		clear_item_tax_index()
 
 	def validate_name_with_item(self):
 		if frappe.db.exists("Item", self.name):
@@ -156,6 +156,7 @@ class Item(WebsiteGenerator):
 		self.update_variants()
 		self.update_item_price()
 		self.update_template_item()
+		self.clear_item_tax_index()
 
 	def validate_description(self):
 		'''Clean HTML description if set'''
@@ -658,6 +659,15 @@ class Item(WebsiteGenerator):
 		for variant_of in frappe.get_all("Item", filters={"variant_of": self.name}):
 			frappe.delete_doc("Item", variant_of.name)
 
+		self.clear_item_tax_index()
+
+	def clear_item_tax_index(self):
+		doc_before_save = self.get_doc_before_save()
+		if self.get("taxes") or (doc_before_save and doc_before_save.get("taxes")):
+			from erpnext.stock.get_item_details import clear_item_tax_index
+
+			clear_item_tax_index()
+
 	def before_rename(self, old_name, new_name, merge=False):
 		if self.item_name == old_name:
 			frappe.db.set_value("Item", old_name, "item_name", new_name)
@@ -683,6 +693,8 @@ class Item(WebsiteGenerator):
 			invalidate_cache_for_item(self)
 			clear_cache(self.route)
 
+		self.clear_item_tax_index()
+
 		frappe.db.set_value("Item", new_name, "item_code", new_name)
 
 		if merge:
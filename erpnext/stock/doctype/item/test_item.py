@@ -22,7 +22,7 @@ from erpnext.stock.doctype.item.item import (
 	validate_is_stock_item,
 )
 from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
-from erpnext.stock.get_item_details import get_item_details
+from erpnext.stock.get_item_details import get_item_details, get_item_details_bulk
 from erpnext.tests.utils import ERPNextTestCase, change_settings
 
 test_ignore = ["BOM"]
@@ -114,6 +114,39 @@ class TestItem(ERPNextTestCase):
 		for key, value in to_check.items():
 			self.assertEqual(value, details.get(key))
 
+	def test_get_item_details_bulk(self):
+		make_test_objects("Item Price")
+
+		company = "_Test Company"
+		currency = frappe.get_cached_value("Company",  company,  "default_currency")
+		args_list = []
+		for item_code, price_list, customer in [
+			("_Test Item", "_Test Price List", "_Test Customer"),
+			("_Test Item 2", "_Test Price List Rest of the World", "_Test Customer"),
+			("_Test Item", "_Test Price List Rest of the World", None),
+			("_Test Item Home Desktop 100", "_Test Price List", "_Test Customer"),
+			("_Test Item", "_Test Price List", "_Test Customer")]:
+			args_list.append({
+				"item_code": item_code,
+				"company": company,
+				"price_list": price_list,
+				"currency": currency,
+				"doctype": "Sales Order",
+				"conversion_rate": 1,
+				"price_list_currency": currency,
+				"plc_conversion_rate": 1,
+				"order_type": "Sales",
+				"customer": customer,
+				"transaction_date": "2017-04-20",
+				"uom": "_Test UOM",
+				"conversion_factor": 1,
+				"qty": 1
+			})
+
+		expected = [get_item_details(frappe._dict(args)) for args in args_list]
+		self.assertEqual(get_item_details_bulk([frappe._dict(args) for args in args_list]), expected)
+		self.assertFalse(frappe.flags.item_details_prefetch)
+
 	def test_item_tax_template(self):
 		expected_item_tax_template = [
 			{"item_code": "_Test Item With Item Tax Template", "tax_category": "",
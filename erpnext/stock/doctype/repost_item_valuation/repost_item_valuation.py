@@ -1,11 +1,22 @@
 # Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import json
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import cint, get_link_to_form, get_weekday, now, nowtime, today
+from frappe.utils import (
+	cint,
+	flt,
+	get_link_to_form,
+	get_weekday,
+	now,
+	now_datetime,
+	nowtime,
+	time_diff_in_seconds,
+	today,
+)
 from frappe.utils.user import get_users_with_role
 from rq.timeouts import JobTimeoutException
 
@@ -14,8 +25,12 @@ from erpnext.accounts.utils import (
 	check_if_stock_and_account_balance_synced,
 	update_gl_entries_after,
 )
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import (
+	update_closing_balance,
+)
 from erpnext.stock.stock_ledger import repost_future_sle
 
+REPOSTING_JOB_NAME = 'repost_item_valuation_group'
 
 class RepostItemValuation(Document):
 	def validate(self):
@@ -55,17 +70,29 @@ class RepostItemValuation(Document):
 		frappe.enqueue(repost, timeout=1800, queue='long',
 			job_name='repost_sle', now=True, doc=self)
 
-def repost(doc):
+def repost(doc, repost_group=None):
 	try:
 		if not frappe.db.exists("Repost Item Valuation", doc.name):
 			return
 
+		started_at = now_datetime()
 		doc.set_status('In Progress')
+		doc.db_set({
+			'repost_group': repost_group,
+			'queue_lag': time_diff_in_seconds(started_at, doc.creation)
+		})
 		frappe.db.commit()
 
-		repost_sl_entries(doc)
+		entries_reposted = repost_sl_entries(doc)
+		repost_closing_balance(doc)
 		repost_gl_entries(doc)
 
+		time_taken = time_diff_in_seconds(now_datetime(), started_at)
+		doc.db_set({
+			'entries_reposted': entries_reposted,
+			'time_taken': time_taken,
+			'throughput': flt(entries_reposted / time_taken, 2) if time_taken else entries_reposted
+		})
 		doc.set_status('Completed')
 
 	except (Exception, JobTimeoutException):
@@ -86,16 +113,26 @@ def repost(doc):
 
 def repost_sl_entries(doc):
 	if doc.based_on == 'Transaction':
-		repost_future_sle(voucher_type=doc.voucher_type, voucher_no=doc.voucher_no,
+		return repost_future_sle(voucher_type=doc.voucher_type, voucher_no=doc.voucher_no,
 			allow_negative_stock=doc.allow_negative_stock, via_landed_cost_voucher=doc.via_landed_cost_voucher, doc=doc)
 	else:
-		repost_future_sle(args=[frappe._dict({
+		return repost_future_sle(args=[frappe._dict({
 			"item_code": doc.item_code,
 			"warehouse": doc.warehouse,
 			"posting_date": doc.posting_date,
 			"posting_time": doc.posting_time
 		})], allow_negative_stock=doc.allow_negative_stock, via_landed_cost_voucher=doc.via_landed_cost_voucher)
 
+def repost_closing_balance(doc):
+	if doc.based_on == 'Transaction':
+		distinct_item_and_warehouse = frappe.db.get_value(doc.doctype, doc.name, "distinct_item_and_warehouse")
+		item_warehouses = [frappe.safe_eval(k) for k in json.loads(distinct_item_and_warehouse or "{}")]
+	else:
+		item_warehouses = [(doc.item_code, doc.warehouse)]
+
+	for item_code, warehouse in item_warehouses:
+		update_closing_balance(item_code, warehouse, doc.posting_date)
+
 def repost_gl_entries(doc):
 	if not cint(erpnext.is_perpetual_inventory_enabled(doc.company)):
 		return
@@ -127,19 +164,168 @@ def repost_entries():
 	if not in_configured_timeslot():
 		return
 
+	if is_reposting_job_running():
+		# entries picked up by the previous run are still being reposted
+		return
+
 	riv_entries = get_repost_item_valuation_entries()
+	if not riv_entries:
+		check_stock_and_account_balance()
+		return
 
-	for row in riv_entries:
-		doc = frappe.get_cached_doc('Repost Item Valuation', row.name)
-		repost(doc)
+	parallel_jobs = cint(frappe.db.get_single_value("Stock Reposting Settings", "parallel_reposting_jobs")) or 1
+	repost_groups = get_repost_groups(riv_entries, parallel_jobs)
 
-	riv_entries = get_repost_item_valuation_entries()
-	if riv_entries:
+	if len(repost_groups) == 1:
+		repost_entries_in_group(repost_groups[0])
 		return
 
+	for i, entries in enumerate(repost_groups, 1):
+		frappe.enqueue(repost_entries_in_group, queue='long', timeout=7200,
+			job_name=REPOSTING_JOB_NAME, entries=entries,
+			repost_group=_("Group {0} of {1}").format(i, len(repost_groups)))
+
+def repost_entries_in_group(entries, repost_group=None):
+	"""Repost the entries of a group one by one, in the order of their posting"""
+	for name in entries:
+		doc = frappe.get_doc('Repost Item Valuation', name)
+		if doc.status not in ('Queued', 'In Progress') or doc.docstatus != 1:
+			continue
+
+		repost(doc, repost_group)
+
+	if not get_repost_item_valuation_entries():
+		check_stock_and_account_balance()
+
+def check_stock_and_account_balance():
 	for d in frappe.get_all('Company', filters= {'enable_perpetual_inventory': 1}):
 		check_if_stock_and_account_balance_synced(today(), d.name)
 
+def is_reposting_job_running():
+	from frappe.utils.background_jobs import get_jobs
+
+	jobs = get_jobs(site=frappe.local.site, queue='long', key='job_name')
+	return REPOSTING_JOB_NAME in jobs.get(frappe.local.site, [])
+
+def get_repost_groups(riv_entries, max_groups=1):
+	"""
+		Partition the entries into groups that can be reposted in parallel.
+
+		Entries are in the same group if the item-warehouses they repost overlap, including
+		the item-warehouses linked through dependant entries (transfers, repack and manufacture)
+		posted after them, or if they repost the GL entries of the same voucher. Each group keeps
+		the order of `riv_entries`, independent groups are then packed into at most `max_groups`
+		groups.
+	"""
+	parent = {}
+
+	def find(key):
+		while parent.setdefault(key, key) != key:
+			parent[key] = parent[parent[key]]
+			key = parent[key]
+		return key
+
+	for row in riv_entries:
+		for key in get_repost_keys(row.name):
+			parent[find(key)] = find(row.name)
+
+	components = {}
+	for row in riv_entries:
+		components.setdefault(find(row.name), []).append(row.name)
+
+	# biggest group first, each to the group with the least entries
+	repost_groups = [[] for i in range(min(max_groups, len(components)) or 1)]
+	for entries in sorted(components.values(), key=len, reverse=True):
+		min(repost_groups, key=len).extend(entries)
+
+	order = {row.name: i for i, row in enumerate(riv_entries)}
+	return [sorted(entries, key=order.get) for entries in repost_groups if entries]
+
+def get_repost_keys(riv_name):
+	"""
+		The (item_code, warehouse) keys an entry reposts, and the ('Voucher', voucher_type, voucher_no)
+		keys of the vouchers whose GL entries it reposts
+	"""
+	doc = frappe.db.get_value('Repost Item Valuation', riv_name,
+		['based_on', 'voucher_type', 'voucher_no', 'item_code', 'warehouse', 'posting_date', 'posting_time'],
+		as_dict=1)
+
+	if doc.based_on == 'Transaction':
+		item_warehouses = [(d.item_code, d.warehouse) for d in frappe.get_all('Stock Ledger Entry',
+			filters={'voucher_type': doc.voucher_type, 'voucher_no': doc.voucher_no},
+			fields=['item_code', 'warehouse'], distinct=True)]
+	else:
+		item_warehouses = [(doc.item_code, doc.warehouse)]
+
+	item_warehouses = get_dependant_item_warehouses(item_warehouses, doc.posting_date, doc.posting_time)
+	vouchers = get_future_vouchers(item_warehouses, doc.posting_date, doc.posting_time)
+
+	return item_warehouses + [('Voucher', voucher_type, voucher_no) for voucher_type, voucher_no in vouchers]
+
+def get_future_vouchers(item_warehouses, posting_date, posting_time):
+	"""
+		Vouchers posted after the posting date whose GL entries are reposted with the item-warehouses.
+		Like `get_future_stock_vouchers`, it matches any of the items in any of the warehouses
+	"""
+	if not item_warehouses:
+		return []
+
+	return frappe.db.sql("""
+		select distinct voucher_type, voucher_no
+		from `tabStock Ledger Entry`
+		where
+			item_code in %(items)s
+			and warehouse in %(warehouses)s
+			and is_cancelled = 0
+			and timestamp(posting_date, posting_time) >= timestamp(%(posting_date)s, %(posting_time)s)
+	""", {
+		'items': list({d[0] for d in item_warehouses}),
+		'warehouses': list({d[1] for d in item_warehouses}),
+		'posting_date': posting_date,
+		'posting_time': posting_time or '00:00'
+	})
+
+def get_dependant_item_warehouses(item_warehouses, posting_date, posting_time):
+	"""Item-warehouses whose entries after the posting date depend on the given ones, transitively"""
+	item_warehouses = list(dict.fromkeys(item_warehouses))
+	to_check = set(item_warehouses)
+
+	while to_check:
+		items = list({d[0] for d in to_check})
+		warehouses = list({d[1] for d in to_check})
+
+		dependant_sle = frappe.db.sql("""
+			select sle.item_code, sle.warehouse, dependant_sle.item_code as dependant_item_code,
+				dependant_sle.warehouse as dependant_warehouse
+			from `tabStock Ledger Entry` sle, `tabStock Ledger Entry` dependant_sle
+			where
+				sle.item_code in %(items)s
+				and sle.warehouse in %(warehouses)s
+				and sle.is_cancelled = 0
+				and sle.dependant_sle_voucher_detail_no is not null
+				and sle.dependant_sle_voucher_detail_no != ''
+				and timestamp(sle.posting_date, sle.posting_time) >= timestamp(%(posting_date)s, %(posting_time)s)
+				and dependant_sle.voucher_detail_no = sle.dependant_sle_voucher_detail_no
+				and dependant_sle.name != sle.name
+				and dependant_sle.is_cancelled = 0
+		""", {
+			'items': items,
+			'warehouses': warehouses,
+			'posting_date': posting_date,
+			'posting_time': posting_time or '00:00'
+		}, as_dict=1)
+
+		new_item_warehouses = set()
+		for d in dependant_sle:
+			key = (d.dependant_item_code, d.dependant_warehouse)
+			if (d.item_code, d.warehouse) in to_check and key not in item_warehouses:
+				item_warehouses.append(key)
+				new_item_warehouses.add(key)
+
+		to_check = new_item_warehouses
+
+	return item_warehouses
+
 def get_repost_item_valuation_entries():
 	return frappe.db.sql(""" SELECT name from `tabRepost Item Valuation`
 		WHERE status in ('Queued', 'In Progress') and creation <= %s and docstatus = 1
@@ -5,12 +5,18 @@ import unittest
 
 import frappe
 
+from erpnext.stock.doctype.item.test_item import make_item
 from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import (
+	get_repost_groups,
 	in_configured_timeslot,
 )
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
 
 
 class TestRepostItemValuation(unittest.TestCase):
+	def tearDown(self):
+		frappe.db.rollback()
+
 	def test_repost_time_slot(self):
 		repost_settings = frappe.get_doc("Stock Reposting Settings")
 
@@ -70,3 +76,46 @@ class TestRepostItemValuation(unittest.TestCase):
 				in_configured_timeslot(repost_settings, case.get("current_time")),
 				msg=f"Exepcted false from : {case}",
 			)
+
+
+	def test_repost_groups(self):
+		def make_repost_entry(item_code, warehouse, posting_date):
+			return frappe.get_doc({
+				"doctype": "Repost Item Valuation",
+				"based_on": "Item and Warehouse",
+				"item_code": item_code,
+				"warehouse": warehouse,
+				"posting_date": posting_date,
+				"posting_time": "00:00:00"
+			}).insert(ignore_permissions=True)
+
+		item1 = make_item("_Test Item For Repost Group 1", {"is_stock_item": 1}).name
+		item2 = make_item("_Test Item For Repost Group 2", {"is_stock_item": 1}).name
+
+		riv1 = make_repost_entry(item1, "_Test Warehouse - _TC", "2021-01-01")
+		riv2 = make_repost_entry(item2, "_Test Warehouse - _TC", "2021-01-02")
+		riv3 = make_repost_entry(item1, "_Test Warehouse - _TC", "2021-01-03")
+		riv_entries = [frappe._dict(name=d.name) for d in (riv1, riv2, riv3)]
+
+		# entries of the same item-warehouse are reposted in order, by the same job
+		groups = get_repost_groups(riv_entries, max_groups=4)
+		self.assertEqual(len(groups), 2)
+		self.assertIn([riv1.name, riv3.name], groups)
+		self.assertIn([riv2.name], groups)
+
+		groups = get_repost_groups(riv_entries, max_groups=1)
+		self.assertEqual(groups, [[riv1.name, riv2.name, riv3.name]])
+
+		# a later voucher of both items has its GL entries reposted by both, in the same job
+		se = make_stock_entry(item_code=item1, target="_Test Warehouse - _TC", qty=1, basic_rate=100,
+			posting_date="2021-01-05", do_not_save=True)
+		se.append("items", {"item_code": item2, "t_warehouse": "_Test Warehouse - _TC", "qty": 1,
+			"basic_rate": 100, "conversion_factor": 1, "transfer_qty": 1, "cost_center": se.items[0].cost_center,
+			"expense_account": se.items[0].expense_account})
+		se.insert()
+		se.submit()
+
+		groups = get_repost_groups(riv_entries, max_groups=4)
+		self.assertEqual(groups, [[riv1.name, riv2.name, riv3.name]])
+
+		se.cancel()
@@ -0,0 +1,220 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_months, flt, get_last_day, getdate, now, today
+
+
+class StockClosingBalance(Document):
+	pass
+
+
+def make_closing_balance(closing_date=None):
+	"""
+		Snapshot the stock balance of every (company, item, warehouse, batch)
+		as on the closing date (last day of the previous month by default).
+
+		The snapshot is built incrementally, starting from the previous snapshot
+		and folding only the stock ledger entries posted after it.
+	"""
+	closing_date = getdate(closing_date or get_last_day(add_months(today(), -1)))
+
+	if frappe.db.exists("Stock Closing Balance", {"posting_date": closing_date}):
+		return
+
+	previous_closing_date = get_closing_date(before=closing_date)
+	balance_map = get_closing_balance_map(previous_closing_date)
+
+	for sle in get_stock_ledger_entries(previous_closing_date, closing_date):
+		update_balance_map(balance_map, sle)
+
+	insert_closing_balance(balance_map, closing_date)
+
+def update_closing_balance(item_code, warehouse, posting_date):
+	"""
+		Rebuild the snapshots of an item-warehouse from the posting date onwards,
+		called when a back-dated transaction or a repost changes its ledger
+	"""
+	closing_dates = frappe.db.sql_list("""
+		select distinct posting_date
+		from `tabStock Closing Balance`
+		where posting_date >= %s
+		order by posting_date""", posting_date)
+
+	if not closing_dates:
+		return
+
+	previous_closing_date = get_closing_date(before=posting_date)
+	balance_map = get_closing_balance_map(previous_closing_date, item_code=item_code, warehouse=warehouse)
+	sl_entries = get_stock_ledger_entries(previous_closing_date, closing_dates[-1],
+		item_code=item_code, warehouse=warehouse)
+
+	frappe.db.sql("""
+		delete from `tabStock Closing Balance`
+		where item_code = %s and warehouse = %s and posting_date >= %s
+	""", (item_code, warehouse, closing_dates[0]))
+
+	i = 0
+	for closing_date in closing_dates:
+		while i < len(sl_entries) and sl_entries[i].posting_date <= closing_date:
+			update_balance_map(balance_map, sl_entries[i])
+			i += 1
+
+		insert_closing_balance(balance_map, closing_date)
+
+def update_closing_balance_for_entries(sl_entries):
+	"""Refresh snapshots made stale by stock ledger entries posted on or before them"""
+	latest_closing_date = get_closing_date()
+	if not latest_closing_date or not sl_entries:
+		return
+
+	item_warehouses = {}
+	for sle in sl_entries:
+		posting_date = getdate(sle.get("posting_date"))
+		if posting_date > latest_closing_date:
+			continue
+
+		key = (sle.get("item_code"), sle.get("warehouse"))
+		item_warehouses[key] = min(posting_date, item_warehouses.get(key, posting_date))
+
+	for (item_code, warehouse), posting_date in item_warehouses.items():
+		update_closing_balance(item_code, warehouse, posting_date)
+
+def get_closing_date(before=None):
+	"""Returns the latest closing date, optionally strictly before the given date"""
+	condition = ""
+	if before:
+		condition = "where posting_date < %s" % frappe.db.escape(str(getdate(before)))
+
+	closing_date = frappe.db.sql("""
+		select max(posting_date)
+		from `tabStock Closing Balance`
+		{0}""".format(condition))
+
+	return closing_date[0][0] if closing_date and closing_date[0][0] else None
+
+def get_closing_balance_map(closing_date, item_code=None, warehouse=None):
+	balance_map = {}
+	if not closing_date:
+		return balance_map
+
+	filters = {"posting_date": closing_date}
+	if item_code:
+		filters["item_code"] = item_code
+	if warehouse:
+		filters["warehouse"] = warehouse
+
+	for d in frappe.get_all("Stock Closing Balance", filters=filters,
+		fields=["company", "item_code", "warehouse", "batch_no",
+			"qty_after_transaction", "valuation_rate", "stock_value"]):
+		key = (d.company, d.item_code, d.warehouse)
+		balance = balance_map.setdefault(key, frappe._dict({"valuation_rate": 0.0, "batches": {}}))
+		balance.valuation_rate = flt(d.valuation_rate)
+		balance.batches[d.batch_no or ""] = frappe._dict({
+			"qty": flt(d.qty_after_transaction),
+			"value": flt(d.stock_value)
+		})
+
+	return balance_map
+
+def get_stock_ledger_entries(from_date, to_date, item_code=None, warehouse=None):
+	"""Entries posted after `from_date` and up to `to_date`, in the Stock Balance report's order"""
+	conditions = ""
+	if from_date:
+		conditions += " and posting_date > %(from_date)s"
+	if item_code:
+		conditions += " and item_code = %(item_code)s"
+	if warehouse:
+		conditions += " and warehouse = %(warehouse)s"
+
+	return frappe.db.sql("""
+		select
+			company, item_code, warehouse, batch_no, posting_date, voucher_type,
+			actual_qty, qty_after_transaction, valuation_rate, stock_value_difference
+		from
+			`tabStock Ledger Entry`
+		where
+			is_cancelled = 0
+			and docstatus < 2
+			and posting_date <= %(to_date)s
+			{0}
+		order by posting_date, posting_time, creation, actual_qty""".format(conditions), {
+			"from_date": from_date,
+			"to_date": to_date,
+			"item_code": item_code,
+			"warehouse": warehouse
+		}, as_dict=1)
+
+def update_balance_map(balance_map, sle):
+	"""Fold an entry into the balance the same way the Stock Balance report does"""
+	key = (sle.company, sle.item_code, sle.warehouse)
+	balance = balance_map.setdefault(key, frappe._dict({"valuation_rate": 0.0, "batches": {}}))
+	batch = balance.batches.setdefault(sle.batch_no or "", frappe._dict({"qty": 0.0, "value": 0.0}))
+
+	if sle.voucher_type == "Stock Reconciliation" and not sle.batch_no:
+		qty_diff = flt(sle.qty_after_transaction) - sum(d.qty for d in balance.batches.values())
+	else:
+		qty_diff = flt(sle.actual_qty)
+
+	batch.qty += qty_diff
+	batch.value += flt(sle.stock_value_difference)
+	balance.valuation_rate = flt(sle.valuation_rate)
+
+def insert_closing_balance(balance_map, closing_date):
+	values = []
+	timestamp = now()
+	for (company, item_code, warehouse), balance in balance_map.items():
+		for batch_no, batch in balance.batches.items():
+			if not flt(batch.qty, 9) and not flt(batch.value, 9):
+				continue
+
+			values.append((frappe.generate_hash(length=10), timestamp, timestamp,
+				frappe.session.user, frappe.session.user, company, item_code, warehouse,
+				batch_no or None, closing_date, batch.qty, balance.valuation_rate, batch.value))
+
+	if values:
+		frappe.db.bulk_insert("Stock Closing Balance", fields=["name", "creation", "modified",
+			"owner", "modified_by", "company", "item_code", "warehouse", "batch_no", "posting_date",
+			"qty_after_transaction", "valuation_rate", "stock_value"], values=values)
+
+def verify_closing_balance(closing_date, precision=6):
+	"""
+		Compare the snapshot of the closing date with a full rescan of the stock ledger,
+		returns the mismatched (company, item, warehouse, batch) rows
+	"""
+	closing_date = getdate(closing_date)
+
+	expected = {}
+	for sle in get_stock_ledger_entries(None, closing_date):
+		update_balance_map(expected, sle)
+
+	actual = get_closing_balance_map(closing_date)
+
+	mismatches = []
+	for key in set(expected) | set(actual):
+		expected_batches = expected.get(key, frappe._dict(batches={})).batches
+		actual_batches = actual.get(key, frappe._dict(batches={})).batches
+
+		for batch_no in set(expected_batches) | set(actual_batches):
+			expected_balance = expected_batches.get(batch_no, frappe._dict(qty=0.0, value=0.0))
+			actual_balance = actual_batches.get(batch_no, frappe._dict(qty=0.0, value=0.0))
+
+			if (flt(expected_balance.qty, precision) != flt(actual_balance.qty, precision)
+				or flt(expected_balance.value, precision) != flt(actual_balance.value, precision)):
+				mismatches.append(frappe._dict({
+					"company": key[0],
+					"item_code": key[1],
+					"warehouse": key[2],
+					"batch_no": batch_no,
+					"expected_qty": expected_balance.qty,
+					"snapshot_qty": actual_balance.qty,
+					"expected_value": expected_balance.value,
+					"snapshot_value": actual_balance.value
+				}))
+
+	return mismatches
+
+def on_doctype_update():
+	frappe.db.add_index("Stock Closing Balance", ["item_code", "warehouse", "posting_date"])
+	frappe.db.add_index("Stock Closing Balance", ["posting_date", "company"])
@@ -0,0 +1,67 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import (
+	make_closing_balance,
+	verify_closing_balance,
+)
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.report.stock_balance.stock_balance import execute
+from erpnext.tests.utils import ERPNextTestCase
+
+
+class TestStockClosingBalance(ERPNextTestCase):
+	def setUp(self):
+		self.item_code = make_item("_Test Item For Closing Balance", {"is_stock_item": 1}).name
+		self.warehouse = "_Test Warehouse - _TC"
+
+		frappe.db.sql("delete from `tabStock Closing Balance`")
+		frappe.db.sql("delete from `tabStock Ledger Entry` where item_code = %s", self.item_code)
+
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=10, rate=100,
+			posting_date="2021-01-10")
+		make_stock_entry(item_code=self.item_code, source=self.warehouse, qty=4,
+			posting_date="2021-02-10")
+
+	def test_closing_balance(self):
+		make_closing_balance("2021-01-31")
+		make_closing_balance("2021-02-28")
+
+		balance = frappe.db.get_value("Stock Closing Balance",
+			{"item_code": self.item_code, "posting_date": "2021-02-28"},
+			["qty_after_transaction", "stock_value"], as_dict=1)
+
+		self.assertEqual(balance.qty_after_transaction, 6)
+		self.assertEqual(balance.stock_value, 600)
+		self.assertFalse(verify_closing_balance("2021-02-28"))
+
+	def test_back_dated_entry_updates_closing_balance(self):
+		make_closing_balance("2021-01-31")
+		make_closing_balance("2021-02-28")
+
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=5, rate=100,
+			posting_date="2021-01-20")
+
+		self.assertEqual(frappe.db.get_value("Stock Closing Balance",
+			{"item_code": self.item_code, "posting_date": "2021-02-28"}, "qty_after_transaction"), 11)
+		self.assertFalse(verify_closing_balance("2021-01-31"))
+		self.assertFalse(verify_closing_balance("2021-02-28"))
+
+	def test_stock_balance_report_with_closing_balance(self):
+		filters = frappe._dict({
+			"company": "_Test Company",
+			"item_code": self.item_code,
+			"from_date": "2021-02-01",
+			"to_date": "2021-02-28"
+		})
+
+		_columns, expected = execute(filters)
+		make_closing_balance("2021-01-31")
+		_columns, data = execute(filters)
+
+		self.assertEqual(len(data), 1)
+		for field in ("opening_qty", "opening_val", "out_qty", "out_val", "bal_qty", "bal_val"):
+			self.assertEqual(data[0][field], expected[0][field])
@@ -29,13 +29,18 @@ class StockLedgerEntry(Document):
 
 	def validate(self):
 		self.flags.ignore_submit_comment = True
-		from erpnext.stock.utils import validate_disabled_warehouse, validate_warehouse_company
+		from erpnext.stock.utils import (
+			get_combine_datetime,
+			validate_disabled_warehouse,
+			validate_warehouse_company,
+		)
 		self.validate_mandatory()
 		self.validate_item()
 		self.validate_batch()
 		validate_disabled_warehouse(self.warehouse)
 		validate_warehouse_company(self.warehouse, self.company)
 		self.scrub_posting_time()
+		self.posting_datetime = get_combine_datetime(self.posting_date, self.posting_time)
 		self.validate_and_set_fiscal_year()
 		self.block_transactions_against_group_warehouse()
 		self.validate_with_last_transaction_posting_time()
@@ -78,15 +83,16 @@ class StockLedgerEntry(Document):
 		if self.voucher_type != "Stock Reconciliation" and not self.actual_qty:
 			frappe.throw(_("Actual Qty is mandatory"))
 
-	def validate_item(self):
-		item_det = frappe.db.sql("""select name, item_name, has_batch_no, docstatus,
-			is_stock_item, has_variants, stock_uom, create_new_batch
-			from tabItem where name=%s""", self.item_code, as_dict=True)
-
+	def validate_item(self, item_det=None, batch_details=None):
 		if not item_det:
-			frappe.throw(_("Item {0} not found").format(self.item_code))
+			item_det = frappe.db.sql("""select name, item_name, has_batch_no, docstatus,
+				is_stock_item, has_variants, stock_uom, create_new_batch
+				from tabItem where name=%s""", self.item_code, as_dict=True)
+
+			if not item_det:
+				frappe.throw(_("Item {0} not found").format(self.item_code))
 
-		item_det = item_det[0]
+			item_det = item_det[0]
 
 		if item_det.is_stock_item != 1:
 			frappe.throw(_("Item {0} must be a stock Item").format(self.item_code))
@@ -96,7 +102,7 @@ class StockLedgerEntry(Document):
 			batch_item = self.item_code if self.item_code == item_det.item_name else self.item_code + ":" + item_det.item_name
 			if not self.batch_no:
 				frappe.throw(_("Batch number is mandatory for Item {0}").format(batch_item))
-			elif not frappe.db.get_value("Batch",{"item": self.item_code, "name": self.batch_no}):
+			elif not self.is_valid_batch(batch_details):
 				frappe.throw(_("{0} is not a valid Batch Number for Item {1}").format(self.batch_no, batch_item))
 
 		elif item_det.has_batch_no == 0 and self.batch_no and self.is_cancelled == 0:
@@ -108,6 +114,12 @@ class StockLedgerEntry(Document):
 
 		self.stock_uom = item_det.stock_uom
 
+	def is_valid_batch(self, batch_details=None):
+		if batch_details is not None:
+			return batch_details.get(self.batch_no, {}).get("item") == self.item_code
+
+		return frappe.db.get_value("Batch",{"item": self.item_code, "name": self.batch_no})
+
 	def check_stock_frozen_date(self):
 		stock_settings = frappe.get_cached_doc('Stock Settings')
 
@@ -127,9 +139,12 @@ class StockLedgerEntry(Document):
 		if not self.posting_time or self.posting_time == '00:0':
 			self.posting_time = '00:00'
 
-	def validate_batch(self):
+	def validate_batch(self, batch_details=None):
 		if self.batch_no and self.voucher_type != "Stock Entry":
-			expiry_date = frappe.db.get_value("Batch", self.batch_no, "expiry_date")
+			if batch_details is not None:
+				expiry_date = batch_details.get(self.batch_no, {}).get("expiry_date")
+			else:
+				expiry_date = frappe.db.get_value("Batch", self.batch_no, "expiry_date")
 			if expiry_date:
 				if getdate(self.posting_date) > getdate(expiry_date):
 					frappe.throw(_("Batch {0} of Item {1} has expired.").format(self.batch_no, self.item_code))
@@ -147,28 +162,50 @@ class StockLedgerEntry(Document):
 		is_group_warehouse(self.warehouse)
 
 	def validate_with_last_transaction_posting_time(self):
-		authorized_role = frappe.db.get_single_value("Stock Settings", "role_allowed_to_create_edit_back_dated_transactions")
-		if authorized_role:
-			authorized_users = get_users(authorized_role)
-			if authorized_users and frappe.session.user not in authorized_users:
-				last_transaction_time = frappe.db.sql("""
-					select MAX(timestamp(posting_date, posting_time)) as posting_time
-					from `tabStock Ledger Entry`
-					where docstatus = 1 and is_cancelled = 0 and item_code = %s
-					and warehouse = %s""", (self.item_code, self.warehouse))[0][0]
-
-				cur_doc_posting_datetime = "%s %s" % (self.posting_date, self.get("posting_time") or "00:00:00")
-
-				if last_transaction_time and get_datetime(cur_doc_posting_datetime) < get_datetime(last_transaction_time):
-					msg = _("Last Stock Transaction for item {0} under warehouse {1} was on {2}.").format(frappe.bold(self.item_code),
-						frappe.bold(self.warehouse), frappe.bold(last_transaction_time))
-
-					msg += "<br><br>" + _("You are not authorized to make/edit Stock Transactions for Item {0} under warehouse {1} before this time.").format(
-						frappe.bold(self.item_code), frappe.bold(self.warehouse))
-
-					msg += "<br><br>" + _("Please contact any of the following users to {} this transaction.")
-					msg += "<br>" + "<br>".join(authorized_users)
-					frappe.throw(msg, BackDatedStockTransaction, title=_("Backdated Stock Entry"))
+		authorized_users = get_back_dated_transaction_approvers()
+		if authorized_users:
+			last_transaction_time = get_last_transaction_times([(self.item_code, self.warehouse)]) \
+				.get((self.item_code, self.warehouse))
+			self.validate_back_dated_transaction(last_transaction_time, authorized_users)
+
+	def validate_back_dated_transaction(self, last_transaction_time, authorized_users):
+		if last_transaction_time and get_datetime(self.posting_datetime) < get_datetime(last_transaction_time):
+			msg = _("Last Stock Transaction for item {0} under warehouse {1} was on {2}.").format(frappe.bold(self.item_code),
+				frappe.bold(self.warehouse), frappe.bold(last_transaction_time))
+
+			msg += "<br><br>" + _("You are not authorized to make/edit Stock Transactions for Item {0} under warehouse {1} before this time.").format(
+				frappe.bold(self.item_code), frappe.bold(self.warehouse))
+
+			msg += "<br><br>" + _("Please contact any of the following users to {} this transaction.")
+			msg += "<br>" + "<br>".join(authorized_users)
+			frappe.throw(msg, BackDatedStockTransaction, title=_("Backdated Stock Entry"))
+
+def get_back_dated_transaction_approvers():
+	"""Users allowed to make back-dated entries, if the session user is not one of them"""
+	authorized_role = frappe.db.get_single_value("Stock Settings", "role_allowed_to_create_edit_back_dated_transactions")
+	if authorized_role:
+		authorized_users = get_users(authorized_role)
+		if authorized_users and frappe.session.user not in authorized_users:
+			return authorized_users
+
+def get_last_transaction_times(item_warehouses):
+	"""Posting datetime of the last entry of the item-warehouses, in one query"""
+	item_warehouses = set(item_warehouses)
+	if not item_warehouses:
+		return {}
+
+	last_transaction_times = frappe.db.sql("""
+		select item_code, warehouse, MAX(posting_datetime) as posting_time
+		from `tabStock Ledger Entry`
+		where docstatus = 1 and is_cancelled = 0 and item_code in %(item_codes)s
+		and warehouse in %(warehouses)s
+		group by item_code, warehouse""", {
+			"item_codes": list({item_code for item_code, warehouse in item_warehouses}),
+			"warehouses": list({warehouse for item_code, warehouse in item_warehouses})
+		}, as_dict=1)
+
+	return {(d.item_code, d.warehouse): d.posting_time for d in last_transaction_times
+		if (d.item_code, d.warehouse) in item_warehouses}
 
 def on_doctype_update():
 	if not frappe.db.has_index('tabStock Ledger Entry', 'posting_sort_index'):
@@ -180,3 +217,5 @@ def on_doctype_update():
 	frappe.db.add_index("Stock Ledger Entry", ["voucher_no", "voucher_type"])
 	frappe.db.add_index("Stock Ledger Entry", ["batch_no", "item_code", "warehouse"])
 	frappe.db.add_index("Stock Ledger Entry", ["warehouse", "item_code"], "item_warehouse")
+	frappe.db.add_index("Stock Ledger Entry", ["item_code", "warehouse", "posting_datetime", "creation"],
+		"item_warehouse_posting_datetime")
@@ -1,9 +1,11 @@
 # Copyright (c) 2015, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
+from unittest.mock import patch
+
 import frappe
 from frappe.core.page.permission_manager.permission_manager import reset
-from frappe.utils import add_days, today
+from frappe.utils import add_days, get_datetime, today
 
 from erpnext.stock.doctype.delivery_note.test_delivery_note import create_delivery_note
 from erpnext.stock.doctype.item.test_item import make_item
@@ -16,7 +18,12 @@ from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import BackDate
 from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import (
 	create_stock_reconciliation,
 )
-from erpnext.stock.stock_ledger import get_previous_sle
+from erpnext.stock.stock_ledger import (
+	get_previous_sle,
+	get_previous_sle_of_current_voucher,
+	get_sle_to_be_reposted,
+	get_stock_ledger_entries,
+)
 from erpnext.tests.utils import ERPNextTestCase
 
 
@@ -347,6 +354,64 @@ class TestStockLedgerEntry(ERPNextTestCase):
 			frappe.set_user("Administrator")
 			user.remove_roles("Stock Manager")
 
+	def test_prefetched_sle_for_reposting(self):
+		# entries fetched in bulk for reposting should match the ones fetched per item-warehouse
+		items = ["_Test Item for Reposting", "_Test Finished Item for Reposting"]
+		warehouses = ["Stores - _TC", "Finished Goods - _TC"]
+
+		for posting_date in ("2020-06-01", "2020-06-05", "2020-06-10"):
+			for item_code in items:
+				for warehouse in warehouses:
+					make_stock_entry(item_code=item_code, target=warehouse, qty=10, rate=100,
+						company="_Test Company", posting_date=posting_date, posting_time="10:00")
+
+		args = [frappe._dict({"item_code": item_code, "warehouse": warehouse,
+			"posting_date": "2020-06-05", "posting_time": "10:00"})
+			for item_code in items for warehouse in warehouses]
+
+		prefetched_sle = get_sle_to_be_reposted(args)
+
+		for d in args:
+			previous_sle = get_previous_sle_of_current_voucher(frappe._dict(d))
+			future_sle = get_stock_ledger_entries(previous_sle, ">", "asc", check_serial_no=False)
+
+			prefetched = prefetched_sle[(d.item_code, d.warehouse)]
+			self.assertEqual(prefetched.previous_sle.name, previous_sle.name)
+			self.assertEqual([sle.name for sle in prefetched.future_sle], [sle.name for sle in future_sle])
+			self.assertEqual(len(prefetched.future_sle), 2)
+
+	def test_previous_sle_after_new_entry(self):
+		# previous entry memoized for the request should not outlive a new entry before it
+		item_code, warehouse = "_Test Item for Reposting", "Stores - _TC"
+		args = {"item_code": item_code, "warehouse": warehouse,
+			"posting_date": "2020-07-10", "posting_time": "10:00"}
+
+		make_stock_entry(item_code=item_code, target=warehouse, qty=10, rate=100,
+			company="_Test Company", posting_date="2020-07-01", posting_time="10:00")
+		self.assertEqual(get_previous_sle(dict(args)).qty_after_transaction, 10)
+
+		se = make_stock_entry(item_code=item_code, target=warehouse, qty=5, rate=100,
+			company="_Test Company", posting_date="2020-07-05", posting_time="10:00:00.500")
+		previous_sle = get_previous_sle(dict(args))
+		self.assertEqual(previous_sle.qty_after_transaction, 15)
+		self.assertEqual(previous_sle.voucher_no, se.name)
+		self.assertEqual(get_datetime(previous_sle.posting_datetime), get_datetime("2020-07-05 10:00:00.500"))
+
+		# entries within the same second are not before the current voucher
+		previous_sle = get_previous_sle_of_current_voucher(frappe._dict(args,
+			posting_date="2020-07-05", posting_time="10:00:00.900"))
+		self.assertEqual(previous_sle.qty_after_transaction, 10)
+
+	def test_previous_sle_memo_within_a_second(self):
+		# lookups at nowtime() within the same second share the memoized entry
+		args = {"item_code": "_Test Item for Reposting", "warehouse": "Stores - _TC",
+			"posting_date": "2020-07-10", "posting_time": "10:00:00.100"}
+		previous_sle = get_previous_sle(dict(args))
+
+		with patch("erpnext.stock.stock_ledger.get_stock_ledger_entries") as get_entries:
+			self.assertEqual(get_previous_sle(dict(args, posting_time="10:00:00.900")), previous_sle)
+			get_entries.assert_not_called()
+
 
 def create_repack_entry(**args):
 	args = frappe._dict(args)
@@ -11,16 +11,20 @@ from erpnext.accounts.utils import get_company_default
 from erpnext.controllers.stock_controller import StockController
 from erpnext.stock.doctype.batch.batch import get_batch_qty
 from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
-from erpnext.stock.utils import get_stock_balance
+from erpnext.stock.utils import get_combine_datetime, get_stock_balance
 
 
 class OpeningEntryAccountError(frappe.ValidationError): pass
 class EmptyStockReconciliationItemsError(frappe.ValidationError): pass
 
+# reconciliations with at least these many rows make their stock ledger entries in bulk
+BULK_RECONCILIATION_THRESHOLD = 500
+
 class StockReconciliation(StockController):
 	def __init__(self, *args, **kwargs):
 		super(StockReconciliation, self).__init__(*args, **kwargs)
 		self.head_row = ["Item Code", "Warehouse", "Quantity", "Valuation Rate"]
+		self.item_details = {}
 
 	def validate(self):
 		if not self.expense_account:
@@ -57,9 +61,10 @@ class StockReconciliation(StockController):
 	def remove_items_with_no_change(self):
 		"""Remove items if qty or rate is not changed"""
 		self.difference_amount = 0.0
+		current_balances = self.get_current_balances()
+
 		def _changed(item):
-			item_dict = get_stock_balance_for(item.item_code, item.warehouse,
-				self.posting_date, self.posting_time, batch_no=item.batch_no)
+			item_dict = current_balances[(item.item_code, item.warehouse, item.batch_no)]
 
 			if ((item.qty is None or item.qty==item_dict.get("qty")) and
 				(item.valuation_rate is None or item.valuation_rate==item_dict.get("rate")) and
@@ -97,6 +102,60 @@ class StockReconciliation(StockController):
 				item.idx = i + 1
 			frappe.msgprint(_("Removed items with no change in quantity or value."))
 
+	def get_item_details(self, item_code):
+		"""Details of an item, fetched together with the items of all rows"""
+		if item_code not in self.item_details:
+			item_codes = list({d.item_code for d in self.items if d.item_code not in self.item_details})
+			self.item_details.update({d.name: d for d in frappe.get_all("Item",
+				filters={"name": ("in", item_codes + [item_code])},
+				fields=["name", "item_name", "stock_uom", "is_stock_item", "has_serial_no", "serial_no_series",
+					"has_batch_no", "create_new_batch", "end_of_life", "disabled", "docstatus",
+					"is_customer_provided_item"])})
+
+		return self.item_details.get(item_code)
+
+	def get_current_balances(self):
+		"""
+			Current qty, valuation rate and serial nos of all rows by (item_code, warehouse, batch_no).
+
+			The previous entries of all item-warehouses and the balances of all batches are
+			fetched together, serialized items and batch items without batch are looked up per row.
+		"""
+		from erpnext.stock.stock_ledger import get_previous_sle_for_item_warehouses
+
+		previous_sle = get_previous_sle_for_item_warehouses([(d.item_code, d.warehouse) for d in self.items],
+			self.posting_date, self.posting_time)
+
+		batch_qty = {}
+		batches = list({d.batch_no for d in self.items if d.batch_no})
+		if batches:
+			batch_qty = {(batch_no, warehouse): flt(qty) for batch_no, warehouse, qty in frappe.db.sql("""
+				select batch_no, warehouse, sum(actual_qty)
+				from `tabStock Ledger Entry`
+				where is_cancelled = 0 and batch_no in %(batches)s and posting_datetime <= %(posting_datetime)s
+				group by batch_no, warehouse""", {
+					"batches": batches,
+					"posting_datetime": get_combine_datetime(self.posting_date, self.posting_time)
+				})}
+
+		current_balances = {}
+		for d in self.items:
+			item = self.get_item_details(d.item_code)
+			if not item or item.has_serial_no or (item.has_batch_no and not d.batch_no):
+				current_balances[(d.item_code, d.warehouse, d.batch_no)] = get_stock_balance_for(d.item_code,
+					d.warehouse, self.posting_date, self.posting_time, batch_no=d.batch_no)
+				continue
+
+			sle = previous_sle.get((d.item_code, d.warehouse)) or {}
+			current_balances[(d.item_code, d.warehouse, d.batch_no)] = {
+				"qty": (batch_qty.get((d.batch_no, d.warehouse), 0) if item.has_batch_no
+					else sle.get("qty_after_transaction", 0.0)),
+				"rate": sle.get("valuation_rate", 0.0),
+				"serial_nos": ""
+			}
+
+		return current_balances
+
 	def validate_data(self):
 		def _get_msg(row_num, msg):
 			return _("Row # {0}:").format(row_num+1) + " " + msg
@@ -105,6 +164,8 @@ class StockReconciliation(StockController):
 		item_warehouse_combinations = []
 
 		default_currency = frappe.db.get_default("currency")
+		warehouses = set(frappe.get_all("Warehouse",
+			filters={"name": ("in", list({d.warehouse for d in self.items}))}, pluck="name"))
 
 		for row_num, row in enumerate(self.items):
 			# find duplicates
@@ -121,7 +182,7 @@ class StockReconciliation(StockController):
 			self.validate_item(row.item_code, row)
 
 			# validate warehouse
-			if not frappe.db.get_value("Warehouse", row.warehouse):
+			if row.warehouse not in warehouses:
 				self.validation_messages.append(_get_msg(row_num, _("Warehouse not found in the system")))
 
 			# if both not specified
@@ -170,7 +231,7 @@ class StockReconciliation(StockController):
 		# using try except to catch all validation msgs and display together
 
 		try:
-			item = frappe.get_doc("Item", item_code)
+			item = self.get_item_details(item_code) or frappe.get_doc("Item", item_code)
 
 			# end of life and stock item
 			validate_end_of_life(item_code, item.end_of_life, item.disabled)
@@ -193,13 +254,13 @@ class StockReconciliation(StockController):
 	def update_stock_ledger(self):
 		"""	find difference between current and expected entries
 			and create stock ledger entries based on the difference"""
-		from erpnext.stock.stock_ledger import get_previous_sle
+		from erpnext.stock.stock_ledger import get_previous_sle, make_sl_entries_in_bulk
 
 		sl_entries = []
 		has_serial_no = False
 		has_batch_no = False
 		for row in self.items:
-			item = frappe.get_doc("Item", row.item_code)
+			item = self.get_item_details(row.item_code)
 			if item.has_batch_no:
 				has_batch_no = True
 
@@ -243,7 +304,11 @@ class StockReconciliation(StockController):
 			if has_batch_no:
 				allow_negative_stock = True
 
-			self.make_sl_entries(sl_entries, allow_negative_stock=allow_negative_stock)
+			if len(self.items) >= BULK_RECONCILIATION_THRESHOLD:
+				make_sl_entries_in_bulk(sl_entries, allow_negative_stock=allow_negative_stock,
+					publish_progress=True)
+			else:
+				self.make_sl_entries(sl_entries, allow_negative_stock=allow_negative_stock)
 
 		if has_serial_no and sl_entries:
 			self.update_valuation_rate_for_serial_no()
@@ -349,7 +414,7 @@ class StockReconciliation(StockController):
 			"voucher_no": self.name,
 			"voucher_detail_no": row.name,
 			"company": self.company,
-			"stock_uom": frappe.db.get_value("Item", row.item_code, "stock_uom"),
+			"stock_uom": self.get_item_details(row.item_code).stock_uom,
 			"is_cancelled": 1 if self.docstatus == 2 else 0,
 			"serial_no": '\n'.join(serial_nos) if serial_nos else '',
 			"batch_no": row.batch_no,
@@ -450,7 +515,7 @@ class StockReconciliation(StockController):
 		changed_any_values = False
 
 		for d in self.get('items'):
-			is_customer_item = frappe.db.get_value('Item', d.item_code, 'is_customer_provided_item')
+			is_customer_item = self.get_item_details(d.item_code).is_customer_provided_item
 			if is_customer_item and d.valuation_rate:
 				d.valuation_rate = 0.0
 				changed_any_values = True
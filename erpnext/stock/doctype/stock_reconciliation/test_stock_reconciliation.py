@@ -5,6 +5,8 @@
 # For license information, please see license.txt
 
 
+from unittest.mock import patch
+
 import frappe
 from frappe.utils import add_days, flt, nowdate, nowtime, random_string
 
@@ -12,6 +14,7 @@ from erpnext.accounts.utils import get_stock_and_account_balance
 from erpnext.stock.doctype.item.test_item import create_item
 from erpnext.stock.doctype.purchase_receipt.test_purchase_receipt import make_purchase_receipt
 from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
+from erpnext.stock.doctype.stock_reconciliation import stock_reconciliation
 from erpnext.stock.doctype.stock_reconciliation.stock_reconciliation import (
 	EmptyStockReconciliationItemsError,
 	get_items,
@@ -399,6 +402,75 @@ class TestStockReconciliation(ERPNextTestCase):
 			, do_not_submit=True)
 		self.assertRaises(frappe.ValidationError, sr.submit)
 
+	def test_bulk_reconciliation(self):
+		# entries made in bulk should match the ones made row by row
+		from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+
+		create_batch_item_with_batch("Testing Batch Item 1", "001")
+		create_batch_item_with_batch("Testing Batch Item 1", "BULK-RECO-001")
+		fields = ["item_code", "batch_no", "actual_qty", "qty_after_transaction", "valuation_rate",
+			"stock_value", "stock_value_difference", "stock_queue", "posting_datetime"]
+
+		results = []
+		for threshold, warehouse_name in ((1000, "_Test Warehouse for Bulk Reco1"), (1, "_Test Warehouse for Bulk Reco2")):
+			warehouse = create_warehouse(warehouse_name)
+			make_stock_entry(item_code="_Test Item", target=warehouse, qty=10, rate=100,
+				posting_date="2021-01-05", posting_time="10:00")
+
+			sr = create_stock_reconciliation(item_code="_Test Item", warehouse=warehouse, qty=25, rate=150,
+				posting_date="2021-01-10", posting_time="10:00", do_not_submit=1)
+			sr.append("items", {"item_code": "Testing Batch Item 1", "warehouse": warehouse,
+				"qty": 5, "valuation_rate": 200, "batch_no": "001"})
+			sr.append("items", {"item_code": "Testing Batch Item 1", "warehouse": warehouse,
+				"qty": 7, "valuation_rate": 300, "batch_no": "BULK-RECO-001"})
+
+			with patch.object(stock_reconciliation, "BULK_RECONCILIATION_THRESHOLD", threshold):
+				sr.submit()
+
+			results.append((
+				frappe.get_all("Stock Ledger Entry", filters={"voucher_no": sr.name},
+					fields=fields, order_by="item_code, actual_qty", as_list=1),
+				frappe.get_all("Bin", filters={"warehouse": warehouse},
+					fields=["item_code", "actual_qty", "projected_qty", "valuation_rate", "stock_value"],
+					order_by="item_code", as_list=1)
+			))
+
+		self.assertEqual(results[0], results[1])
+		self.assertEqual(frappe.db.get_value("Bin", {"item_code": "_Test Item",
+			"warehouse": create_warehouse("_Test Warehouse for Bulk Reco2")}, "actual_qty"), 25)
+
+		# the entries of the batches tie on posting datetime, the last one made has the balance
+		last_sle = frappe.get_all("Stock Ledger Entry",
+			filters={"item_code": "Testing Batch Item 1", "warehouse": create_warehouse("_Test Warehouse for Bulk Reco2"),
+				"is_cancelled": 0},
+			fields=["qty_after_transaction", "stock_value"],
+			order_by="posting_datetime desc, creation desc", limit=1)[0]
+		self.assertEqual((last_sle.qty_after_transaction, last_sle.stock_value), (12, 3100))
+
+	@change_settings("Stock Settings", {"role_allowed_to_create_edit_back_dated_transactions": "Stock Manager"})
+	def test_bulk_back_dated_entries(self):
+		# back-dated entries validated in bulk are blocked like the ones submitted row by row
+		from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+		from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import BackDatedStockTransaction
+		from erpnext.stock.stock_ledger import validate_sl_entries_in_bulk
+
+		warehouse = create_warehouse("_Test Warehouse for Bulk Reco3")
+		make_stock_entry(item_code="_Test Item", target=warehouse, qty=10, rate=100)
+		sr = create_stock_reconciliation(item_code="_Test Item", warehouse=warehouse, qty=25, rate=150,
+			posting_date=add_days(nowdate(), -1), do_not_submit=1)
+
+		user = frappe.get_doc("User", "test@example.com")
+		user.add_roles("Stock User")
+		user.remove_roles("Stock Manager")
+		frappe.set_user(user.name)
+
+		try:
+			self.assertRaises(BackDatedStockTransaction, validate_sl_entries_in_bulk,
+				[sr.get_sle_for_items(sr.items[0])])
+		finally:
+			frappe.set_user("Administrator")
+
+
 def create_batch_item_with_batch(item_name, batch_id):
 	batch_item_doc = create_item(item_name, is_stock_item=1)
 	if not batch_item_doc.has_batch_no:
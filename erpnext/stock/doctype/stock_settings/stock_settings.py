@@ -36,6 +36,7 @@ class StockSettings(Document):
 		self.validate_warehouses()
 		self.cant_change_valuation_method()
 		self.validate_clean_description_html()
+		self.validate_stock_queue_format()
 
 	def validate_warehouses(self):
 		warehouse_fields = ["default_warehouse", "sample_retention_warehouse"]
@@ -64,6 +65,12 @@ class StockSettings(Document):
 			# changed to text
 			frappe.enqueue('erpnext.stock.doctype.stock_settings.stock_settings.clean_all_descriptions', now=frappe.flags.in_test)
 
+	def validate_stock_queue_format(self):
+		if self.stock_queue_format != (self.db_get('stock_queue_format') or "JSON"):
+			# re-encode the stock queue of existing entries
+			frappe.enqueue('erpnext.stock.stock_queue.convert_stock_queue', queue='long',
+				queue_format=self.stock_queue_format, now=frappe.flags.in_test)
+
 	def on_update(self):
 		self.toggle_warehouse_field_for_inter_warehouse_transfer()
 
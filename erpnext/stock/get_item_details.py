@@ -121,6 +121,85 @@ def get_item_details(args, doc=None, for_validate=False, overwrite_warehouse=Tru
 
 	return out
 
+@frappe.whitelist()
+def get_item_details_bulk(args_list, doc=None, for_validate=False, overwrite_warehouse=True):
+	"""
+		Item details of all the rows of a document, same as `get_item_details` per row, with the
+		item prices, bins and pricing rule index fetched once for all the rows
+
+		args_list = [args of `get_item_details`, ...]
+	"""
+	if isinstance(args_list, str):
+		args_list = json.loads(args_list)
+
+	if isinstance(doc, str):
+		doc = json.loads(doc)
+
+	args_list = [frappe._dict(json.loads(args) if isinstance(args, str) else args) for args in args_list]
+
+	started = prefetch_item_details(args_list)
+	try:
+		return [get_item_details(args, doc, for_validate, overwrite_warehouse) for args in args_list]
+	finally:
+		if started:
+			clear_item_details_prefetch()
+
+def prefetch_item_details(args_list):
+	"""
+		Fetch the items, item prices and bins of the rows with one query each, used by
+		`get_item_price`, `get_bin_details` and `get_valuation_rate` until cleared.
+		Returns False if a prefetch is already active.
+	"""
+	if frappe.flags.item_details_prefetch:
+		return False
+
+	item_codes = {args.get("item_code") for args in args_list if args.get("item_code")}
+	price_lists = {args.get("price_list") or args.get("selling_price_list") or args.get("buying_price_list")
+		for args in args_list} - {None, ""}
+
+	prefetch = frappe._dict({
+		"item_codes": set(),
+		"price_lists": price_lists,
+		"item_prices": {},
+		"bins": {}
+	})
+
+	if item_codes:
+		for d in frappe.get_all("Item", filters={"name": ("in", list(item_codes))}, fields=["name", "variant_of"]):
+			prefetch.item_codes.add(d.name)
+			if d.variant_of:
+				prefetch.item_codes.add(d.variant_of)
+
+	if prefetch.item_codes and price_lists:
+		for d in frappe.db.sql("""
+			select name, item_code, price_list, price_list_rate, uom, batch_no,
+				customer, supplier, valid_from, valid_upto
+			from `tabItem Price`
+			where item_code in %s and price_list in %s""",
+			(list(prefetch.item_codes), list(price_lists)), as_dict=1):
+			prefetch.item_prices.setdefault((d.item_code, d.price_list), []).append(d)
+
+	if prefetch.item_codes:
+		for d in frappe.db.sql("""
+			select item_code, warehouse, projected_qty, actual_qty, reserved_qty, valuation_rate
+			from `tabBin` where item_code in %s""", [list(prefetch.item_codes)], as_dict=1):
+			prefetch.bins[(d.item_code, d.warehouse)] = d
+
+	frappe.flags.item_details_prefetch = prefetch
+
+	return True
+
+def clear_item_details_prefetch():
+	frappe.flags.item_details_prefetch = None
+
+def get_prefetched_bin(item_code, warehouse):
+	"""Returns (is_prefetched, bin row)"""
+	prefetch = frappe.flags.item_details_prefetch
+	if not prefetch or item_code not in prefetch.item_codes:
+		return False, None
+
+	return True, prefetch.bins.get((item_code, warehouse))
+
 def update_stock(args, out):
 	if (args.get("doctype") == "Delivery Note" or
 		(args.get("doctype") == "Sales Invoice" and args.get('update_stock'))) \
@@ -489,16 +568,17 @@ def get_item_tax_template(args, item, out):
 			"item_tax_template": None
 		}
 	"""
+	index = get_item_tax_index(args.get("company"))
+
 	item_tax_template = None
-	if item.taxes:
-		item_tax_template = _get_item_tax_template(args, item.taxes, out)
+	if index.item_taxes.get(item.name):
+		item_tax_template = _get_item_tax_template(args, index.item_taxes[item.name], out)
 
 	if not item_tax_template:
 		item_group = item.item_group
 		while item_group and not item_tax_template:
-			item_group_doc = frappe.get_cached_doc("Item Group", item_group)
-			item_tax_template = _get_item_tax_template(args, item_group_doc.taxes, out)
-			item_group = item_group_doc.parent_item_group
+			item_tax_template = _get_item_tax_template(args, index.item_group_taxes.get(item_group, []), out)
+			item_group = index.parent_item_groups.get(item_group)
 
 def _get_item_tax_template(args, taxes, out=None, for_validate=False):
 	if out is None:
@@ -507,7 +587,9 @@ def _get_item_tax_template(args, taxes, out=None, for_validate=False):
 	taxes_with_no_validity = []
 
 	for tax in taxes:
-		tax_company = frappe.get_cached_value("Item Tax Template", tax.item_tax_template, 'company')
+		# rows of the item tax index carry the company of their template
+		tax_company = tax.get("template_company") \
+			or frappe.get_cached_value("Item Tax Template", tax.item_tax_template, 'company')
 		if tax_company == args['company']:
 			if (tax.valid_from or tax.maximum_net_rate):
 				# In purchase Invoice first preference will be given to supplier invoice date
@@ -556,7 +638,10 @@ def is_within_valid_range(args, tax):
 @frappe.whitelist()
 def get_item_tax_map(company, item_tax_template, as_json=True):
 	item_tax_map = {}
-	if item_tax_template:
+	tax_maps = get_item_tax_index(company).tax_maps
+	if item_tax_template in tax_maps:
+		item_tax_map = dict(tax_maps[item_tax_template])
+	elif item_tax_template:
 		template = frappe.get_cached_doc("Item Tax Template", item_tax_template)
 		for d in template.taxes:
 			if frappe.get_cached_value("Account", d.tax_type, "company") == company:
@@ -564,6 +649,71 @@ def get_item_tax_map(company, item_tax_template, as_json=True):
 
 	return json.dumps(item_tax_map) if as_json else item_tax_map
 
+def get_item_tax_index(company):
+	"""
+		Item Tax rows of the items and item groups with templates of the company, the tax maps of
+		these templates and the parents of the item groups
+
+		The index is kept in redis per company and memoized for the request. It is cleared when
+		an Item, Item Group or Item Tax Template is changed and when the transaction is rolled back.
+	"""
+	if not company:
+		return frappe._dict({"item_taxes": {}, "item_group_taxes": {}, "parent_item_groups": {}, "tax_maps": {}})
+
+	if not hasattr(frappe.local, "item_tax_index"):
+		frappe.local.item_tax_index = {}
+
+	if company not in frappe.local.item_tax_index:
+		index = frappe.cache().hget("item_tax_index", company)
+		if index is None:
+			index = build_item_tax_index(company)
+			frappe.cache().hset("item_tax_index", company, index)
+
+		frappe.local.item_tax_index[company] = index
+
+	return frappe.local.item_tax_index[company]
+
+def build_item_tax_index(company):
+	index = frappe._dict({"item_taxes": {}, "item_group_taxes": {}, "parent_item_groups": {}, "tax_maps": {}})
+
+	for d in frappe.db.sql("""
+		select tax.parenttype, tax.parent, tax.item_tax_template, tax.tax_category, tax.valid_from,
+			tax.minimum_net_rate, tax.maximum_net_rate, template.company as template_company
+		from `tabItem Tax` tax, `tabItem Tax Template` template
+		where tax.item_tax_template = template.name and template.company = %s
+			and tax.parenttype in ('Item', 'Item Group')
+		order by tax.parent, tax.idx""", company, as_dict=1):
+		taxes = index.item_taxes if d.pop("parenttype") == "Item" else index.item_group_taxes
+		taxes.setdefault(d.pop("parent"), []).append(d)
+
+	index.parent_item_groups = dict(frappe.db.sql("select name, parent_item_group from `tabItem Group`"))
+
+	for template, tax_type, tax_rate in frappe.db.sql("""
+		select detail.parent, detail.tax_type, detail.tax_rate
+		from `tabItem Tax Template Detail` detail, `tabAccount` account
+		where detail.tax_type = account.name and account.company = %s
+			and detail.parenttype = 'Item Tax Template'
+		order by detail.parent, detail.idx""", company):
+		index.tax_maps.setdefault(template, {})[tax_type] = tax_rate
+
+	# templates without taxes of the company
+	for template in frappe.get_all("Item Tax Template", filters={"company": company}, pluck="name"):
+		index.tax_maps.setdefault(template, {})
+
+	return index
+
+class ItemTaxIndexObserver:
+	def on_rollback(self):
+		clear_item_tax_index()
+
+def clear_item_tax_index():
+	frappe.cache().delete_value("item_tax_index")
+	frappe.local.item_tax_index = {}
+
+	# the index may be rebuilt with changes that are rolled back later
+	if not any(isinstance(observer, ItemTaxIndexObserver) for observer in frappe.local.rollback_observers):
+		frappe.local.rollback_observers.append(ItemTaxIndexObserver())
+
 @frappe.whitelist()
 def calculate_service_end_date(args, item=None):
 	args = process_args(args)
@@ -699,6 +849,10 @@ def insert_item_price(args):
 	if frappe.db.get_value("Price List", args.price_list, "currency", cache=True) == args.currency \
 		and cint(frappe.db.get_single_value("Stock Settings", "auto_insert_price_list_rate_if_missing")):
 		if frappe.has_permission("Item Price", "write"):
+			if frappe.flags.item_details_prefetch:
+				# prices of the item are changed, read them from the database from here on
+				frappe.flags.item_details_prefetch.item_codes.discard(args.item_code)
+
 			price_list_rate = (args.rate / args.get('conversion_factor')
 				if args.get("conversion_factor") else args.rate)
 
@@ -733,6 +887,11 @@ def get_item_price(args, item_code, ignore_party=False):
 
 	args['item_code'] = item_code
 
+	prefetch = frappe.flags.item_details_prefetch
+	if prefetch and item_code in prefetch.item_codes and args.get("price_list") in prefetch.price_lists:
+		return filter_item_prices(prefetch.item_prices.get((item_code, args.get("price_list")), []),
+			args, ignore_party)
+
 	conditions = """where item_code=%(item_code)s
 		and price_list=%(price_list)s
 		and ifnull(uom, '') in ('', %(uom)s)"""
@@ -759,6 +918,37 @@ def get_item_price(args, item_code, ignore_party=False):
 		from `tabItem Price` {conditions}
 		order by valid_from desc, batch_no desc, uom desc """.format(conditions=conditions), args)
 
+def filter_item_prices(item_prices, args, ignore_party=False):
+	"""Apply the conditions and order of `get_item_price` on prefetched Item Price rows"""
+	def is_applicable(d):
+		if cstr(d.uom) not in ('', args.get('uom')) or cstr(d.batch_no) not in ('', args.get('batch_no')):
+			return False
+
+		if not ignore_party:
+			if args.get("customer"):
+				if d.customer != args.get("customer"):
+					return False
+			elif args.get("supplier"):
+				if d.supplier != args.get("supplier"):
+					return False
+			elif d.customer or d.supplier:
+				return False
+
+		for date in (args.get('transaction_date'), args.get('posting_date')):
+			if date and not (getdate(d.valid_from or '2000-01-01') <= getdate(date)
+				<= getdate(d.valid_upto or '2500-12-31')):
+				return False
+
+		return True
+
+	item_prices = [d for d in item_prices if is_applicable(d)]
+
+	# order by valid_from desc, batch_no desc, uom desc (nulls last)
+	for fieldname in ("uom", "batch_no", "valid_from"):
+		item_prices.sort(key=lambda d: (d.get(fieldname) is not None, d.get(fieldname) or ""), reverse=True)
+
+	return [(d.name, d.price_list_rate, d.uom) for d in item_prices]
+
 def get_price_list_rate_for(args, item_code):
 	"""
 		:param customer: link to Customer DocType
@@ -984,9 +1174,15 @@ def get_projected_qty(item_code, warehouse):
 
 @frappe.whitelist()
 def get_bin_details(item_code, warehouse, company=None):
-	bin_details = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
-		["projected_qty", "actual_qty", "reserved_qty"], as_dict=True, cache=True) \
-			or {"projected_qty": 0, "actual_qty": 0, "reserved_qty": 0}
+	is_prefetched, bin_details = get_prefetched_bin(item_code, warehouse)
+	if is_prefetched:
+		bin_details = bin_details and frappe._dict({fieldname: bin_details[fieldname]
+			for fieldname in ("projected_qty", "actual_qty", "reserved_qty")})
+	else:
+		bin_details = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
+			["projected_qty", "actual_qty", "reserved_qty"], as_dict=True, cache=True)
+
+	bin_details = bin_details or {"projected_qty": 0, "actual_qty": 0, "reserved_qty": 0}
 	if company:
 		bin_details['company_total_stock'] = get_company_total_stock(item_code, company)
 	return bin_details
@@ -1148,6 +1344,11 @@ def get_valuation_rate(item_code, company, warehouse=None):
 		if not warehouse:
 			warehouse = item.get("default_warehouse") or item_group.get("default_warehouse") or brand.get("default_warehouse")
 
+		is_prefetched, bin_details = get_prefetched_bin(item_code, warehouse)
+		if is_prefetched:
+			return bin_details and frappe._dict({"valuation_rate": bin_details.valuation_rate}) \
+				or {"valuation_rate": 0}
+
 		return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
 			["valuation_rate"], as_dict=True) or {"valuation_rate": 0}
 
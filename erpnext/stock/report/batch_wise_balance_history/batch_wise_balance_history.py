@@ -4,7 +4,9 @@
 
 import frappe
 from frappe import _
-from frappe.utils import cint, flt, getdate
+from frappe.utils import cint, flt
+
+from erpnext.stock.stock_ledger_replay import BatchBalanceAggregator, StockLedgerReader, replay
 
 
 def execute(filters=None):
@@ -65,42 +67,16 @@ def get_conditions(filters):
 
 # get all details
 def get_stock_ledger_entries(filters):
-	conditions = get_conditions(filters)
-	return frappe.db.sql("""
-		select item_code, batch_no, warehouse, posting_date, sum(actual_qty) as actual_qty
-		from `tabStock Ledger Entry`
-		where is_cancelled = 0 and docstatus < 2 and ifnull(batch_no, '') != '' %s
-		group by voucher_no, batch_no, item_code, warehouse
-		order by item_code, warehouse""" %
-		conditions, as_dict=1)
+	return StockLedgerReader(
+		["item_code", "batch_no", "warehouse", "posting_date", "sum(actual_qty) as actual_qty"],
+		conditions="and is_cancelled = 0 and ifnull(batch_no, '') != '' %s" % get_conditions(filters),
+		group_by="voucher_no, batch_no, item_code, warehouse",
+		order_by="item_code, warehouse")
 
 
 def get_item_warehouse_batch_map(filters, float_precision):
 	sle = get_stock_ledger_entries(filters)
-	iwb_map = {}
-
-	from_date = getdate(filters["from_date"])
-	to_date = getdate(filters["to_date"])
-
-	for d in sle:
-		iwb_map.setdefault(d.item_code, {}).setdefault(d.warehouse, {})\
-			.setdefault(d.batch_no, frappe._dict({
-				"opening_qty": 0.0, "in_qty": 0.0, "out_qty": 0.0, "bal_qty": 0.0
-			}))
-		qty_dict = iwb_map[d.item_code][d.warehouse][d.batch_no]
-		if d.posting_date < from_date:
-			qty_dict.opening_qty = flt(qty_dict.opening_qty, float_precision) \
-				+ flt(d.actual_qty, float_precision)
-		elif d.posting_date >= from_date and d.posting_date <= to_date:
-			if flt(d.actual_qty) > 0:
-				qty_dict.in_qty = flt(qty_dict.in_qty, float_precision) + flt(d.actual_qty, float_precision)
-			else:
-				qty_dict.out_qty = flt(qty_dict.out_qty, float_precision) \
-					+ abs(flt(d.actual_qty, float_precision))
-
-		qty_dict.bal_qty = flt(qty_dict.bal_qty, float_precision) + flt(d.actual_qty, float_precision)
-
-	return iwb_map
+	return replay(sle, BatchBalanceAggregator(filters["from_date"], filters["to_date"], float_precision))
 
 
 def get_item_details(filters):
@@ -1,10 +1,11 @@
 # Copyright (c) 2013, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-import frappe
 from frappe import _
 from frappe.utils import flt
 
+from erpnext.stock.stock_ledger_replay import SLEAggregator, StockLedgerReader, replay
+
 
 def execute(filters=None):
 	columns, data = [], []
@@ -13,49 +14,49 @@ def execute(filters=None):
 	return columns, data
 
 def get_data(filters):
-	data = get_stock_ledger_entries(filters)
-	itewise_balance_qty = {}
-
-	for row in data:
-		key = (row.item_code, row.warehouse)
-		itewise_balance_qty.setdefault(key, []).append(row)
+	return replay(get_stock_ledger_entries(filters), IncorrectBalanceAggregator())
 
-	res = validate_data(itewise_balance_qty)
-	return res
+class IncorrectBalanceAggregator(SLEAggregator):
+	"""First entry per item and warehouse whose qty after transaction is off from the replayed balance"""
+	def __init__(self):
+		self.balance_qty = {}
+		self.incorrect_rows = {}
 
-def validate_data(itewise_balance_qty):
-	res = []
-	for key, data in itewise_balance_qty.items():
-		row = get_incorrect_data(data)
-		if row:
-			res.append(row)
-			res.append({})
-
-	return res
+	def update(self, row):
+		key = (row.item_code, row.warehouse)
+		if key in self.incorrect_rows:
+			return
 
-def get_incorrect_data(data):
-	balance_qty = 0.0
-	for row in data:
-		balance_qty += row.actual_qty
+		balance_qty = self.balance_qty.get(key, 0.0) + row.actual_qty
 		if row.voucher_type == "Stock Reconciliation" and not row.batch_no:
 			balance_qty = flt(row.qty_after_transaction)
 
+		self.balance_qty[key] = balance_qty
+
 		row.expected_balance_qty = balance_qty
 		if abs(flt(row.expected_balance_qty) - flt(row.qty_after_transaction)) > 0.5:
 			row.differnce = abs(flt(row.expected_balance_qty) - flt(row.qty_after_transaction))
-			return row
+			self.incorrect_rows[key] = row
 
-def get_stock_ledger_entries(report_filters):
-	filters = {}
-	fields = ['name', 'voucher_type', 'voucher_no', 'item_code', 'actual_qty',
-		'posting_date', 'posting_time', 'company', 'warehouse', 'qty_after_transaction', 'batch_no']
+	def get_result(self):
+		res = []
+		for key in self.balance_qty:
+			if key in self.incorrect_rows:
+				res.append(self.incorrect_rows[key])
+				res.append({})
 
+		return res
+
+def get_stock_ledger_entries(report_filters):
+	conditions, values = "", {}
 	for field in ['warehouse', 'item_code', 'company']:
 		if report_filters.get(field):
-			filters[field] = report_filters.get(field)
+			conditions += " and sle.{0} = %({0})s".format(field)
+			values[field] = report_filters.get(field)
 
-	return frappe.get_all('Stock Ledger Entry', fields = fields, filters = filters,
-		order_by = 'timestamp(posting_date, posting_time) asc, creation asc')
+	return StockLedgerReader(["sle.name", "sle.voucher_type", "sle.voucher_no", "sle.item_code",
+		"sle.actual_qty", "sle.posting_date", "sle.posting_time", "sle.company", "sle.warehouse",
+		"sle.qty_after_transaction", "sle.batch_no"], conditions=conditions, values=values)
 
 def get_columns():
 	return [{
@@ -2,6 +2,7 @@
 # License: GNU General Public License v3. See license.txt
 
 
+from collections import deque
 from operator import itemgetter
 
 import frappe
@@ -9,6 +10,7 @@ from frappe import _
 from frappe.utils import cint, date_diff, flt
 
 from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
+from erpnext.stock.stock_ledger_replay import SLEAggregator, StockLedgerReader, replay
 
 
 def execute(filters=None):
@@ -165,85 +167,121 @@ def get_columns(filters):
 	return columns
 
 def get_fifo_queue(filters, sle=None):
-	item_details = {}
-	transferred_item_details = {}
-	serial_no_batch_purchase_details = {}
+	return FIFOSlots(filters, sle).generate()
 
-	if sle == None:
-		sle = get_stock_ledger_entries(filters)
+class FIFOSlots(SLEAggregator):
+	"""
+		FIFO slots (qty or serial no, posting date) of the stock in hand, built from the stock
+		ledger entries in posting order. Entries are streamed from the database unless given.
 
-	for d in sle:
-		key = (d.name, d.warehouse) if filters.get('show_warehouse_wise_stock') else d.name
-		item_details.setdefault(key, {"details": d, "fifo_queue": []})
-		fifo_queue = item_details[key]["fifo_queue"]
+		Qty slots are kept in a deque and serial nos in an insertion ordered dict,
+		so consuming either is O(1) per slot.
+	"""
+	def __init__(self, filters=None, sle=None):
+		self.filters = filters or frappe._dict()
+		self.sle = sle
 
-		transferred_item_key = (d.voucher_no, d.name, d.warehouse)
-		transferred_item_details.setdefault(transferred_item_key, [])
+		self.item_details = {}
+		self.serial_no_batch_purchase_details = {}
+
+		# slots transferred out by the voucher being processed, to be transferred in with their age
+		self.transferred_item_details = {}
+		self.current_voucher = None
+
+	def generate(self):
+		if self.sle is None:
+			self.sle = get_stock_ledger_entries_reader(self.filters)
+
+		return replay(self.sle, self)
+
+	def update(self, d):
+		key, item = self.init_item_details(d)
+
+		if d.voucher_no != self.current_voucher:
+			self.transferred_item_details = {}
+			self.current_voucher = d.voucher_no
 
 		if d.voucher_type == "Stock Reconciliation":
-			d.actual_qty = flt(d.qty_after_transaction) - flt(item_details[key].get("qty_after_transaction", 0))
+			d.actual_qty = flt(d.qty_after_transaction) - flt(item.get("qty_after_transaction", 0))
 
 		serial_no_list = get_serial_nos(d.serial_no) if d.serial_no else []
+		transferred_item_key = (d.voucher_no, d.name, d.warehouse)
 
 		if d.actual_qty > 0:
-			if transferred_item_details.get(transferred_item_key):
-				batch = transferred_item_details[transferred_item_key][0]
-				fifo_queue.append(batch)
-				transferred_item_details[transferred_item_key].pop(0)
-			else:
-				if serial_no_list:
-					for serial_no in serial_no_list:
-						if serial_no_batch_purchase_details.get(serial_no):
-							fifo_queue.append([serial_no, serial_no_batch_purchase_details.get(serial_no)])
-						else:
-							serial_no_batch_purchase_details.setdefault(serial_no, d.posting_date)
-							fifo_queue.append([serial_no, d.posting_date])
-				else:
-					fifo_queue.append([d.actual_qty, d.posting_date])
+			self.compute_incoming_stock(d, item, serial_no_list, transferred_item_key)
 		else:
-			if serial_no_list:
-				fifo_queue[:] = [serial_no for serial_no in fifo_queue if serial_no[0] not in serial_no_list]
-			else:
-				qty_to_pop = abs(d.actual_qty)
-				while qty_to_pop:
-					batch = fifo_queue[0] if fifo_queue else [0, None]
-					if 0 < flt(batch[0]) <= qty_to_pop:
-						# if batch qty > 0
-						# not enough or exactly same qty in current batch, clear batch
-						qty_to_pop -= flt(batch[0])
-						transferred_item_details[transferred_item_key].append(fifo_queue.pop(0))
-					else:
-						# all from current batch
-						batch[0] = flt(batch[0]) - qty_to_pop
-						transferred_item_details[transferred_item_key].append([qty_to_pop, batch[1]])
-						qty_to_pop = 0
-
-		item_details[key]["qty_after_transaction"] = d.qty_after_transaction
-
-		if "total_qty" not in item_details[key]:
-			item_details[key]["total_qty"] = d.actual_qty
+			self.compute_outgoing_stock(d, item, serial_no_list, transferred_item_key)
+
+		item["qty_after_transaction"] = d.qty_after_transaction
+		item["total_qty"] = item.get("total_qty", 0) + d.actual_qty
+		item["has_serial_no"] = d.has_serial_no
+
+	def get_result(self):
+		for item in self.item_details.values():
+			item["fifo_queue"] = list(item.pop("qty_slots")) + \
+				[[serial_no, posting_date] for serial_no, posting_date in item.pop("serial_nos").items()]
+
+		return self.item_details
+
+	def init_item_details(self, d):
+		key = (d.name, d.warehouse) if self.filters.get('show_warehouse_wise_stock') else d.name
+		if key not in self.item_details:
+			self.item_details[key] = {"details": d, "qty_slots": deque(), "serial_nos": {}}
+
+		return key, self.item_details[key]
+
+	def compute_incoming_stock(self, d, item, serial_no_list, transferred_item_key):
+		transferred_slots = self.transferred_item_details.get(transferred_item_key)
+		if transferred_slots:
+			item["qty_slots"].append(transferred_slots.popleft())
+		elif serial_no_list:
+			for serial_no in serial_no_list:
+				posting_date = self.serial_no_batch_purchase_details.setdefault(serial_no, d.posting_date)
+				item["serial_nos"][serial_no] = posting_date
 		else:
-			item_details[key]["total_qty"] += d.actual_qty
-
-		item_details[key]["has_serial_no"] = d.has_serial_no
-
-	return item_details
+			item["qty_slots"].append([d.actual_qty, d.posting_date])
+
+	def compute_outgoing_stock(self, d, item, serial_no_list, transferred_item_key):
+		if serial_no_list:
+			for serial_no in serial_no_list:
+				item["serial_nos"].pop(serial_no, None)
+			return
+
+		fifo_queue = item["qty_slots"]
+		transferred_slots = self.transferred_item_details.setdefault(transferred_item_key, deque())
+
+		qty_to_pop = abs(d.actual_qty)
+		while qty_to_pop:
+			slot = fifo_queue[0] if fifo_queue else [0, None]
+			if 0 < flt(slot[0]) <= qty_to_pop:
+				# if slot qty > 0
+				# not enough or exactly same qty in current slot, clear slot
+				qty_to_pop -= flt(slot[0])
+				transferred_slots.append(fifo_queue.popleft())
+			else:
+				# all from current slot
+				slot[0] = flt(slot[0]) - qty_to_pop
+				transferred_slots.append([qty_to_pop, slot[1]])
+				qty_to_pop = 0
 
 def get_stock_ledger_entries(filters):
-	return frappe.db.sql("""select
-			item.name, item.item_name, item_group, brand, description, item.stock_uom, item.has_serial_no,
-			actual_qty, posting_date, voucher_type, voucher_no, serial_no, batch_no, qty_after_transaction, warehouse
-		from `tabStock Ledger Entry` sle,
-			(select name, item_name, description, stock_uom, brand, item_group, has_serial_no
-				from `tabItem` {item_conditions}) item
-		where item_code = item.name and
+	return list(get_stock_ledger_entries_reader(filters))
+
+def get_stock_ledger_entries_reader(filters):
+	return StockLedgerReader([
+			"item.name", "item.item_name", "item_group", "brand", "description", "item.stock_uom",
+			"item.has_serial_no", "actual_qty", "posting_date", "voucher_type", "voucher_no", "serial_no",
+			"batch_no", "qty_after_transaction", "warehouse"
+		],
+		joins=""", (select name, item_name, description, stock_uom, brand, item_group, has_serial_no
+			from `tabItem` {item_conditions}) item""".format(item_conditions=get_item_conditions(filters)),
+		conditions="""and item_code = item.name and
 			company = %(company)s and
 			posting_date <= %(to_date)s and
 			is_cancelled != 1
-			{sle_conditions}
-			order by posting_date, posting_time, sle.creation, actual_qty""" #nosec
-		.format(item_conditions=get_item_conditions(filters),
-			sle_conditions=get_sle_conditions(filters)), filters, as_dict=True)
+			{sle_conditions}""".format(sle_conditions=get_sle_conditions(filters)),
+		values=filters,
+		order_by="posting_date, posting_time, sle.creation, actual_qty")
 
 def get_item_conditions(filters):
 	conditions = []
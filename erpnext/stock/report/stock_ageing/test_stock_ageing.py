@@ -0,0 +1,59 @@
+import frappe
+
+from erpnext.stock.report.stock_ageing.stock_ageing import FIFOSlots
+from erpnext.tests.utils import ERPNextTestCase
+
+
+class TestStockAgeing(ERPNextTestCase):
+	def setUp(self):
+		self.filters = frappe._dict(company="_Test Company", to_date="2021-12-10")
+
+	def test_normal_inward_outward_queue(self):
+		sle = [
+			make_sle(actual_qty=30, qty_after_transaction=30, posting_date="2021-12-01", voucher_no="001"),
+			make_sle(actual_qty=20, qty_after_transaction=50, posting_date="2021-12-02", voucher_no="002"),
+			make_sle(actual_qty=-40, qty_after_transaction=10, posting_date="2021-12-03", voucher_no="003"),
+		]
+
+		item = FIFOSlots(self.filters, sle).generate()["Flask Item"]
+
+		self.assertEqual(item["total_qty"], 10)
+		self.assertEqual(item["fifo_queue"], [[10.0, "2021-12-02"]])
+
+	def test_inward_in_same_voucher_keeps_age(self):
+		sle = [
+			make_sle(actual_qty=30, qty_after_transaction=30, posting_date="2021-12-01", voucher_no="001"),
+			make_sle(actual_qty=-20, qty_after_transaction=10, posting_date="2021-12-05", voucher_no="002"),
+			make_sle(actual_qty=20, qty_after_transaction=30, posting_date="2021-12-05", voucher_no="002"),
+			make_sle(actual_qty=5, qty_after_transaction=35, posting_date="2021-12-06", voucher_no="003"),
+		]
+
+		item = FIFOSlots(self.filters, sle).generate()["Flask Item"]
+
+		self.assertEqual(item["fifo_queue"], [[10.0, "2021-12-01"], [20, "2021-12-01"], [5, "2021-12-06"]])
+
+	def test_serialized_item(self):
+		serial_nos = ["SN{0:05d}".format(i) for i in range(1000)]
+		sle = [
+			make_sle(actual_qty=1000, qty_after_transaction=1000, posting_date="2021-12-01", voucher_no="001",
+				serial_no="\n".join(serial_nos), has_serial_no=1),
+		]
+		for i, serial_no in enumerate(serial_nos[:990]):
+			sle.append(make_sle(actual_qty=-1, qty_after_transaction=999 - i, posting_date="2021-12-02",
+				voucher_no="OUT{0}".format(i), serial_no=serial_no, has_serial_no=1))
+
+		item = FIFOSlots(self.filters, sle).generate()["Flask Item"]
+
+		self.assertEqual(item["total_qty"], 10)
+		self.assertEqual(item["fifo_queue"], [[serial_no, "2021-12-01"] for serial_no in serial_nos[990:]])
+
+def make_sle(**args):
+	sle = frappe._dict({
+		"name": "Flask Item",
+		"warehouse": "WH 1",
+		"voucher_type": "Stock Entry",
+		"serial_no": None,
+		"has_serial_no": 0
+	})
+	sle.update(args)
+	return sle
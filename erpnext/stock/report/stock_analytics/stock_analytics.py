@@ -13,6 +13,7 @@ from erpnext.stock.report.stock_balance.stock_balance import (
 	get_items,
 	get_stock_ledger_entries,
 )
+from erpnext.stock.stock_ledger_replay import PeriodBalanceAggregator, replay
 from erpnext.stock.utils import is_reposting_item_valuation_in_progress
 
 
@@ -168,47 +169,21 @@ def get_periodic_data(entry, filters):
 					- Warehouse A : bal_qty/value
 					- Warehouse B : bal_qty/value
 	"""
-	periodic_data = {}
-	for d in entry:
-		period = get_period(d.posting_date, filters)
-		bal_qty = 0
-
-		# if period against item does not exist yet, instantiate it
-		# insert existing balance dict against period, and add/subtract to it
-		if periodic_data.get(d.item_code) and not periodic_data.get(d.item_code).get(period):
-			previous_balance = periodic_data[d.item_code]['balance'].copy()
-			periodic_data[d.item_code][period] = previous_balance
-
-		if d.voucher_type == "Stock Reconciliation":
-			if periodic_data.get(d.item_code) and periodic_data.get(d.item_code).get('balance').get(d.warehouse):
-				bal_qty = periodic_data[d.item_code]['balance'][d.warehouse]
-
-			qty_diff = d.qty_after_transaction - bal_qty
-		else:
-			qty_diff = d.actual_qty
-
-		if filters["value_quantity"] == 'Quantity':
-			value = qty_diff
-		else:
-			value = d.stock_value_difference
-
-		# period-warehouse wise balance
-		periodic_data.setdefault(d.item_code, {}).setdefault('balance', {}).setdefault(d.warehouse, 0.0)
-		periodic_data.setdefault(d.item_code, {}).setdefault(period, {}).setdefault(d.warehouse, 0.0)
-
-		periodic_data[d.item_code]['balance'][d.warehouse] += value
-		periodic_data[d.item_code][period][d.warehouse] = periodic_data[d.item_code]['balance'][d.warehouse]
-
-	return periodic_data
+	return replay(entry, PeriodBalanceAggregator(lambda posting_date: get_period(posting_date, filters),
+		"qty" if filters["value_quantity"] == 'Quantity' else "value"))
 
 def get_data(filters):
 	data = []
 	items = get_items(filters)
-	sle = get_stock_ledger_entries(filters, items)
-	item_details = get_item_details(items, sle, filters)
-	periodic_data = get_periodic_data(sle, filters)
 	ranges = get_period_date_ranges(filters)
 
+	# also caches the fiscal years of yearly periods, no query can be run while the entries are streamed
+	periods = [get_period(end_date, filters) for dummy, end_date in ranges]
+
+	sle = get_stock_ledger_entries(filters, items, as_iterator=True)
+	periodic_data = get_periodic_data(sle, filters)
+	item_details = get_item_details(items or list(periodic_data), [], filters)
+
 	for dummy, item_data in item_details.items():
 		row = {
 			"name": item_data.name,
@@ -218,8 +193,7 @@ def get_data(filters):
 			"brand": item_data.brand,
 		}
 		total = 0
-		for dummy, end_date in ranges:
-			period = get_period(end_date, filters)
+		for period in periods:
 			period_data = periodic_data.get(item_data.name, {}).get(period)
 			amount = sum(period_data.values()) if period_data else 0
 			row[scrub(period)] = amount
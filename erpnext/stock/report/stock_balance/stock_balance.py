@@ -2,15 +2,18 @@
 # License: GNU General Public License v3. See license.txt
 
 
+from itertools import chain
 from operator import itemgetter
 
 import frappe
 from frappe import _
-from frappe.utils import cint, date_diff, flt, getdate
+from frappe.utils import date_diff, getdate
 
 import erpnext
-from erpnext.stock.report.stock_ageing.stock_ageing import get_average_age, get_fifo_queue
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import get_closing_date
+from erpnext.stock.report.stock_ageing.stock_ageing import FIFOSlots, get_average_age
 from erpnext.stock.report.stock_ledger.stock_ledger import get_item_group_condition
+from erpnext.stock.stock_ledger_replay import BalanceAggregator, StockLedgerReader, replay
 from erpnext.stock.utils import add_additional_uom_columns, is_reposting_item_valuation_in_progress
 
 
@@ -29,18 +32,21 @@ def execute(filters=None):
 	include_uom = filters.get("include_uom")
 	columns = get_columns(filters)
 	items = get_items(filters)
-	sle = get_stock_ledger_entries(filters, items)
 
 	if filters.get('show_stock_ageing_data'):
+		# balances and ageing slots from a single pass over the whole ledger
 		filters['show_warehouse_wise_stock'] = True
-		item_wise_fifo_queue = get_fifo_queue(filters, sle)
+		sle = get_stock_ledger_entries(filters, items, as_iterator=True)
+		iwb_map, item_wise_fifo_queue = replay(sle, get_balance_aggregator(filters), FIFOSlots(filters))
+	else:
+		sle = get_stock_ledger_entries(filters, items, use_closing_balance=True, as_iterator=True)
+		iwb_map = get_item_warehouse_map(filters, sle)
 
 	# if no stock ledger entry found return
-	if not sle:
+	if not iwb_map:
 		return columns, []
 
-	iwb_map = get_item_warehouse_map(filters, sle)
-	item_map = get_item_details(items, sle, filters)
+	item_map = get_item_details(items or list({key[1] for key in iwb_map}), [], filters)
 	item_reorder_detail_map = get_item_reorder_details(item_map.keys())
 
 	data = []
@@ -153,7 +159,7 @@ def get_conditions(filters):
 
 	return conditions
 
-def get_stock_ledger_entries(filters, items):
+def get_stock_ledger_entries(filters, items, use_closing_balance=False, as_iterator=False):
 	item_conditions_sql = ''
 	if items:
 		item_conditions_sql = ' and sle.item_code in ({})'\
@@ -161,82 +167,54 @@ def get_stock_ledger_entries(filters, items):
 
 	conditions = get_conditions(filters)
 
+	closing_balance = []
+	if use_closing_balance:
+		# start from the nearest snapshot before the from date and only scan the entries after it
+		closing_date = get_closing_date(before=filters.get("from_date"))
+		if closing_date:
+			closing_balance = get_closing_balance_entries(closing_date, item_conditions_sql, conditions)
+			conditions += " and sle.posting_date > %s" % frappe.db.escape(str(closing_date))
+
+	reader = StockLedgerReader([
+			"sle.item_code", "warehouse", "sle.posting_date", "sle.actual_qty", "sle.valuation_rate",
+			"sle.company", "sle.voucher_type", "sle.qty_after_transaction", "sle.stock_value_difference",
+			"sle.item_code as name", "sle.voucher_no", "sle.stock_value", "sle.batch_no"
+		],
+		conditions="{0} {1} and is_cancelled = 0".format(item_conditions_sql, conditions),
+		order_by="sle.posting_date, sle.posting_time, sle.creation, sle.actual_qty",
+		force_index="posting_sort_index")
+
+	if as_iterator:
+		return chain(closing_balance, reader)
+
+	return closing_balance + frappe.db.sql(reader.get_query(), as_dict=1)
+
+def get_closing_balance_entries(closing_date, item_conditions_sql, conditions):
+	"""Snapshot rows shaped like stock ledger entries carrying the whole balance as on the closing date"""
 	return frappe.db.sql("""
 		select
-			sle.item_code, warehouse, sle.posting_date, sle.actual_qty, sle.valuation_rate,
-			sle.company, sle.voucher_type, sle.qty_after_transaction, sle.stock_value_difference,
-			sle.item_code as name, sle.voucher_no, sle.stock_value, sle.batch_no
+			sle.item_code, sle.warehouse, sle.posting_date, sle.qty_after_transaction as actual_qty,
+			sle.valuation_rate, sle.company, 'Stock Closing Balance' as voucher_type,
+			sle.qty_after_transaction, sle.stock_value as stock_value_difference,
+			sle.item_code as name, sle.name as voucher_no, sle.stock_value, sle.batch_no
 		from
-			`tabStock Ledger Entry` sle force index (posting_sort_index)
-		where sle.docstatus < 2 %s %s
-		and is_cancelled = 0
-		order by sle.posting_date, sle.posting_time, sle.creation, sle.actual_qty""" % #nosec
-		(item_conditions_sql, conditions), as_dict=1)
+			`tabStock Closing Balance` sle
+		where sle.posting_date = %s %s %s
+		order by sle.item_code, sle.warehouse, sle.batch_no""" % #nosec
+		(frappe.db.escape(str(closing_date)), item_conditions_sql, conditions), as_dict=1)
 
 def get_item_warehouse_map(filters, sle):
-	iwb_map = {}
-	from_date = getdate(filters.get("from_date"))
-	to_date = getdate(filters.get("to_date"))
-
-	float_precision = cint(frappe.db.get_default("float_precision")) or 3
-
-	for d in sle:
-		key = (d.company, d.item_code, d.warehouse)
-		if key not in iwb_map:
-			iwb_map[key] = frappe._dict({
-				"opening_qty": 0.0, "opening_val": 0.0,
-				"in_qty": 0.0, "in_val": 0.0,
-				"out_qty": 0.0, "out_val": 0.0,
-				"bal_qty": 0.0, "bal_val": 0.0,
-				"val_rate": 0.0
-			})
-
-		qty_dict = iwb_map[(d.company, d.item_code, d.warehouse)]
-
-		if d.voucher_type == "Stock Reconciliation" and not d.batch_no:
-			qty_diff = flt(d.qty_after_transaction) - flt(qty_dict.bal_qty)
-		else:
-			qty_diff = flt(d.actual_qty)
-
-		value_diff = flt(d.stock_value_difference)
-
-		if d.posting_date < from_date or (d.posting_date == from_date
-			and d.voucher_type == "Stock Reconciliation" and
-			frappe.db.get_value("Stock Reconciliation", d.voucher_no, "purpose") == "Opening Stock"):
-			qty_dict.opening_qty += qty_diff
-			qty_dict.opening_val += value_diff
-
-		elif d.posting_date >= from_date and d.posting_date <= to_date:
-			if flt(qty_diff, float_precision) >= 0:
-				qty_dict.in_qty += qty_diff
-				qty_dict.in_val += value_diff
-			else:
-				qty_dict.out_qty += abs(qty_diff)
-				qty_dict.out_val += abs(value_diff)
-
-		qty_dict.val_rate = d.valuation_rate
-		qty_dict.bal_qty += qty_diff
-		qty_dict.bal_val += value_diff
-
-	iwb_map = filter_items_with_no_transactions(iwb_map, float_precision)
-
-	return iwb_map
-
-def filter_items_with_no_transactions(iwb_map, float_precision):
-	for (company, item, warehouse) in sorted(iwb_map):
-		qty_dict = iwb_map[(company, item, warehouse)]
-
-		no_transactions = True
-		for key, val in qty_dict.items():
-			val = flt(val, float_precision)
-			qty_dict[key] = val
-			if key != "val_rate" and val:
-				no_transactions = False
+	return replay(sle, get_balance_aggregator(filters))
 
-		if no_transactions:
-			iwb_map.pop((company, item, warehouse))
+def get_balance_aggregator(filters):
+	# fetched before the entries as no query can be run while they are streamed
+	opening_stock_vouchers = get_opening_stock_reconciliations(getdate(filters.get("from_date")))
+	return BalanceAggregator(filters.get("from_date"), filters.get("to_date"), opening_stock_vouchers)
 
-	return iwb_map
+def get_opening_stock_reconciliations(posting_date):
+	return set(frappe.get_all("Stock Reconciliation",
+		filters={"posting_date": posting_date, "purpose": "Opening Stock", "docstatus": 1},
+		pluck="name"))
 
 def get_items(filters):
 	"Get items based on item code, item group or brand."
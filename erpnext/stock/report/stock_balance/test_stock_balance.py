@@ -0,0 +1,59 @@
+import frappe
+
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import (
+	create_stock_reconciliation,
+)
+from erpnext.stock.report.stock_balance.stock_balance import (
+	execute,
+	get_item_warehouse_map,
+	get_stock_ledger_entries,
+)
+from erpnext.tests.utils import ERPNextTestCase
+
+
+class TestStockBalance(ERPNextTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+
+		cls.item_code = make_item("_Test Item For Stock Balance", {"is_stock_item": 1}).name
+		cls.filters = frappe._dict({
+			"company": "_Test Company",
+			"item_code": cls.item_code,
+			"from_date": "2021-03-01",
+			"to_date": "2021-03-31"
+		})
+
+		create_stock_reconciliation(item_code=cls.item_code, qty=10, rate=100, purpose="Opening Stock",
+			expense_account="Temporary Opening - _TC", posting_date="2021-03-01")
+		make_stock_entry(item_code=cls.item_code, target="_Test Warehouse - _TC", qty=5, rate=100,
+			posting_date="2021-03-05")
+
+	def test_opening_stock_reconciliation(self):
+		_columns, data = execute(self.filters)
+
+		self.assertEqual(len(data), 1)
+		self.assertEqual(data[0]["opening_qty"], 10)
+		self.assertEqual(data[0]["in_qty"], 5)
+		self.assertEqual(data[0]["bal_qty"], 15)
+
+	def test_streamed_stock_ledger_entries(self):
+		items = [self.item_code]
+
+		iwb_map = get_item_warehouse_map(self.filters, get_stock_ledger_entries(self.filters, items))
+		streamed_iwb_map = get_item_warehouse_map(self.filters,
+			get_stock_ledger_entries(self.filters, items, as_iterator=True))
+
+		self.assertTrue(iwb_map)
+		self.assertEqual(streamed_iwb_map, iwb_map)
+
+	def test_stock_ageing_data(self):
+		# balances and ageing are built from the same pass over the ledger
+		_columns, data = execute(frappe._dict(self.filters, show_stock_ageing_data=1))
+
+		self.assertEqual(len(data), 1)
+		self.assertEqual(data[0]["bal_qty"], 15)
+		self.assertEqual(data[0]["earliest_age"], 30)
+		self.assertEqual(data[0]["latest_age"], 26)
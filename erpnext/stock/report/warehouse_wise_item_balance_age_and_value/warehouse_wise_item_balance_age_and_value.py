@@ -28,10 +28,10 @@ def execute(filters=None):
 	columns = get_columns(filters)
 
 	items = get_items(filters)
-	sle = get_stock_ledger_entries(filters, items)
+	sle = get_stock_ledger_entries(filters, items, use_closing_balance=True, as_iterator=True)
 
-	item_map = get_item_details(items, sle, filters)
 	iwb_map = get_item_warehouse_map(filters, sle)
+	item_map = get_item_details(items or list({key[1] for key in iwb_map}), [], filters)
 	warehouse_list = get_warehouse_list(filters)
 	item_ageing = get_fifo_queue(filters)
 	data = []
@@ -2,19 +2,30 @@
 # License: GNU General Public License v3. See license.txt
 
 import copy
+import datetime
 import json
 
 import frappe
 from frappe import _
 from frappe.model.meta import get_field_precision
-from frappe.utils import cint, cstr, flt, get_link_to_form, getdate, now
+from frappe.utils import cint, cstr, flt, get_link_to_form, getdate, now, now_datetime
 
 import erpnext
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import (
+	update_closing_balance_for_entries,
+)
+from erpnext.stock.stock_queue import (
+	decode_stock_queue,
+	encode_stock_queue,
+	get_stock_queue_format,
+)
 from erpnext.stock.utils import (
+	get_combine_datetime,
 	get_incoming_outgoing_rate_for_cancel,
 	get_or_make_bin,
 	get_valuation_method,
 )
+from erpnext.utilities.bulk_validation import has_doc_event_hooks, validate_mandatory_and_links
 
 
 # future reposting
@@ -25,11 +36,38 @@ class SerialNoExistsInFutureTransaction(frappe.ValidationError):
 _exceptions = frappe.local('stockledger_exceptions')
 # _exceptions = []
 
+class PreviousSLECache(dict):
+	"""
+		Previous entries found by `get_previous_sle` in the current request, by
+		(item_code, warehouse, posting datetime to the second, excluded entry), so that
+		lookups at `nowtime()` in the same second share an entry. Cleared whenever
+		the stock ledger is written to and when the transaction is rolled back.
+	"""
+	def on_rollback(self):
+		self.clear()
+
+def get_previous_sle_cache():
+	cache = getattr(frappe.local, "previous_sle_cache", None)
+	if cache is None:
+		cache = frappe.local.previous_sle_cache = PreviousSLECache()
+
+	# observers are dropped on every commit and rollback
+	if not any(observer is cache for observer in frappe.local.rollback_observers):
+		frappe.local.rollback_observers.append(cache)
+
+	return cache
+
+def clear_previous_sle_cache():
+	cache = getattr(frappe.local, "previous_sle_cache", None)
+	if cache:
+		cache.clear()
+
 def make_sl_entries(sl_entries, allow_negative_stock=False, via_landed_cost_voucher=False):
 	from erpnext.controllers.stock_controller import future_sle_exists
 	if sl_entries:
 		from erpnext.stock.utils import update_bin
 
+		clear_previous_sle_cache()
 		cancel = sl_entries[0].get("is_cancelled")
 		if cancel:
 			validate_cancellation(sl_entries)
@@ -65,6 +103,9 @@ def make_sl_entries(sl_entries, allow_negative_stock=False, via_landed_cost_vouc
 				args.previous_qty_after_transaction = sle.get("previous_qty_after_transaction")
 
 			update_bin(args, allow_negative_stock, via_landed_cost_voucher)
+			clear_previous_sle_cache()
+
+		update_closing_balance_for_entries(sl_entries)
 
 def get_args_for_future_sle(row):
 	return frappe._dict({
@@ -129,6 +170,215 @@ def make_entry(args, allow_negative_stock=False, via_landed_cost_voucher=False):
 	sle.submit()
 	return sle
 
+def make_sl_entries_in_bulk(sl_entries, allow_negative_stock=False, publish_progress=False):
+	"""
+		Make the entries of a voucher posted at one datetime, like a Stock Reconciliation with
+		many rows, in bulk.
+
+		The previous entries of all item-warehouses are fetched in one query, the new entries are
+		validated and valued in memory, and the entries and bins are written in chunks. Cancellations,
+		serialized entries, vouchers with later entries for any of their item-warehouses and entries
+		with document hooks go through `make_sl_entries`.
+	"""
+	from erpnext.controllers.stock_controller import future_sle_exists
+
+	if not sl_entries:
+		return
+
+	if (sl_entries[0].get("is_cancelled") or any(sle.get("serial_no") for sle in sl_entries)
+		or has_doc_event_hooks("Stock Ledger Entry")
+		or future_sle_exists(get_args_for_future_sle(sl_entries[0]), sl_entries)):
+		return make_sl_entries(sl_entries, allow_negative_stock)
+
+	allow_negative_stock = cint(allow_negative_stock) \
+		or cint(frappe.db.get_single_value("Stock Settings", "allow_negative_stock"))
+
+	sle_docs = validate_sl_entries_in_bulk(sl_entries, allow_negative_stock)
+
+	previous_sle = get_previous_sle_for_item_warehouses([(sle.item_code, sle.warehouse) for sle in sle_docs],
+		sl_entries[0].posting_date, sl_entries[0].posting_time)
+	data = value_sl_entries_in_bulk(sle_docs, previous_sle, allow_negative_stock)
+
+	clear_previous_sle_cache()
+	insert_sl_entries(sle_docs, publish_progress)
+	update_bins_in_bulk(data)
+	update_batch_qty_in_bulk(sle_docs, allow_negative_stock)
+	clear_previous_sle_cache()
+
+	update_closing_balance_for_entries(sl_entries)
+
+def validate_sl_entries_in_bulk(sl_entries, allow_negative_stock=False):
+	"""
+		Stock Ledger Entry documents of the entries, validated as on submit with the items,
+		batches, warehouses and last transaction times fetched once for all entries
+	"""
+	from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import (
+		get_back_dated_transaction_approvers,
+		get_last_transaction_times,
+	)
+	from erpnext.stock.utils import (
+		is_group_warehouse,
+		validate_disabled_warehouse,
+		validate_warehouse_company,
+	)
+
+	items = {d.name: d for d in frappe.get_all("Item",
+		filters={"name": ("in", list({sle.item_code for sle in sl_entries}))},
+		fields=["name", "item_name", "has_batch_no", "docstatus", "is_stock_item", "has_variants",
+			"stock_uom", "create_new_batch"])}
+
+	batch_details = {}
+	batches = list({sle.batch_no for sle in sl_entries if sle.get("batch_no")})
+	if batches:
+		batch_details = {d.name: d for d in frappe.get_all("Batch",
+			filters={"name": ("in", batches)}, fields=["name", "item", "expiry_date"])}
+
+	for warehouse, company in {(sle.warehouse, sle.company) for sle in sl_entries}:
+		validate_disabled_warehouse(warehouse)
+		validate_warehouse_company(warehouse, company)
+		is_group_warehouse(warehouse)
+
+	authorized_users = get_back_dated_transaction_approvers()
+	last_transaction_times = {}
+	if authorized_users:
+		last_transaction_times = get_last_transaction_times((sle.item_code, sle.warehouse) for sle in sl_entries)
+
+	sle_docs = []
+	for args in sl_entries:
+		sle = frappe.get_doc(dict(args, doctype="Stock Ledger Entry"))
+		sle.flags.ignore_permissions = 1
+		sle.allow_negative_stock = allow_negative_stock
+
+		sle.validate_mandatory()
+		sle.validate_item(items.get(sle.item_code), batch_details)
+		sle.validate_batch(batch_details)
+		sle.scrub_posting_time()
+		sle.posting_datetime = get_combine_datetime(sle.posting_date, sle.posting_time)
+		sle.validate_and_set_fiscal_year()
+		if authorized_users:
+			sle.validate_back_dated_transaction(last_transaction_times.get((sle.item_code, sle.warehouse)),
+				authorized_users)
+		sle.check_stock_frozen_date()
+
+		sle.name = frappe.generate_hash(txt="", length=10)
+		sle_docs.append(sle)
+
+	validate_mandatory_and_links(sle_docs)
+
+	return sle_docs
+
+def value_sl_entries_in_bulk(sle_docs, previous_sle, allow_negative_stock=False):
+	"""Value the entries in memory per item-warehouse, returns the balances by item-warehouse"""
+	item_codes = list({sle.item_code for sle in sle_docs})
+	valuation_methods = dict(frappe.get_all("Item", filters={"name": ("in", item_codes)},
+		fields=["name", "valuation_method"], as_list=1))
+	default_valuation_method = frappe.db.get_value("Stock Settings", None, "valuation_method") or "FIFO"
+	stock_queue_format = get_stock_queue_format()
+
+	company_currency = frappe.get_cached_value("Company", sle_docs[0].company, "default_currency")
+	precision = get_field_precision(frappe.get_meta("Stock Ledger Entry").get_field("stock_value"),
+		currency=company_currency)
+
+	valuations = {}
+	for sle in sle_docs:
+		key = (sle.item_code, sle.warehouse)
+		if key not in valuations:
+			valuations[key] = VoucherValuation(sle.item_code, sle.warehouse, previous_sle.get(key),
+				valuation_methods.get(sle.item_code) or default_valuation_method, precision,
+				stock_queue_format, allow_negative_stock)
+
+		entry = frappe._dict(sle.as_dict())
+		valuations[key].process_sle(entry)
+		sle.update({fieldname: entry.get(fieldname) for fieldname in ("qty_after_transaction",
+			"valuation_rate", "stock_value", "stock_queue", "stock_value_difference")})
+
+	data = {}
+	for key, valuation in valuations.items():
+		if valuation.exceptions:
+			valuation.raise_exceptions()
+
+		data[key] = valuation.data[key[1]]
+
+	return data
+
+def insert_sl_entries(sle_docs, publish_progress=False):
+	"""Insert submitted entries in chunks of 500 rows"""
+	fields = []
+	timestamp = now_datetime()
+	for i in range(0, len(sle_docs), 500):
+		values = []
+		for j, sle in enumerate(sle_docs[i:i + 500], i):
+			sle.docstatus = 1
+			sle.owner = sle.modified_by = frappe.session.user
+			# entries at the same posting datetime are ordered by creation, keep the order of insertion
+			sle.creation = sle.modified = (timestamp + datetime.timedelta(microseconds=j)).strftime(
+				"%Y-%m-%d %H:%M:%S.%f")
+
+			d = sle.get_valid_dict(convert_dates_to_str=True)
+			if not fields:
+				fields = list(d)
+
+			values.append([d.get(fieldname) for fieldname in fields])
+
+		frappe.db.bulk_insert("Stock Ledger Entry", fields=fields, values=values)
+
+		if publish_progress:
+			frappe.publish_progress(min(i + 500, len(sle_docs)) * 100 / len(sle_docs),
+				title=_("Making Stock Ledger Entries..."),
+				doctype=sle_docs[0].voucher_type, docname=sle_docs[0].voucher_no)
+
+def update_bins_in_bulk(data):
+	"""Set the balances of the item-warehouses on their bins, 500 bins per query"""
+	bins = {}
+	for item_code, warehouse in data:
+		bins[(item_code, warehouse)] = get_or_make_bin(item_code, warehouse)
+
+	timestamp = now()
+	keys = list(data)
+	for i in range(0, len(keys), 500):
+		chunk = keys[i:i + 500]
+		case = "case name {0} end".format(" ".join(["when %s then %s"] * len(chunk)))
+
+		values = []
+		for fieldname in ("qty_after_transaction", "valuation_rate", "stock_value", "qty_after_transaction"):
+			for key in chunk:
+				values.extend([bins[key], flt(data[key].get(fieldname))])
+
+		values.extend([timestamp, frappe.session.user])
+		values.extend(bins[key] for key in chunk)
+
+		frappe.db.sql("""
+			update `tabBin`
+			set actual_qty = {case}, valuation_rate = {case}, stock_value = {case},
+				projected_qty = {case} + ordered_qty + indented_qty + planned_qty - reserved_qty
+					- reserved_qty_for_production - reserved_qty_for_sub_contract,
+				modified = %s, modified_by = %s
+			where name in ({names})""".format(case=case, names=", ".join(["%s"] * len(chunk))), #nosec
+			tuple(values))
+
+def update_batch_qty_in_bulk(sle_docs, allow_negative_stock=False):
+	"""Validate and update the batch qty once per batch, as done on submit of every entry"""
+	batches = list({sle.batch_no for sle in sle_docs if sle.batch_no})
+	if not batches:
+		return
+
+	if not allow_negative_stock:
+		for batch_no, item_code, warehouse, qty in frappe.db.sql("""
+			select batch_no, item_code, warehouse, sum(actual_qty)
+			from `tabStock Ledger Entry`
+			where is_cancelled = 0 and batch_no in %(batches)s
+			group by batch_no, item_code, warehouse
+			having sum(actual_qty) < 0""", {"batches": batches}):
+			frappe.throw(_("Stock balance in Batch {0} will become negative {1} for Item {2} at Warehouse {3}")
+				.format(batch_no, qty, item_code, warehouse))
+
+	for i in range(0, len(batches), 500):
+		frappe.db.sql("""
+			update `tabBatch` batch
+			set batch_qty = ifnull((select sum(actual_qty) from `tabStock Ledger Entry` sle
+				where sle.docstatus = 1 and sle.is_cancelled = 0 and sle.batch_no = batch.name), 0)
+			where batch.name in %(batches)s""", {"batches": batches[i:i + 500]})
+
 def repost_future_sle(args=None, voucher_type=None, voucher_no=None, allow_negative_stock=None, via_landed_cost_voucher=False, doc=None):
 	if not args and voucher_type and voucher_no:
 		args = get_items_to_be_repost(voucher_type, voucher_no, doc)
@@ -136,6 +386,8 @@ def repost_future_sle(args=None, voucher_type=None, voucher_no=None, allow_negat
 	distinct_item_warehouses = get_distinct_item_warehouse(args, doc)
 
 	i = get_current_index(doc) or 0
+	prefetched_sle = get_sle_to_be_reposted(args[i:])
+	entries_reposted = 0
 	while i < len(args):
 		validate_item_warehouse(args[i])
 
@@ -145,8 +397,14 @@ def repost_future_sle(args=None, voucher_type=None, voucher_no=None, allow_negat
 			'posting_date': args[i].get('posting_date'),
 			'posting_time': args[i].get('posting_time'),
 			'creation': args[i].get('creation'),
-			'distinct_item_warehouses': distinct_item_warehouses
+			'distinct_item_warehouses': distinct_item_warehouses,
+			'prefetched_sle': prefetched_sle
 		}, allow_negative_stock=allow_negative_stock, via_landed_cost_voucher=via_landed_cost_voucher)
+		entries_reposted += obj.entries_processed
+
+		# entries of the reposted warehouses have changed, they have to be fetched again if required
+		for warehouse in obj.data:
+			prefetched_sle.pop((obj.item_code, warehouse), None)
 
 		distinct_item_warehouses[(args[i].get('item_code'), args[i].get('warehouse'))].reposting_status = True
 
@@ -157,6 +415,7 @@ def repost_future_sle(args=None, voucher_type=None, voucher_no=None, allow_negat
 					args.append(data.sle)
 				elif data.sle_changed and not data.reposting_status:
 					args[data.args_idx] = data.sle
+					prefetched_sle.pop(item_wh, None)
 
 				data.sle_changed = False
 		i += 1
@@ -167,6 +426,66 @@ def repost_future_sle(args=None, voucher_type=None, voucher_no=None, allow_negat
 	if doc and args:
 		update_args_in_repost_item_valuation(doc, i, args, distinct_item_warehouses)
 
+	return entries_reposted
+
+def get_sle_to_be_reposted(args):
+	"""
+		Fetch the previous entry and the future entries of every item-warehouse to be reposted
+		upfront, with a single query for all the future entries instead of one per item-warehouse.
+
+		Returns {(item_code, warehouse): {"previous_sle": {}, "future_sle": []}}
+	"""
+	prefetched_sle = {}
+	conditions = []
+	values = []
+
+	for d in args:
+		if not (d.get('item_code') and d.get('warehouse') and d.get('posting_date') and d.get('posting_time')):
+			continue
+
+		key = (d.get('item_code'), d.get('warehouse'))
+		if key in prefetched_sle:
+			continue
+
+		previous_sle = get_previous_sle_of_current_voucher(frappe._dict({
+			'item_code': d.get('item_code'),
+			'warehouse': d.get('warehouse'),
+			'posting_date': d.get('posting_date'),
+			'posting_time': d.get('posting_time')
+		}))
+
+		prefetched_sle[key] = frappe._dict({
+			'previous_sle': previous_sle,
+			'future_sle': []
+		})
+
+		# same conditions as get_stock_ledger_entries(previous_sle, ">", "asc")
+		condition = "(item_code = %s and warehouse = %s and posting_datetime > %s"
+		values.extend([d.get('item_code'), d.get('warehouse'), get_combine_datetime(
+			previous_sle.get('posting_date') or '1900-01-01', previous_sle.get('posting_time') or '00:00')])
+
+		if previous_sle.get('name'):
+			condition += " and name != %s"
+			values.append(previous_sle.name)
+
+		conditions.append(condition + ")")
+
+	if not conditions:
+		return prefetched_sle
+
+	future_sle = frappe.db.sql("""
+		select *, posting_datetime as "timestamp"
+		from `tabStock Ledger Entry`
+		where is_cancelled = 0
+		and ({0})
+		order by posting_datetime asc, creation asc
+		for update""".format(" or ".join(conditions)), tuple(values), as_dict=1)
+
+	for sle in future_sle:
+		prefetched_sle[(sle.item_code, sle.warehouse)].future_sle.append(sle)
+
+	return prefetched_sle
+
 def validate_item_warehouse(args):
 	for field in ['item_code', 'warehouse', 'posting_date', 'posting_time']:
 		if not args.get(field):
@@ -248,12 +567,18 @@ class update_entries_after(object):
 		self.company = frappe.get_cached_value("Warehouse", self.args.warehouse, "company")
 		self.get_precision()
 		self.valuation_method = get_valuation_method(self.item_code)
+		self.stock_queue_format = get_stock_queue_format()
 
 		self.new_items_found = False
 		self.distinct_item_warehouses = args.get("distinct_item_warehouses", frappe._dict())
 
+		# entries fetched in bulk for multiple item-warehouses by repost_future_sle
+		self.prefetched_sle = (args.get("prefetched_sle") or {}).pop((self.item_code, self.args.warehouse), None)
+		self.sle_to_update = {}
+		self.entries_processed = 0
+
 		self.data = frappe._dict()
-		self.initialize_previous_data(self.args)
+		self.initialize_previous_data(self.args, self.prefetched_sle)
 		self.build()
 
 	def get_precision(self):
@@ -261,7 +586,7 @@ class update_entries_after(object):
 		self.precision = get_field_precision(frappe.get_meta("Stock Ledger Entry").get_field("stock_value"),
 			currency=company_base_currency)
 
-	def initialize_previous_data(self, args):
+	def initialize_previous_data(self, args, prefetched_sle=None):
 		"""
 			Get previous sl entries for current item for each related warehouse
 			and assigns into self.data dict
@@ -283,7 +608,10 @@ class update_entries_after(object):
 		"""
 		self.data.setdefault(args.warehouse, frappe._dict())
 		warehouse_dict = self.data[args.warehouse]
-		previous_sle = get_previous_sle_of_current_voucher(args)
+		if prefetched_sle:
+			previous_sle = prefetched_sle.previous_sle
+		else:
+			previous_sle = get_previous_sle_of_current_voucher(args)
 		warehouse_dict.previous_sle = previous_sle
 
 		for key in ("qty_after_transaction", "valuation_rate", "stock_value"):
@@ -291,7 +619,7 @@ class update_entries_after(object):
 
 		warehouse_dict.update({
 			"prev_stock_value": previous_sle.stock_value or 0.0,
-			"stock_queue": json.loads(previous_sle.stock_queue or "[]"),
+			"stock_queue": decode_stock_queue(previous_sle.stock_queue),
 			"stock_value_difference": 0.0
 		})
 
@@ -300,6 +628,7 @@ class update_entries_after(object):
 
 		if self.args.get("sle_id"):
 			self.process_sle_against_current_timestamp()
+			self.update_sle_in_db()
 			if not future_sle_exists(self.args):
 				self.update_bin()
 		else:
@@ -315,6 +644,7 @@ class update_entries_after(object):
 				if sle.dependant_sle_voucher_detail_no:
 					entries_to_fix = self.get_dependent_entries_to_fix(entries_to_fix, sle)
 
+			self.update_sle_in_db()
 			self.update_bin()
 
 		if self.exceptions:
@@ -326,18 +656,22 @@ class update_entries_after(object):
 			self.process_sle(sle)
 
 	def get_sle_against_current_voucher(self):
-		self.args['time_format'] = '%H:%i:%s'
+		# entries posted within the same second
+		self.args['from_datetime'] = get_combine_datetime(self.args.posting_date,
+			self.args.posting_time).replace(microsecond=0)
+		self.args['to_datetime'] = self.args.from_datetime + datetime.timedelta(seconds=1)
 
 		return frappe.db.sql("""
 			select
-				*, timestamp(posting_date, posting_time) as "timestamp"
+				*, posting_datetime as "timestamp"
 			from
 				`tabStock Ledger Entry`
 			where
 				item_code = %(item_code)s
 				and warehouse = %(warehouse)s
 				and is_cancelled = 0
-				and timestamp(posting_date, time_format(posting_time, %(time_format)s)) = timestamp(%(posting_date)s, time_format(%(posting_time)s, %(time_format)s))
+				and posting_datetime >= %(from_datetime)s
+				and posting_datetime < %(to_datetime)s
 
 			order by
 				creation ASC
@@ -346,6 +680,9 @@ class update_entries_after(object):
 
 	def get_future_entries_to_fix(self):
 		# includes current entry!
+		if self.prefetched_sle:
+			return list(self.prefetched_sle.future_sle)
+
 		args = self.data[self.args.warehouse].previous_sle \
 			or frappe._dict({"item_code": self.item_code, "warehouse": self.args.warehouse})
 
@@ -440,14 +777,47 @@ class update_entries_after(object):
 		sle.qty_after_transaction = self.wh_data.qty_after_transaction
 		sle.valuation_rate = self.wh_data.valuation_rate
 		sle.stock_value = self.wh_data.stock_value
-		sle.stock_queue = json.dumps(self.wh_data.stock_queue)
+		sle.stock_queue = encode_stock_queue(self.wh_data.stock_queue, self.stock_queue_format)
 		sle.stock_value_difference = stock_value_difference
-		sle.doctype="Stock Ledger Entry"
-		frappe.get_doc(sle).db_update()
+		self.sle_to_update[sle.name] = sle
+		self.entries_processed += 1
 
 		if not self.args.get("sle_id"):
 			self.update_outgoing_rate_on_transaction(sle)
 
+	def update_sle_in_db(self):
+		"""Write back the processed entries in bulk, one query per chunk instead of one per entry"""
+		if not self.sle_to_update:
+			return
+
+		clear_previous_sle_cache()
+
+		fields = ("qty_after_transaction", "valuation_rate", "stock_value", "stock_value_difference",
+			"stock_queue", "incoming_rate", "outgoing_rate")
+
+		sl_entries = list(self.sle_to_update.values())
+		self.sle_to_update = {}
+
+		for i in range(0, len(sl_entries), 500):
+			chunk = sl_entries[i:i + 500]
+
+			values = []
+			set_clause = []
+			for field in fields:
+				set_clause.append("`{0}` = case name {1} end".format(field,
+					" ".join(["when %s then %s"] * len(chunk))))
+
+				for sle in chunk:
+					values.extend([sle.name, sle.get(field) if field == "stock_queue" else flt(sle.get(field))])
+
+			values.extend(sle.name for sle in chunk)
+
+			frappe.db.sql("""
+				update `tabStock Ledger Entry`
+				set {0}
+				where name in ({1})""".format(", ".join(set_clause), ", ".join(["%s"] * len(chunk))),
+				tuple(values))
+
 	def validate_negative_stock(self, sle):
 		"""
 			validate negative stock for entries current datetime onwards
@@ -466,6 +836,8 @@ class update_entries_after(object):
 	def get_dynamic_incoming_outgoing_rate(self, sle):
 		# Get updated incoming/outgoing rate from transaction
 		if sle.recalculate_rate:
+			# rate of returns and stock entries is derived from the ledger, write back pending entries first
+			self.update_sle_in_db()
 			rate = self.get_incoming_outgoing_rate_from_transaction(sle)
 
 			if flt(sle.actual_qty) >= 0:
@@ -533,6 +905,7 @@ class update_entries_after(object):
 			self.recalculate_amounts_in_stock_entry(sle.voucher_no)
 
 	def recalculate_amounts_in_stock_entry(self, voucher_no):
+		self.update_sle_in_db()
 		stock_entry = frappe.get_doc("Stock Entry", voucher_no, for_update=True)
 		stock_entry.calculate_rate_and_amount(reset_outgoing_rate=False, raise_error_if_no_rate=False)
 		stock_entry.db_update()
@@ -558,6 +931,7 @@ class update_entries_after(object):
 
 		# Recalculate subcontracted item's rate in case of subcontracted purchase receipt/invoice
 		if frappe.get_cached_value(sle.voucher_type, sle.voucher_no, "is_subcontracted") == 'Yes':
+			self.update_sle_in_db()
 			doc = frappe.get_doc(sle.voucher_type, sle.voucher_no)
 			doc.update_valuation_rate(reset_outgoing_rate=False)
 			for d in (doc.items + doc.supplied_items):
@@ -596,11 +970,11 @@ class update_entries_after(object):
 		if not self.wh_data.valuation_rate and sle.voucher_detail_no:
 			allow_zero_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 			if not allow_zero_rate:
-				self.wh_data.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-					sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-					currency=erpnext.get_company_currency(sle.company), company=sle.company)
+				self.wh_data.valuation_rate = self.get_valuation_rate_from_ledger(sle)
 
 	def get_incoming_value_for_serial_nos(self, sle, serial_nos):
+		self.update_sle_in_db()
+
 		# get rate from serial nos within same company
 		all_serial_nos = frappe.get_all("Serial No",
 			fields=["purchase_rate", "name", "company"],
@@ -663,9 +1037,7 @@ class update_entries_after(object):
 			if not self.wh_data.valuation_rate and sle.voucher_detail_no:
 				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 				if not allow_zero_valuation_rate:
-					self.wh_data.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-						sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-						currency=erpnext.get_company_currency(sle.company), company=sle.company)
+					self.wh_data.valuation_rate = self.get_valuation_rate_from_ledger(sle)
 
 	def get_fifo_values(self, sle):
 		incoming_rate = flt(sle.incoming_rate)
@@ -696,9 +1068,7 @@ class update_entries_after(object):
 					# Get valuation rate from last sle if exists or from valuation rate field in item master
 					allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 					if not allow_zero_valuation_rate:
-						_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-							sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-							currency=erpnext.get_company_currency(sle.company), company=sle.company)
+						_rate = self.get_valuation_rate_from_ledger(sle)
 					else:
 						_rate = 0
 
@@ -748,6 +1118,13 @@ class update_entries_after(object):
 		if not self.wh_data.stock_queue:
 			self.wh_data.stock_queue.append([0, sle.incoming_rate or sle.outgoing_rate or self.wh_data.valuation_rate])
 
+	def get_valuation_rate_from_ledger(self, sle):
+		# last valuation rate is read from the ledger, write back pending entries first
+		self.update_sle_in_db()
+		return get_valuation_rate(sle.item_code, sle.warehouse,
+			sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
+			currency=erpnext.get_company_currency(sle.company), company=sle.company)
+
 	def check_if_allow_zero_valuation_rate(self, voucher_type, voucher_detail_no):
 		ref_item_dt = ""
 
@@ -811,29 +1188,58 @@ class update_entries_after(object):
 			})
 
 
+class VoucherValuation(update_entries_after):
+	"""
+		Values the new entries of an item-warehouse in memory from its previous entry, in the
+		same way as `update_entries_after` values the entries of the current voucher, without
+		reading or writing the ledger.
+	"""
+	def __init__(self, item_code, warehouse, previous_sle, valuation_method, precision,
+		stock_queue_format, allow_negative_stock=False):
+		self.exceptions = {}
+		self.verbose = 1
+		self.allow_zero_rate = False
+		self.via_landed_cost_voucher = False
+		self.allow_negative_stock = allow_negative_stock
+
+		# rates are given by the voucher, as for the entries of the current voucher
+		self.args = frappe._dict({"item_code": item_code, "warehouse": warehouse, "sle_id": True})
+		self.item_code = item_code
+		self.valuation_method = valuation_method
+		self.precision = precision
+		self.stock_queue_format = stock_queue_format
+
+		self.sle_to_update = {}
+		self.entries_processed = 0
+		self.data = frappe._dict()
+		self.initialize_previous_data(self.args, frappe._dict({"previous_sle": frappe._dict(previous_sle or {})}))
+
+
 def get_previous_sle_of_current_voucher(args, exclude_current_voucher=False):
 	"""get stock ledger entries filtered by specific posting datetime conditions"""
 
-	args['time_format'] = '%H:%i:%s'
 	if not args.get("posting_date"):
 		args["posting_date"] = "1900-01-01"
 	if not args.get("posting_time"):
 		args["posting_time"] = "00:00"
 
+	# entries posted before the second of the posting time
+	args["from_datetime"] = get_combine_datetime(args["posting_date"], args["posting_time"]).replace(microsecond=0)
+
 	voucher_condition = ""
 	if exclude_current_voucher:
 		voucher_no = args.get("voucher_no")
 		voucher_condition = f"and voucher_no != '{voucher_no}'"
 
 	sle = frappe.db.sql("""
-		select *, timestamp(posting_date, posting_time) as "timestamp"
+		select *, posting_datetime as "timestamp"
 		from `tabStock Ledger Entry`
 		where item_code = %(item_code)s
 			and warehouse = %(warehouse)s
 			and is_cancelled = 0
 			{voucher_condition}
-			and timestamp(posting_date, time_format(posting_time, %(time_format)s)) < timestamp(%(posting_date)s, time_format(%(posting_time)s, %(time_format)s))
-		order by timestamp(posting_date, posting_time) desc, creation desc
+			and posting_datetime < %(from_datetime)s
+		order by posting_datetime desc, creation desc
 		limit 1
 		for update""".format(voucher_condition=voucher_condition), args, as_dict=1)
 
@@ -854,13 +1260,73 @@ def get_previous_sle(args, for_update=False):
 		}
 	"""
 	args["name"] = args.get("sle", None) or ""
+
+	# memoize plain item-warehouse lookups, they are repeated for every row of a transaction
+	key = None
+	if not for_update and args.get("warehouse") and not args.get("serial_no"):
+		key = (args.get("item_code"), args.get("warehouse"), get_combine_datetime(
+			args.get("posting_date") or "1900-01-01", args.get("posting_time") or "00:00").replace(microsecond=0),
+			args["name"])
+
+		cache = get_previous_sle_cache()
+		if key in cache:
+			return frappe._dict(cache[key]) if cache[key] else {}
+
 	sle = get_stock_ledger_entries(args, "<=", "desc", "limit 1", for_update=for_update)
-	return sle and sle[0] or {}
+	sle = sle and sle[0] or {}
+
+	if key:
+		cache[key] = sle
+		return frappe._dict(sle) if sle else {}
+
+	return sle
+
+def get_previous_sle_for_item_warehouses(item_warehouses, posting_date, posting_time):
+	"""
+		Last entry on or before the posting datetime of each item-warehouse, with a windowed
+		query per 1000 item-warehouses. The entries are memoized for `get_previous_sle`.
+
+		Returns {(item_code, warehouse): sle}
+	"""
+	posting_datetime = get_combine_datetime(posting_date or "1900-01-01", posting_time or "00:00")
+	item_warehouses = list(dict.fromkeys(item_warehouses))
+	cache = get_previous_sle_cache()
+
+	previous_sle = {}
+	for i in range(0, len(item_warehouses), 1000):
+		chunk = item_warehouses[i:i + 1000]
+		keys = set(chunk)
+
+		for sle in frappe.db.sql("""
+			select * from (
+				select *, posting_datetime as "timestamp",
+					row_number() over (partition by item_code, warehouse
+						order by posting_datetime desc, creation desc) as row_no
+				from `tabStock Ledger Entry`
+				where is_cancelled = 0
+					and item_code in %(item_codes)s
+					and warehouse in %(warehouses)s
+					and posting_datetime <= %(posting_datetime)s
+			) sle
+			where row_no = 1""", {
+				"item_codes": list({d[0] for d in chunk}),
+				"warehouses": list({d[1] for d in chunk}),
+				"posting_datetime": posting_datetime
+			}, as_dict=1):
+			if (sle.item_code, sle.warehouse) in keys:
+				del sle["row_no"]
+				previous_sle[(sle.item_code, sle.warehouse)] = sle
+
+		for item_code, warehouse in chunk:
+			cache[(item_code, warehouse, posting_datetime.replace(microsecond=0), "")] = \
+				previous_sle.get((item_code, warehouse)) or {}
+
+	return previous_sle
 
 def get_stock_ledger_entries(previous_sle, operator=None,
 	order="desc", limit=None, for_update=False, debug=False, check_serial_no=True):
 	"""get stock ledger entries filtered by specific posting datetime conditions"""
-	conditions = " and timestamp(posting_date, posting_time) {0} timestamp(%(posting_date)s, %(posting_time)s)".format(operator)
+	conditions = " and posting_datetime {0} %(posting_datetime)s".format(operator)
 	if previous_sle.get("warehouse"):
 		conditions += " and warehouse = %(warehouse)s"
 	elif previous_sle.get("warehouse_condition"):
@@ -884,16 +1350,19 @@ def get_stock_ledger_entries(previous_sle, operator=None,
 	if not previous_sle.get("posting_time"):
 		previous_sle["posting_time"] = "00:00"
 
+	previous_sle["posting_datetime"] = get_combine_datetime(previous_sle["posting_date"],
+		previous_sle["posting_time"])
+
 	if operator in (">", "<=") and previous_sle.get("name"):
 		conditions += " and name!=%(name)s"
 
 	return frappe.db.sql("""
-		select *, timestamp(posting_date, posting_time) as "timestamp"
+		select *, posting_datetime as "timestamp"
 		from `tabStock Ledger Entry`
 		where item_code = %%(item_code)s
 		and is_cancelled = 0
 		%(conditions)s
-		order by timestamp(posting_date, posting_time) %(order)s, creation %(order)s
+		order by posting_datetime %(order)s, creation %(order)s
 		%(limit)s %(for_update)s""" % {
 			"conditions": conditions,
 			"limit": limit or "",
@@ -904,7 +1373,7 @@ def get_stock_ledger_entries(previous_sle, operator=None,
 def get_sle_by_voucher_detail_no(voucher_detail_no, excluded_sle=None):
 	return frappe.db.get_value('Stock Ledger Entry',
 		{'voucher_detail_no': voucher_detail_no, 'name': ['!=', excluded_sle]},
-		['item_code', 'warehouse', 'posting_date', 'posting_time', 'timestamp(posting_date, posting_time) as timestamp'],
+		['item_code', 'warehouse', 'posting_date', 'posting_time', 'posting_datetime as timestamp'],
 		as_dict=1)
 
 def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
@@ -983,6 +1452,7 @@ def update_qty_in_future_sle(args, allow_negative_stock=False):
 		# add condition to update SLEs before this date & time
 		datetime_limit_condition = get_datetime_limit_condition(detail)
 
+	args.posting_datetime = get_combine_datetime(args.posting_date, args.posting_time)
 	frappe.db.sql("""
 		update `tabStock Ledger Entry`
 		set qty_after_transaction = qty_after_transaction + {qty_shift}
@@ -991,15 +1461,16 @@ def update_qty_in_future_sle(args, allow_negative_stock=False):
 			and warehouse = %(warehouse)s
 			and voucher_no != %(voucher_no)s
 			and is_cancelled = 0
-			and (timestamp(posting_date, posting_time) > timestamp(%(posting_date)s, %(posting_time)s)
+			and (posting_datetime > %(posting_datetime)s
 				or (
-					timestamp(posting_date, posting_time) = timestamp(%(posting_date)s, %(posting_time)s)
+					posting_datetime = %(posting_datetime)s
 					and creation > %(creation)s
 				)
 			)
 		{datetime_limit_condition}
 		""".format(qty_shift=qty_shift, datetime_limit_condition=datetime_limit_condition), args)
 
+	clear_previous_sle_cache()
 	validate_negative_qty_in_future_sle(args, allow_negative_stock)
 
 def get_stock_reco_qty_shift(args):
@@ -1025,10 +1496,11 @@ def get_stock_reco_qty_shift(args):
 
 def get_next_stock_reco(args):
 	"""Returns next nearest stock reconciliaton's details."""
+	args.posting_datetime = get_combine_datetime(args.posting_date, args.posting_time)
 
 	return frappe.db.sql("""
 		select
-			name, posting_date, posting_time, creation, voucher_no
+			name, posting_date, posting_time, posting_datetime, creation, voucher_no
 		from
 			`tabStock Ledger Entry`
 		where
@@ -1037,9 +1509,9 @@ def get_next_stock_reco(args):
 			and voucher_type = 'Stock Reconciliation'
 			and voucher_no != %(voucher_no)s
 			and is_cancelled = 0
-			and (timestamp(posting_date, posting_time) > timestamp(%(posting_date)s, %(posting_time)s)
+			and (posting_datetime > %(posting_datetime)s
 				or (
-					timestamp(posting_date, posting_time) = timestamp(%(posting_date)s, %(posting_time)s)
+					posting_datetime = %(posting_datetime)s
 					and creation > %(creation)s
 				)
 			)
@@ -1049,9 +1521,9 @@ def get_next_stock_reco(args):
 def get_datetime_limit_condition(detail):
 	return f"""
 		and
-		(timestamp(posting_date, posting_time) < timestamp('{detail.posting_date}', '{detail.posting_time}')
+		(posting_datetime < '{detail.posting_datetime}'
 			or (
-				timestamp(posting_date, posting_time) = timestamp('{detail.posting_date}', '{detail.posting_time}')
+				posting_datetime = '{detail.posting_datetime}'
 				and creation < '{detail.creation}'
 			)
 		)"""
@@ -1082,10 +1554,10 @@ def get_future_sle_with_negative_qty(args):
 			item_code = %(item_code)s
 			and warehouse = %(warehouse)s
 			and voucher_no != %(voucher_no)s
-			and timestamp(posting_date, posting_time) >= timestamp(%(posting_date)s, %(posting_time)s)
+			and posting_datetime >= %(posting_datetime)s
 			and is_cancelled = 0
 			and qty_after_transaction < 0
-		order by timestamp(posting_date, posting_time) asc
+		order by posting_datetime asc
 		limit 1
 	""", args, as_dict=1)
 
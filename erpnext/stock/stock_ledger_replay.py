@@ -0,0 +1,191 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+"""
+	Streaming reader and replay of stock ledger entries for the stock reports.
+
+	`StockLedgerReader` streams the selected columns of the entries from the database and
+	`replay` feeds every entry once to any number of aggregators, each building its own
+	result: balances, FIFO ageing slots, period balances, batch balances.
+"""
+
+import frappe
+from frappe.utils import cint, flt, getdate
+
+from erpnext.stock.utils import iterate_sql
+
+
+class StockLedgerReader:
+	"""
+		Stock Ledger Entries (aliased as `sle`) with only the given columns, streamed with a
+		server side cursor. No other query can be run while the entries are being read.
+	"""
+	def __init__(self, fields, conditions="", values=None, joins="", group_by=None,
+		order_by="sle.posting_date, sle.posting_time, sle.creation", force_index=None):
+		self.fields = fields
+		self.conditions = conditions
+		self.values = values
+		self.joins = joins
+		self.group_by = group_by
+		self.order_by = order_by
+		self.force_index = force_index
+
+	def get_query(self):
+		return """
+			select {fields}
+			from `tabStock Ledger Entry` sle {force_index} {joins}
+			where sle.docstatus < 2 {conditions}
+			{group_by}
+			{order_by}""".format( #nosec
+			fields=", ".join(self.fields),
+			force_index="force index ({0})".format(self.force_index) if self.force_index else "",
+			joins=self.joins,
+			conditions=self.conditions,
+			group_by="group by {0}".format(self.group_by) if self.group_by else "",
+			order_by="order by {0}".format(self.order_by) if self.order_by else "")
+
+	def __iter__(self):
+		return iterate_sql(self.get_query(), self.values)
+
+def replay(entries, *aggregators):
+	"""Feed the entries in order to all aggregators and return their results"""
+	for sle in entries:
+		for aggregator in aggregators:
+			aggregator.update(sle)
+
+	results = [aggregator.get_result() for aggregator in aggregators]
+	return results[0] if len(results) == 1 else results
+
+class SLEAggregator:
+	"""Base of the aggregators, `update` is called for every entry in posting order"""
+	def update(self, sle):
+		raise NotImplementedError
+
+	def get_result(self):
+		raise NotImplementedError
+
+class BalanceAggregator(SLEAggregator):
+	"""
+		Opening, in, out and closing qty and value per (company, item, warehouse) for a period.
+		The opening stock reconciliations on the from date count in the opening balance.
+	"""
+	def __init__(self, from_date, to_date, opening_stock_vouchers=None):
+		self.from_date = getdate(from_date)
+		self.to_date = getdate(to_date)
+		self.opening_stock_vouchers = opening_stock_vouchers or set()
+		self.float_precision = cint(frappe.db.get_default("float_precision")) or 3
+		self.balances = {}
+
+	def update(self, d):
+		key = (d.company, d.item_code, d.warehouse)
+		if key not in self.balances:
+			self.balances[key] = frappe._dict({
+				"opening_qty": 0.0, "opening_val": 0.0,
+				"in_qty": 0.0, "in_val": 0.0,
+				"out_qty": 0.0, "out_val": 0.0,
+				"bal_qty": 0.0, "bal_val": 0.0,
+				"val_rate": 0.0
+			})
+
+		qty_dict = self.balances[key]
+
+		if d.voucher_type == "Stock Reconciliation" and not d.batch_no:
+			qty_diff = flt(d.qty_after_transaction) - flt(qty_dict.bal_qty)
+		else:
+			qty_diff = flt(d.actual_qty)
+
+		value_diff = flt(d.stock_value_difference)
+
+		if d.posting_date < self.from_date or (d.posting_date == self.from_date
+			and d.voucher_type == "Stock Reconciliation" and d.voucher_no in self.opening_stock_vouchers):
+			qty_dict.opening_qty += qty_diff
+			qty_dict.opening_val += value_diff
+
+		elif d.posting_date >= self.from_date and d.posting_date <= self.to_date:
+			if flt(qty_diff, self.float_precision) >= 0:
+				qty_dict.in_qty += qty_diff
+				qty_dict.in_val += value_diff
+			else:
+				qty_dict.out_qty += abs(qty_diff)
+				qty_dict.out_val += abs(value_diff)
+
+		qty_dict.val_rate = d.valuation_rate
+		qty_dict.bal_qty += qty_diff
+		qty_dict.bal_val += value_diff
+
+	def get_result(self):
+		"""Balances rounded to the float precision, without the ones with no transactions"""
+		for key in sorted(self.balances):
+			qty_dict = self.balances[key]
+
+			no_transactions = True
+			for fieldname, val in qty_dict.items():
+				val = flt(val, self.float_precision)
+				qty_dict[fieldname] = val
+				if fieldname != "val_rate" and val:
+					no_transactions = False
+
+			if no_transactions:
+				self.balances.pop(key)
+
+		return self.balances
+
+class PeriodBalanceAggregator(SLEAggregator):
+	"""
+		Balance qty or value per item, period and warehouse at the end of each period with entries,
+		with the balance carried over from the previous period.
+	"""
+	def __init__(self, get_period, value_field="qty"):
+		self.get_period = get_period
+		self.value_field = value_field
+		self.periodic_data = {}
+
+	def update(self, d):
+		period = self.get_period(d.posting_date)
+		item_data = self.periodic_data.setdefault(d.item_code, {})
+		balance = item_data.setdefault("balance", {})
+
+		# carry the balance over to a new period
+		if period not in item_data:
+			item_data[period] = balance.copy()
+
+		if d.voucher_type == "Stock Reconciliation":
+			qty_diff = d.qty_after_transaction - balance.get(d.warehouse, 0)
+		else:
+			qty_diff = d.actual_qty
+
+		value = qty_diff if self.value_field == "qty" else d.stock_value_difference
+
+		balance[d.warehouse] = balance.get(d.warehouse, 0.0) + value
+		item_data[period][d.warehouse] = balance[d.warehouse]
+
+	def get_result(self):
+		return self.periodic_data
+
+class BatchBalanceAggregator(SLEAggregator):
+	"""Opening, in, out and closing qty per item, warehouse and batch for a period"""
+	def __init__(self, from_date, to_date, float_precision):
+		self.from_date = getdate(from_date)
+		self.to_date = getdate(to_date)
+		self.float_precision = float_precision
+		self.balances = {}
+
+	def update(self, d):
+		precision = self.float_precision
+		qty_dict = self.balances.setdefault(d.item_code, {}).setdefault(d.warehouse, {})\
+			.setdefault(d.batch_no, frappe._dict({
+				"opening_qty": 0.0, "in_qty": 0.0, "out_qty": 0.0, "bal_qty": 0.0
+			}))
+
+		if d.posting_date < self.from_date:
+			qty_dict.opening_qty = flt(qty_dict.opening_qty, precision) + flt(d.actual_qty, precision)
+		elif d.posting_date >= self.from_date and d.posting_date <= self.to_date:
+			if flt(d.actual_qty) > 0:
+				qty_dict.in_qty = flt(qty_dict.in_qty, precision) + flt(d.actual_qty, precision)
+			else:
+				qty_dict.out_qty = flt(qty_dict.out_qty, precision) + abs(flt(d.actual_qty, precision))
+
+		qty_dict.bal_qty = flt(qty_dict.bal_qty, precision) + flt(d.actual_qty, precision)
+
+	def get_result(self):
+		return self.balances
@@ -0,0 +1,77 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+"""
+Codecs for the FIFO stock queue stored in `tabStock Ledger Entry`.stock_queue
+
+JSON: human readable list of [qty, rate] pairs, the default.
+Compact: [qty, rate] pairs packed as little-endian float64, deflated and base64 encoded.
+	About half the size of JSON and faster to encode for queues with many lots.
+
+Decoding detects the format from the stored value, so both can coexist in the ledger.
+"""
+
+import base64
+import json
+import struct
+import zlib
+
+import frappe
+
+JSON_FORMAT = "JSON"
+COMPACT_FORMAT = "Compact"
+COMPACT_PREFIX = "z:"
+
+
+def get_stock_queue_format():
+	return frappe.db.get_single_value("Stock Settings", "stock_queue_format", cache=True) or JSON_FORMAT
+
+def encode_stock_queue(stock_queue, queue_format=None):
+	"""Returns the stock queue (list of [qty, rate]) as text in the given or configured format"""
+	if (queue_format or get_stock_queue_format()) != COMPACT_FORMAT:
+		return json.dumps(stock_queue)
+
+	values = [float(v) for lot in stock_queue for v in lot]
+	packed = struct.pack("<%dd" % len(values), *values)
+
+	return COMPACT_PREFIX + base64.b64encode(zlib.compress(packed, 1)).decode()
+
+def decode_stock_queue(value):
+	"""Returns the stock queue as a list of [qty, rate] from text in any of the formats"""
+	if not value:
+		return []
+
+	if not value.startswith(COMPACT_PREFIX):
+		return json.loads(value)
+
+	packed = zlib.decompress(base64.b64decode(value[len(COMPACT_PREFIX):]))
+	values = struct.unpack("<%dd" % (len(packed) // 8), packed)
+
+	return [[qty, rate] for qty, rate in zip(values[0::2], values[1::2])]
+
+def convert_stock_queue(queue_format=None, chunk_size=10000):
+	"""Re-encode the stock queue of all the stock ledger entries into the given or configured format"""
+	queue_format = queue_format or get_stock_queue_format()
+	if queue_format == COMPACT_FORMAT:
+		condition = "stock_queue not like 'z:%%'"
+	else:
+		condition = "stock_queue like 'z:%%'"
+
+	last_name = ""
+	while True:
+		sl_entries = frappe.db.sql("""
+			select name, stock_queue
+			from `tabStock Ledger Entry`
+			where name > %s and stock_queue is not null and stock_queue != '' and {0}
+			order by name
+			limit %s""".format(condition), (last_name, chunk_size), as_dict=1)
+
+		if not sl_entries:
+			break
+
+		for sle in sl_entries:
+			frappe.db.sql("update `tabStock Ledger Entry` set stock_queue = %s where name = %s",
+				(encode_stock_queue(decode_stock_queue(sle.stock_queue), queue_format), sle.name))
+
+		last_name = sl_entries[-1].name
+		frappe.db.commit()
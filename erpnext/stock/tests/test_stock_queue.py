@@ -0,0 +1,39 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+import json
+import random
+import unittest
+
+from erpnext.stock.stock_queue import (
+	COMPACT_FORMAT,
+	JSON_FORMAT,
+	decode_stock_queue,
+	encode_stock_queue,
+)
+
+
+class TestStockQueue(unittest.TestCase):
+	def test_round_trip(self):
+		stock_queue = [[10, 100], [2.5, 101.25], [-3, 0]]
+
+		for queue_format in (JSON_FORMAT, COMPACT_FORMAT):
+			value = encode_stock_queue(stock_queue, queue_format)
+			self.assertEqual(decode_stock_queue(value), stock_queue, msg=queue_format)
+
+	def test_decode_empty_and_legacy_values(self):
+		self.assertEqual(decode_stock_queue(None), [])
+		self.assertEqual(decode_stock_queue(""), [])
+		self.assertEqual(decode_stock_queue("[[1, 10]]"), [[1, 10]])
+		self.assertEqual(decode_stock_queue(encode_stock_queue([], COMPACT_FORMAT)), [])
+
+	def test_large_queue(self):
+		stock_queue = [[float(random.randint(1, 50)), round(random.uniform(10, 500), 2)]
+			for i in range(10000)]
+
+		json_value = encode_stock_queue(stock_queue, JSON_FORMAT)
+		compact_value = encode_stock_queue(stock_queue, COMPACT_FORMAT)
+
+		self.assertEqual(json.loads(json_value), stock_queue)
+		self.assertEqual(decode_stock_queue(compact_value), stock_queue)
+		self.assertLess(len(compact_value), len(json_value))
@@ -2,13 +2,15 @@
 # License: GNU General Public License v3. See license.txt
 
 
+import datetime
 import json
 
 import frappe
 from frappe import _
-from frappe.utils import cstr, flt, get_link_to_form, nowdate, nowtime
+from frappe.utils import cstr, flt, get_link_to_form, get_time, getdate, nowdate, nowtime
 
 import erpnext
+from erpnext.stock.stock_queue import decode_stock_queue
 
 
 class InvalidWarehouseCompany(frappe.ValidationError): pass
@@ -66,7 +68,7 @@ def get_stock_value_on(warehouse=None, posting_date=None, item_code=None):
 		FROM `tabStock Ledger Entry` sle
 		WHERE posting_date <= %s {0}
 			and is_cancelled = 0
-		ORDER BY timestamp(posting_date, posting_time) DESC, creation DESC
+		ORDER BY posting_datetime DESC, creation DESC
 	""".format(condition), values, as_dict=1)
 
 	sle_map = {}
@@ -109,12 +111,9 @@ def get_stock_balance(item_code, warehouse, posting_date=None, posting_time=None
 		return last_entry.qty_after_transaction if last_entry else 0.0
 
 def get_serial_nos_data_after_transactions(args):
-	from pypika import CustomFunction
-
 	serial_nos = set()
 	args = frappe._dict(args)
 	sle = frappe.qb.DocType('Stock Ledger Entry')
-	Timestamp = CustomFunction('timestamp', ['date', 'time'])
 
 	stock_ledger_entries = frappe.qb.from_(
 		sle
@@ -123,10 +122,10 @@ def get_serial_nos_data_after_transactions(args):
 	).where(
 		(sle.item_code == args.item_code)
 		& (sle.warehouse == args.warehouse)
-		& (Timestamp(sle.posting_date, sle.posting_time) < Timestamp(args.posting_date, args.posting_time))
+		& (sle.posting_datetime < get_combine_datetime(args.posting_date, args.posting_time))
 		& (sle.is_cancelled == 0)
 	).orderby(
-		sle.posting_date, sle.posting_time, sle.creation
+		sle.posting_datetime, sle.creation
 	).run(as_dict=1)
 
 	for stock_ledger_entry in stock_ledger_entries:
@@ -138,6 +137,10 @@ def get_serial_nos_data_after_transactions(args):
 
 	return '\n'.join(serial_nos)
 
+def get_combine_datetime(posting_date, posting_time):
+	"""Posting date and time of a stock transaction as stored in `posting_datetime` of the ledger"""
+	return datetime.datetime.combine(getdate(posting_date), get_time(posting_time))
+
 def get_serial_nos_data(serial_nos):
 	from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
 	return get_serial_nos(serial_nos)
@@ -226,7 +229,7 @@ def get_incoming_rate(args, raise_error_if_no_rate=True):
 		previous_sle = get_previous_sle(args)
 		if valuation_method == 'FIFO':
 			if previous_sle:
-				previous_stock_queue = json.loads(previous_sle.get('stock_queue', '[]') or '[]')
+				previous_stock_queue = decode_stock_queue(previous_sle.get('stock_queue'))
 				in_rate = get_fifo_rate(previous_stock_queue, args.get("qty") or 0) if previous_stock_queue else 0
 		elif valuation_method == 'Moving Average':
 			in_rate = previous_sle.get('valuation_rate') or 0
@@ -416,3 +419,27 @@ def is_reposting_item_valuation_in_progress():
 		{'docstatus': 1, 'status': ['in', ['Queued','In Progress']]})
 	if reposting_in_progress:
 		frappe.msgprint(_("Item valuation reposting in progress. Report might show incorrect item valuation."), alert=1)
+
+def iterate_sql(query, values=None):
+	"""
+		Yields the rows of the query as dicts, streamed from the server with an unbuffered
+		cursor on MariaDB so that large results are not held in memory.
+		No other query can be run on the connection until the iteration is over.
+	"""
+	if frappe.db.db_type != "mariadb":
+		yield from frappe.db.sql(query, values, as_dict=1)
+		return
+
+	from pymysql.cursors import SSCursor
+
+	if not frappe.db._conn:
+		frappe.db.connect()
+
+	cursor = frappe.db._conn.cursor(SSCursor)
+	try:
+		cursor.execute(query, values)
+		columns = [column[0] for column in cursor.description]
+		for row in cursor:
+			yield frappe._dict(zip(columns, row))
+	finally:
+		cursor.close()
@@ -0,0 +1,66 @@
+# Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and contributors
+# License: GNU General Public License v3. See license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import cstr
+
+# wildcard hooks of erpnext that do nothing for ledger entries, SLAs only apply to the documents
+# they are set up for
+IGNORED_WILDCARD_HOOKS = (
+	"erpnext.support.doctype.service_level_agreement.service_level_agreement.apply",
+)
+
+
+def has_doc_event_hooks(doctype):
+	"""
+		Returns True if apps hook into the document events of the doctype, directly or with the
+		`*` wildcard. Ledger entries made in bulk do not run the document events.
+	"""
+	doc_events = frappe.get_hooks("doc_events")
+	if doc_events.get(doctype):
+		return True
+
+	for handlers in (doc_events.get("*") or {}).values():
+		if isinstance(handlers, str):
+			handlers = [handlers]
+
+		if any(handler not in IGNORED_WILDCARD_HOOKS for handler in handlers):
+			return True
+
+	return False
+
+def validate_mandatory_and_links(docs):
+	"""
+		The mandatory and link validations of `Document.insert` for documents of the same doctype
+		inserted in bulk, with one query per linked doctype
+	"""
+	if not docs:
+		return
+
+	for doc in docs:
+		doc._validate_mandatory()
+
+	meta = frappe.get_meta(docs[0].doctype)
+	names = {}
+	for df in meta.get_link_fields() + meta.get_dynamic_link_fields():
+		for doc in docs:
+			value = doc.get(df.fieldname)
+			if not value:
+				continue
+
+			doctype = df.options if df.fieldtype == "Link" else doc.get(df.options)
+			if doctype:
+				names.setdefault(doctype, {}).setdefault(cstr(value), df)
+
+	for doctype, values in names.items():
+		if frappe.get_meta(doctype).issingle:
+			existing = {doctype.lower()}
+		else:
+			existing = {cstr(name).lower() for name in frappe.get_all(doctype,
+				filters={"name": ("in", list(values))}, pluck="name")}
+
+		for value, df in values.items():
+			if value.lower() not in existing:
+				frappe.throw(_("Could not find {0}: {1}").format(_(df.label), value),
+					frappe.LinkValidationError, title=_("Invalid Link"))